@@ -5,6 +5,9 @@
 #include <chrono>
 #include <filesystem>
 #include <atomic>
+#include <vector>
+#include <sstream>
+#include <cstdint>
 #include <openssl/ssl.h>
 #include <openssl/err.h>
 #include <openssl/sha.h>
@@ -34,33 +37,77 @@ void initSSL()
 }
 
 // ========== SHA256 ==========
+// Must match HASH_SEGMENT_SIZE on the server.
+const long long HASH_SEGMENT_SIZE = 64LL * 1024 * 1024;
+
+string toHex(const unsigned char *hash, unsigned int len)
+{
+    string hex;
+    char tmp[3];
+    for (unsigned int i = 0; i < len; i++)
+    {
+        sprintf(tmp, "%02x", hash[i]);
+        hex += tmp;
+    }
+    return hex;
+}
+
+// "<sha256> <tree>": tree is sha256 over the digests of each
+// HASH_SEGMENT_SIZE segment, so the server can verify a resumed upload
+// from its checkpoints without rereading the whole file.
 string sha256file(const string &path)
 {
     ifstream f(path, ios::binary);
 
     EVP_MD_CTX *ctx = EVP_MD_CTX_new();
+    EVP_MD_CTX *seg = EVP_MD_CTX_new();
+    EVP_MD_CTX *tree = EVP_MD_CTX_new();
     const EVP_MD *md = EVP_sha256();
     EVP_DigestInit_ex(ctx, md, NULL);
+    EVP_DigestInit_ex(seg, md, NULL);
+    EVP_DigestInit_ex(tree, md, NULL);
+
+    unsigned char hash[EVP_MAX_MD_SIZE];
+    unsigned int len = 0;
+    long long segUsed = 0;
 
     char buf[4096];
     while (f.read(buf, sizeof(buf)) || f.gcount() > 0)
     {
-        EVP_DigestUpdate(ctx, buf, f.gcount());
+        long long n = f.gcount();
+        EVP_DigestUpdate(ctx, buf, n);
+
+        long long off = 0;
+        while (off < n)
+        {
+            long long part = min(n - off, HASH_SEGMENT_SIZE - segUsed);
+            EVP_DigestUpdate(seg, buf + off, part);
+            segUsed += part;
+            off += part;
+            if (segUsed == HASH_SEGMENT_SIZE)
+            {
+                EVP_DigestFinal_ex(seg, hash, &len);
+                EVP_DigestUpdate(tree, hash, len);
+                EVP_DigestInit_ex(seg, md, NULL);
+                segUsed = 0;
+            }
+        }
+    }
+    if (segUsed > 0)
+    {
+        EVP_DigestFinal_ex(seg, hash, &len);
+        EVP_DigestUpdate(tree, hash, len);
     }
 
-    unsigned char hash[EVP_MAX_MD_SIZE];
-    unsigned int len = 0;
     EVP_DigestFinal_ex(ctx, hash, &len);
-    EVP_MD_CTX_free(ctx);
+    string full = toHex(hash, len);
+    EVP_DigestFinal_ex(tree, hash, &len);
+    string treeHex = toHex(hash, len);
 
-    string hex;
-    char tmp[3];
-    for (unsigned int i = 0; i < len; i++)
-    {
-        sprintf(tmp, "%02x", hash[i]);
-        hex += tmp;
-    }
-    return hex;
+    EVP_MD_CTX_free(ctx);
+    EVP_MD_CTX_free(seg);
+    EVP_MD_CTX_free(tree);
+    return full + " " + treeHex;
 }
 
 // ========== UNIQUE NAME ==========
@@ -80,6 +127,324 @@ string getUniqueFilename(const string &dir, const string &filename)
     return fullPath.filename().string();
 }
 
+// ========== CONNECT ==========
+int connectServer(const string &host, int port)
+{
+    int sock = socket(AF_INET, SOCK_STREAM, 0);
+
+    sockaddr_in server{};
+    server.sin_family = AF_INET;
+    server.sin_port = htons(port);
+
+#ifdef _WIN32
+    inet_pton(AF_INET, host.c_str(), &(server.sin_addr));
+#else
+    inet_pton(AF_INET, host.c_str(), &server.sin_addr);
+#endif
+
+    connect(sock, (sockaddr *)&server, sizeof(server));
+    return sock;
+}
+
+// ========== TLS SESSION RESUMPTION ==========
+// Session (TLS 1.3 ticket) from the login connection. Extra connections,
+// such as the parallel upload streams, present it and skip the server's
+// certificate signature; the server falls back to a full handshake when
+// the ticket has expired or its keys were rotated.
+SSL_SESSION *resumeSession = nullptr;
+
+void keepSession(SSL *ssl)
+{
+    SSL_SESSION *session = SSL_get1_session(ssl);
+    if (!session)
+        return;
+    if (resumeSession)
+        SSL_SESSION_free(resumeSession);
+    resumeSession = session;
+}
+
+void closeSocket(int sock)
+{
+#ifdef _WIN32
+    closesocket(sock);
+#else
+    close(sock);
+#endif
+}
+
+string readLine(SSL *ssl)
+{
+    string line;
+    char c;
+    while (SSL_read(ssl, &c, 1) == 1 && c != '\n')
+        line += c;
+    return line;
+}
+
+// ========== PARALLEL UPLOAD ==========
+const int UPLOAD_STREAMS = 4;
+
+bool isRangesHeader(const string &msg)
+{
+    // "RANGES <file_id> <token> <range_size> <streams>", not "RANGES DONE"
+    return msg.rfind("RANGES ", 0) == 0 && msg.size() > 7 && isdigit((unsigned char)msg[7]);
+}
+
+// One data connection: sends every RANGE the server hands out until END.
+void streamRanges(SSL_CTX *ctx, const string &host, int port, const string &hello,
+                  const string &path, atomic<long long> &sent, atomic<int> &running)
+{
+    int sock = connectServer(host, port);
+    SSL *ssl = SSL_new(ctx);
+    SSL_set_fd(ssl, sock);
+    if (resumeSession)
+        SSL_set_session(ssl, resumeSession);
+    if (SSL_connect(ssl) == 1)
+    {
+        SSL_write(ssl, hello.c_str(), hello.size());
+
+        ifstream file(path, ios::binary);
+        vector<char> chunk(256 * 1024);
+        while (true)
+        {
+            istringstream line(readLine(ssl));
+            string word;
+            long long index, start, length;
+            if (!(line >> word >> index >> start >> length) || word != "RANGE")
+                break; // END, or the server gave up on this stream
+
+            file.clear();
+            file.seekg(start);
+            long long left = length;
+            while (left > 0)
+            {
+                file.read(chunk.data(), min((long long)chunk.size(), left));
+                streamsize n = file.gcount();
+                if (n <= 0 || SSL_write(ssl, chunk.data(), n) <= 0)
+                    break;
+                left -= n;
+                sent += n;
+            }
+            if (left > 0)
+                break;
+        }
+        SSL_shutdown(ssl);
+    }
+    SSL_free(ssl);
+    closeSocket(sock);
+    running--;
+}
+
+// Serves a RANGES reply over parallel connections, then finishes the upload
+// on the control connection with the usual CHECKSUM line.
+bool uploadRanges(SSL *ssl, SSL_CTX *ctx, const string &host, int port,
+                  const string &header, const string &path, const string &checksum)
+{
+    istringstream in(header);
+    string word, fileId, token;
+    long long rangeSize;
+    int streams;
+    in >> word >> fileId >> token >> rangeSize >> streams;
+
+    long long size = fs::file_size(path);
+    string hello = "STREAM " + fileId + " " + token + "\n";
+    atomic<long long> sent(0);
+    atomic<int> running(streams);
+
+    vector<thread> workers;
+    for (int i = 0; i < streams; i++)
+        workers.emplace_back(streamRanges, ctx, host, port, hello, path, ref(sent), ref(running));
+
+    while (running > 0)
+    {
+        // only ranges still missing on the server are sent, so this is a floor
+        cout << "\r⏳ Uploading (" << streams << " streams)... "
+             << (size ? sent * 100 / size : 100) << "%";
+        cout.flush();
+        this_thread::sleep_for(chrono::milliseconds(200));
+    }
+    for (auto &w : workers)
+        w.join();
+
+    string done = readLine(ssl);
+    cout << "\n[SERVER] " << done << endl;
+    if (done != "RANGES DONE")
+        return false;
+
+    string msg_ck = "CHECKSUM " + checksum + "\n";
+    SSL_write(ssl, msg_ck.c_str(), msg_ck.size());
+    return true;
+}
+
+// ========== CHUNKED UPLOAD ==========
+// Content-defined chunks for dedup on the server. Must match tcp/chunks.py
+// on the server, or none of the chunks it stored are ever found again.
+const long long CHUNK_MIN_SIZE = 16 * 1024;
+const long long CHUNK_MAX_SIZE = 256 * 1024;
+const uint64_t CHUNK_MASK = 0xFFFFULL << 48;
+
+struct Chunk
+{
+    long long start;
+    long long length;
+    string hash;
+};
+
+// gear[b]: the first 8 bytes of sha256(b), big-endian
+uint64_t gear[256];
+
+void initGear()
+{
+    unsigned char hash[EVP_MAX_MD_SIZE];
+    unsigned int len = 0;
+    for (int b = 0; b < 256; b++)
+    {
+        unsigned char byte = (unsigned char)b;
+        EVP_Digest(&byte, 1, hash, &len, EVP_sha256(), NULL);
+        uint64_t v = 0;
+        for (int i = 0; i < 8; i++)
+            v = (v << 8) | hash[i];
+        gear[b] = v;
+    }
+}
+
+// Gear rolling hash restarted CHUNK_MIN_SIZE bytes into each chunk; a chunk
+// ends after the first byte that leaves (h & CHUNK_MASK) == 0, or at
+// CHUNK_MAX_SIZE. An edit only moves the cut points right next to it.
+vector<Chunk> cdcChunks(const string &path)
+{
+    ifstream f(path, ios::binary);
+    vector<Chunk> chunks;
+    vector<char> current;
+    current.reserve(CHUNK_MAX_SIZE);
+    unsigned char hash[EVP_MAX_MD_SIZE];
+    unsigned int len = 0;
+    long long start = 0;
+    uint64_t h = 0;
+
+    auto cut = [&]()
+    {
+        EVP_Digest(current.data(), current.size(), hash, &len, EVP_sha256(), NULL);
+        chunks.push_back({start, (long long)current.size(), toHex(hash, len)});
+        start += current.size();
+        current.clear();
+        h = 0;
+    };
+
+    vector<char> buf(1024 * 1024);
+    while (f.read(buf.data(), buf.size()) || f.gcount() > 0)
+    {
+        long long n = f.gcount();
+        for (long long i = 0; i < n; i++)
+        {
+            current.push_back(buf[i]);
+            long long pos = current.size();
+            if (pos > CHUNK_MIN_SIZE)
+            {
+                h = (h << 1) + gear[(unsigned char)buf[i]];
+                if (!(h & CHUNK_MASK))
+                {
+                    cut();
+                    continue;
+                }
+            }
+            if (pos == CHUNK_MAX_SIZE)
+                cut();
+        }
+    }
+    if (!current.empty())
+        cut();
+    return chunks;
+}
+
+// Answers a MANIFEST reply: sends one "<sha256> <length>" line per chunk,
+// then only the chunks the server lists in "NEED <k> <runs>", then the
+// usual CHECKSUM line. When the server holds too little of the file it
+// answers the manifest with a RANGES header instead; the upload then goes
+// over parallel streams.
+bool uploadChunks(SSL *ssl, SSL_CTX *ctx, const string &host, int port,
+                  const string &path, const vector<Chunk> &chunks,
+                  const string &checksum)
+{
+    string manifest;
+    for (const Chunk &c : chunks)
+    {
+        manifest += c.hash + " " + to_string(c.length) + "\n";
+        if (manifest.size() >= 64 * 1024)
+        {
+            SSL_write(ssl, manifest.c_str(), manifest.size());
+            manifest.clear();
+        }
+    }
+    if (!manifest.empty())
+        SSL_write(ssl, manifest.c_str(), manifest.size());
+
+    string reply = readLine(ssl);
+    if (isRangesHeader(reply))
+        return uploadRanges(ssl, ctx, host, port, reply, path, checksum);
+    istringstream need(reply);
+    string word;
+    long long count;
+    if (!(need >> word >> count) || word != "NEED")
+    {
+        cout << "\n[SERVER] " << reply << endl;
+        return false;
+    }
+
+    ifstream file(path, ios::binary);
+    vector<char> chunk(CHUNK_MAX_SIZE);
+    long long done = 0;
+    string run;
+    while (need >> run)
+    {
+        size_t dash = run.find('-');
+        long long first = stoll(run.substr(0, dash));
+        long long last = dash == string::npos ? first : stoll(run.substr(dash + 1));
+        for (long long i = first; i <= last && i < (long long)chunks.size(); i++)
+        {
+            const Chunk &c = chunks[i];
+            file.seekg(c.start);
+            file.read(chunk.data(), c.length);
+            if (file.gcount() != c.length || SSL_write(ssl, chunk.data(), c.length) <= 0)
+            {
+                cout << "\n⛔ Upload aborted.\n";
+                return false;
+            }
+            done++;
+            cout << "\r⏳ Uploading " << count << " of " << chunks.size()
+                 << " chunks... " << (done * 100 / count) << "%";
+            cout.flush();
+        }
+    }
+
+    string msg_ck = "CHECKSUM " + checksum + "\n";
+    SSL_write(ssl, msg_ck.c_str(), msg_ck.size());
+    cout << "\n" << chunks.size() - count << " chunks already on the server\n";
+    return true;
+}
+
+// ========== DOWNLOAD ==========
+// Appends bytes [received, size) to path; false if the connection dropped.
+bool receiveDownload(SSL *ssl, const string &path, long long received, long long size)
+{
+    ofstream out(path, received > 0 ? ios::binary | ios::in | ios::out : ios::binary);
+    out.seekp(received);
+
+    vector<char> buf(256 * 1024);
+    while (received < size)
+    {
+        int n = SSL_read(ssl, buf.data(), (int)min((long long)buf.size(), size - received));
+        if (n <= 0)
+            break;
+        out.write(buf.data(), n);
+        received += n;
+        cout << "\r⬇ Downloading... " << (received * 100 / size) << "%";
+        cout.flush();
+    }
+    out.close();
+    return received == size;
+}
+
 // ========== MAIN ==========
 int main(int argc, char *argv[])
 {
@@ -98,22 +463,11 @@ int main(int argc, char *argv[])
     int port = stoi(argv[8]);
 
     // ========== Create socket ==========
-    int sock = socket(AF_INET, SOCK_STREAM, 0);
-
-    sockaddr_in server{};
-    server.sin_family = AF_INET;
-    server.sin_port = htons(port);
-
-#ifdef _WIN32
-    inet_pton(AF_INET, host.c_str(), &(server.sin_addr));
-#else
-    inet_pton(AF_INET, host.c_str(), &server.sin_addr);
-#endif
-
-    connect(sock, (sockaddr *)&server, sizeof(server));
+    int sock = connectServer(host, port);
 
     // ========== SSL ==========
     initSSL();
+    initGear();
     SSL_CTX *ctx = SSL_CTX_new(TLS_client_method());
     SSL *ssl = SSL_new(ctx);
     SSL_set_fd(ssl, sock);
@@ -129,6 +483,9 @@ int main(int argc, char *argv[])
     cout << reply << endl;
     if (reply.find("AUTHORIZED") == string::npos)
         return 1;
+    // TLS 1.3 tickets arrive after the handshake; they are in by the time
+    // the LOGIN reply has been read
+    keepSession(ssl);
 
     atomic<bool> transferring(false);
     atomic<bool> terminate(false);
@@ -136,6 +493,8 @@ int main(int argc, char *argv[])
     string lastUploadPath = "";
     string lastChecksum = "";
     string pathfile = "upload_path.txt";
+    string lastDownloadPath = "";
+    string downloadfile = "download_path.txt";
 
     {
         ifstream p(pathfile);
@@ -144,6 +503,9 @@ int main(int argc, char *argv[])
             getline(p, lastUploadPath);
             getline(p, lastChecksum);
         }
+        ifstream d(downloadfile);
+        if (d)
+            getline(d, lastDownloadPath);
     }
 
     // ========== HEARTBEAT THREAD ==========
@@ -170,6 +532,28 @@ int main(int argc, char *argv[])
         string msg(buf, len);
         cout << "\n[SERVER] " << msg << endl;
 
+        // ========== RESUME PARALLEL UPLOAD ==========
+        if (isRangesHeader(msg))
+        {
+            transferring = true;
+            if (lastUploadPath == "" || !fs::exists(lastUploadPath))
+            {
+                SSL_write(ssl, "cancel\n", 7);
+                transferring = false;
+                continue;
+            }
+
+            if (uploadRanges(ssl, ctx, host, port, msg, lastUploadPath, lastChecksum))
+            {
+                cout << "✔ Resume completed\n";
+                remove(pathfile.c_str());
+                lastUploadPath = "";
+                lastChecksum = "";
+            }
+            transferring = false;
+            continue;
+        }
+
         // ========== RESUME UPLOAD ==========
         if (msg.rfind("OFFSET", 0) == 0)
         {
@@ -278,11 +662,41 @@ int main(int argc, char *argv[])
                 continue;
             }
 
-            string s = to_string(size) + "\n";
+            // servers with chunk dedup take the CHUNKS offer, others STREAMS
+            vector<Chunk> chunks = cdcChunks(path);
+            string s = to_string(size) + " STREAMS " + to_string(UPLOAD_STREAMS) +
+                       " CHUNKS " + to_string(chunks.size()) + "\n";
             SSL_write(ssl, s.c_str(), s.size());
 
             memset(buf, 0, sizeof(buf));
             SSL_read(ssl, buf, sizeof(buf));
+
+            if (string(buf).rfind("MANIFEST", 0) == 0)
+            {
+                if (uploadChunks(ssl, ctx, host, port, path, chunks, lastChecksum))
+                {
+                    cout << "✔ Upload sent.\n";
+                    remove(pathfile.c_str());
+                    lastUploadPath = "";
+                    lastChecksum = "";
+                }
+                transferring = false;
+                continue;
+            }
+
+            // large files: the server may split the upload across streams
+            if (isRangesHeader(buf))
+            {
+                if (uploadRanges(ssl, ctx, host, port, buf, path, lastChecksum))
+                {
+                    cout << "✔ Upload sent.\n";
+                    remove(pathfile.c_str());
+                    lastUploadPath = "";
+                    lastChecksum = "";
+                }
+                transferring = false;
+                continue;
+            }
             long skip = stol(string(buf));
 
             file.seekg(skip);
@@ -328,6 +742,37 @@ int main(int argc, char *argv[])
             continue;
         }
 
+        // ========== RESUME DOWNLOAD ==========
+        if (msg.rfind("DOWNLOAD_RESUME ", 0) == 0)
+        {
+            transferring = true;
+            string meta = msg.substr(16);
+            long long size = stoll(meta.substr(0, meta.find("|")));
+
+            if (lastDownloadPath == "" || !fs::exists(lastDownloadPath))
+            {
+                SSL_write(ssl, "cancel\n", 7);
+                transferring = false;
+                continue;
+            }
+
+            // what is on disk is what we acknowledge
+            long long offset = fs::file_size(lastDownloadPath);
+            if (offset > size)
+                offset = 0;
+            string reply = "OFFSET " + to_string(offset) + "\n";
+            SSL_write(ssl, reply.c_str(), reply.size());
+
+            if (receiveDownload(ssl, lastDownloadPath, offset, size))
+            {
+                cout << "\n✔ Download resumed and completed: " << lastDownloadPath << endl;
+                remove(downloadfile.c_str());
+                lastDownloadPath = "";
+            }
+            transferring = false;
+            continue;
+        }
+
         // ========== DOWNLOAD ==========
         if (msg.find("Enter save path") != string::npos)
         {
@@ -372,22 +817,17 @@ int main(int argc, char *argv[])
             string finalName = getUniqueFilename(saveDir, fname);
             string fullPath = saveDir + finalName;
 
-            ofstream out(fullPath, ios::binary);
-            long received = 0;
+            lastDownloadPath = fullPath;
+            ofstream df(downloadfile);
+            df << lastDownloadPath;
+            df.close();
 
-            while (received < size)
+            if (receiveDownload(ssl, fullPath, 0, size))
             {
-                int n = SSL_read(ssl, buf, sizeof(buf));
-                if (n <= 0)
-                    break;
-                out.write(buf, n);
-                received += n;
-                cout << "\r⬇ Downloading... " << (received * 100 / size) << "%";
-                cout.flush();
+                cout << "\n✔ Download completed: " << fullPath << endl;
+                remove(downloadfile.c_str());
+                lastDownloadPath = "";
             }
-
-            out.close();
-            cout << "\n✔ Download completed: " << fullPath << endl;
             transferring = false;
             continue;
         }
@@ -396,6 +836,8 @@ int main(int argc, char *argv[])
     terminate = true;
     SSL_shutdown(ssl);
     SSL_free(ssl);
+    if (resumeSession)
+        SSL_SESSION_free(resumeSession);
     SSL_CTX_free(ctx);
 
 #ifdef _WIN32
@@ -1,7 +1,9 @@
 from flask import Flask, render_template, request, redirect, url_for, session
+from flask import jsonify
 import bcrypt
 
 from utils.autho import login_required, admin_required
+from utils.cache import page_cache
 
 from routes.login import login_bp
 from routes.client_manager import client_manager_bp
@@ -31,5 +33,13 @@ def index():
     return redirect(url_for("login.login"))
 
 
+# ========== OPS ==========
+@app.route("/ops/cache")
+@admin_required
+def cache_stats():
+    """Hit/miss counters of the page data cache."""
+    return jsonify(page_cache.stats())
+
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=8080, debug=True)
@@ -1 +1,9 @@
-BACKEND_URL = "http://localhost:8001"
+import os
+
+BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:8001")
+
+# shared keep-alive connections to the backend (utils/backend.py)
+BACKEND_POOL_SIZE = int(os.getenv("BACKEND_POOL_SIZE", "16"))
+BACKEND_CONNECT_TIMEOUT = float(os.getenv("BACKEND_CONNECT_TIMEOUT", "3"))
+BACKEND_READ_TIMEOUT = float(os.getenv("BACKEND_READ_TIMEOUT", "30"))
+BACKEND_RETRIES = int(os.getenv("BACKEND_RETRIES", "2"))
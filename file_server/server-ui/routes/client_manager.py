@@ -1,21 +1,31 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash
-import requests
+from flask import session
 from utils.autho import admin_required
-from config import BACKEND_URL
+from utils import backend
+from utils.cache import page_cache
 
 client_manager_bp = Blueprint("client_manager", __name__)
 
 
 # ========== LOAD PAGE ==========
+def fetch_overview():
+    r = backend.get("/api/clients/overview")
+    if r.status_code != 200:
+        return None
+    data = r.json()
+    return data.get("clients", []), data.get("users", [])
+
+
+def load_overview():
+    """Clients and users for the page, one backend round-trip on a miss."""
+    overview = page_cache.get_or_load(("manager", session.get("role")), fetch_overview)
+    return overview or ([], [])
+
+
 @client_manager_bp.route("/client-manager")
 @admin_required
 def client_manager():
-    r_clients = requests.get(f"{BACKEND_URL}/api/clients")
-    clients = r_clients.json().get("data", []) if r_clients.status_code == 200 else []
-
-    r_users = requests.get(f"{BACKEND_URL}/api/users")
-    users = r_users.json().get("data", []) if r_users.status_code == 200 else []
-
+    clients, users = load_overview()
     return render_template("client_manager.html", clients=clients, users=users)
 
 
@@ -30,19 +40,21 @@ def client_add():
         "user_owner": request.form.get("user_owner"),
     }
 
-    response = requests.post(f"{BACKEND_URL}/api/clients", json=data)
+    response = backend.post("/api/clients", json=data)
 
     if response.status_code == 409:  # duplicate
         flash("Client ID already exists. Please choose another.", "error")
+        clients, users = load_overview()
         return render_template(
             "client_manager.html",
-            clients=requests.get(f"{BACKEND_URL}/api/clients").json().get("data", []),
-            users=requests.get(f"{BACKEND_URL}/api/users").json().get("data", []),
+            clients=clients,
+            users=users,
             add_error="Client ID already exists. Please choose another.",
             show_add_modal=True,
         )
 
     if response.status_code == 201:
+        page_cache.invalidate("manager", "monitor")
         flash("Client successfully added!", "success")
         return redirect(url_for("client_manager.client_manager"))
 
@@ -60,9 +72,9 @@ def client_edit(client_id):
         flash("Password cannot be empty.", "error")
         return redirect(url_for("client_manager.client_manager"))
 
-    response = requests.put(
-        f"{BACKEND_URL}/api/clients/{client_id}", json={"password": password}
-    )
+    response = backend.put(f"/api/clients/{client_id}", json={"password": password})
+    if response.status_code == 200:
+        page_cache.invalidate("manager", "monitor")
 
     flash(
         (
@@ -79,7 +91,9 @@ def client_edit(client_id):
 @client_manager_bp.route("/client-manager/delete/<client_id>", methods=["POST"])
 @admin_required
 def client_delete(client_id):
-    r = requests.delete(f"{BACKEND_URL}/api/clients/{client_id}")
+    r = backend.delete(f"/api/clients/{client_id}")
+    if r.status_code == 200:
+        page_cache.invalidate("manager", "monitor")
 
     flash(
         (
@@ -1,28 +1,35 @@
 from flask import Blueprint, render_template, session, redirect, url_for
-import requests
-from config import BACKEND_URL
+from utils import backend
 from utils.autho import login_required
+from utils.cache import page_cache
 
 client_monitor_bp = Blueprint("client_monitor", __name__)
 
+
 # ========== LOAD PAGE ==========
+def fetch_monitor(username, role):
+    r = backend.post(
+        "/api/clients/monitor",
+        json={"username": username, "role": role},
+    )
+    if r.status_code != 200:
+        return None
+    return r.json().get("clients", [])
+
+
 @client_monitor_bp.route("/client-monitor")
 @login_required
 def client_monitor():
     username = session.get("username")
     role = session.get("role")
 
-    r = requests.post(
-        f"{BACKEND_URL}/api/clients/monitor",
-        json={"username": username, "role": role},
-    )
+    # admins all see the same list; users only their own clients
+    key = ("monitor", role, None if role == "ADMIN" else username)
+    clients = page_cache.get_or_load(key, lambda: fetch_monitor(username, role))
 
-    if r.status_code != 200:
+    if clients is None:
         return render_template(
             "client_monitor.html", clients=[], role=role, error="Backend not responding"
         )
 
-    data = r.json()
-    clients = data.get("clients", [])
-
     return render_template("client_monitor.html", clients=clients, role=role)
@@ -1,28 +1,107 @@
-from flask import Blueprint, render_template, request, redirect, url_for, session, flash
-import requests
-from config import BACKEND_URL
+from flask import (
+    Blueprint,
+    render_template,
+    request,
+    redirect,
+    url_for,
+    session,
+    flash,
+    jsonify,
+    Response,
+)
+from config import BACKEND_CONNECT_TIMEOUT
+from utils import backend
 from utils.autho import login_required
+from utils.cache import page_cache
 
 client_storage_bp = Blueprint("client_storage", __name__)
 
 
 # ========== LOAD PAGE ==========
-@client_storage_bp.route("/client-storage/<client_id>")
-@login_required
-def client_storage(client_id):
+# query parameters the page passes through to the backend file list
+FILE_FILTERS = ("status", "name", "sort", "order")
+
+
+def fetch_files(client_id, cursor=None):
+    """One page of files from the backend: (files, next_cursor) or None."""
     token = session.get("token")
     headers = {"Authorization": f"Bearer {token}"}
+    params = {k: request.args[k] for k in FILE_FILTERS if request.args.get(k)}
+    if cursor:
+        params["cursor"] = cursor
 
-    r = requests.get(f"{BACKEND_URL}/api/storage/{client_id}/files", headers=headers)
-
+    r = backend.get(f"/api/storage/{client_id}/files", headers=headers, params=params)
     if r.status_code != 200:
+        return None
+    data = r.json()
+    return data.get("files", []), data.get("next_cursor")
+
+
+@client_storage_bp.route("/client-storage/<client_id>")
+@login_required
+def client_storage(client_id):
+    filters = {k: request.args.get(k, "") for k in FILE_FILTERS}
+    page = fetch_files(client_id)
+
+    if page is None:
         flash("Failed to load file list.", "error")
-        return render_template("client_storage.html", files=[], client_id=client_id)
+        return render_template(
+            "client_storage.html",
+            files=[],
+            next_cursor=None,
+            filters=filters,
+            client_id=client_id,
+        )
+
+    files, next_cursor = page
+    return render_template(
+        "client_storage.html",
+        files=files,
+        next_cursor=next_cursor,
+        filters=filters,
+        client_id=client_id,
+    )
 
-    data = r.json()
-    files = data.get("files", [])
 
-    return render_template("client_storage.html", files=files, client_id=client_id)
+# ========== MORE FILES (lazy loading) ==========
+@client_storage_bp.route("/client-storage/<client_id>/files")
+@login_required
+def more_files(client_id):
+    page = fetch_files(client_id, request.args.get("cursor"))
+    if page is None:
+        return jsonify({"status": "error"}), 502
+
+    files, next_cursor = page
+    rows = render_template("_file_rows.html", files=files)
+    return jsonify({"status": "ok", "rows": rows, "next_cursor": next_cursor})
+
+
+# ========== LIVE EVENTS ==========
+@client_storage_bp.route("/client-storage/<client_id>/events")
+@login_required
+def events(client_id):
+    """Relay the backend's event stream for this client to the page."""
+    r = backend.get(
+        "/api/clients/monitor/events",
+        params={"client_id": client_id},
+        stream=True,
+        timeout=(BACKEND_CONNECT_TIMEOUT, None),
+    )
+    if r.status_code != 200:
+        r.close()
+        return "", 502
+
+    def relay():
+        try:
+            yield from r.iter_content(chunk_size=None)
+        finally:
+            r.close()
+
+    return Response(
+        relay(),
+        mimetype="text/event-stream",
+        headers={"X-Accel-Buffering": "no"},
+    )
 
 
 # ========== REQUEST UPLOAD ==========
@@ -36,7 +115,7 @@ def request_upload(client_id):
     token = session.get("token")
     headers = {"Authorization": f"Bearer {token}"}
 
-    r = requests.post(f"{BACKEND_URL}/api/storage/{client_id}/upload", headers=headers)
+    r = backend.post(f"/api/storage/{client_id}/upload", headers=headers)
 
     if r.status_code == 201:
         flash("Upload request sent to client.", "success")
@@ -53,9 +132,7 @@ def download_file(file_id):
     token = session.get("token")
     headers = {"Authorization": f"Bearer {token}"}
 
-    r = requests.post(
-        f"{BACKEND_URL}/api/storage/files/{file_id}/download", headers=headers
-    )
+    r = backend.post(f"/api/storage/files/{file_id}/download", headers=headers)
 
     if r.status_code in (200, 202):
         flash("Download request sent to client.", "success")
@@ -72,9 +149,9 @@ def cancel_upload(file_id):
     token = session.get("token")
     headers = {"Authorization": f"Bearer {token}"}
 
-    r = requests.post(
-        f"{BACKEND_URL}/api/storage/file/{file_id}/cancel", headers=headers
-    )
+    r = backend.post(f"/api/storage/file/{file_id}/cancel", headers=headers)
+    if r.status_code == 200:
+        page_cache.invalidate("monitor")  # file counts and usage changed
 
     flash(
         "Upload canceled." if r.status_code == 200 else "Cancel failed.",
@@ -91,9 +168,9 @@ def delete_file(file_id):
     token = session.get("token")
     headers = {"Authorization": f"Bearer {token}"}
 
-    r = requests.delete(
-        f"{BACKEND_URL}/api/storage/files/{file_id}/delete", headers=headers
-    )
+    r = backend.delete(f"/api/storage/files/{file_id}/delete", headers=headers)
+    if r.status_code == 200:
+        page_cache.invalidate("monitor")
 
     if r.status_code == 200:
         flash("🗑 File deleted successfully.", "success")
@@ -1,6 +1,5 @@
 from flask import Blueprint, render_template, request, redirect, url_for, session
-import requests
-from config import BACKEND_URL
+from utils import backend
 
 login_bp = Blueprint("login", __name__)
 
@@ -12,8 +11,8 @@ def login():
         username = request.form.get("username", "").strip()
         password = request.form.get("password", "")
 
-        r = requests.post(
-            f"{BACKEND_URL}/api/login",
+        r = backend.post(
+            "/api/login",
             json={"username": username, "password": password},
         )
 
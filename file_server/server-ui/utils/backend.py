@@ -0,0 +1,55 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from config import (
+    BACKEND_URL,
+    BACKEND_POOL_SIZE,
+    BACKEND_CONNECT_TIMEOUT,
+    BACKEND_READ_TIMEOUT,
+    BACKEND_RETRIES,
+)
+
+# One pooled keep-alive session per UI process instead of a new TCP
+# connection for every backend call. Connection failures are retried for
+# any method (nothing reached the backend); 502/503/504 and read errors
+# only for idempotent requests.
+_retry = Retry(
+    total=BACKEND_RETRIES,
+    connect=BACKEND_RETRIES,
+    read=BACKEND_RETRIES,
+    status=BACKEND_RETRIES,
+    backoff_factor=0.1,
+    status_forcelist=(502, 503, 504),
+    allowed_methods=("GET", "HEAD", "PUT", "DELETE", "OPTIONS"),
+    raise_on_status=False,
+)
+_adapter = HTTPAdapter(
+    pool_connections=1, pool_maxsize=BACKEND_POOL_SIZE, max_retries=_retry
+)
+
+session = requests.Session()
+session.mount("http://", _adapter)
+session.mount("https://", _adapter)
+
+
+def call(method, path, **kwargs):
+    """Backend request on the shared session; path is relative to BACKEND_URL."""
+    kwargs.setdefault("timeout", (BACKEND_CONNECT_TIMEOUT, BACKEND_READ_TIMEOUT))
+    return session.request(method, f"{BACKEND_URL}{path}", **kwargs)
+
+
+def get(path, **kwargs):
+    return call("GET", path, **kwargs)
+
+
+def post(path, **kwargs):
+    return call("POST", path, **kwargs)
+
+
+def put(path, **kwargs):
+    return call("PUT", path, **kwargs)
+
+
+def delete(path, **kwargs):
+    return call("DELETE", path, **kwargs)
@@ -0,0 +1,81 @@
+import os, time, threading
+from collections import OrderedDict
+
+# Page data the UI fetches from the backend on every view but that rarely
+# changes (client list, monitor totals). Entries expire after UI_CACHE_TTL
+# seconds; the UI drops them at once when it changes clients or files
+# itself, so the TTL only bounds how stale changes made elsewhere (a client
+# finishing an upload, another UI process) can look.
+UI_CACHE_TTL = float(os.getenv("UI_CACHE_TTL", "10"))
+UI_CACHE_SIZE = int(os.getenv("UI_CACHE_SIZE", "256"))
+
+
+class PageCache:
+    """TTL + LRU cache keyed by (namespace, ...) tuples, with counters."""
+
+    def __init__(self, ttl=UI_CACHE_TTL, maxsize=UI_CACHE_SIZE):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        # bumped on invalidation, so a load that raced with one is not stored
+        self._generation = {}
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get_or_load(self, key, loader):
+        """Cached value for key, else loader(); None results are not cached."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry:
+                del self._entries[key]
+                self.expired += 1
+            self.misses += 1
+            generation = self._generation.get(key[0], 0)
+
+        value = loader()
+        if value is None or self.ttl <= 0:
+            return value
+        with self._lock:
+            if self._generation.get(key[0], 0) == generation:
+                self._entries[key] = (time.monotonic() + self.ttl, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return value
+
+    def invalidate(self, *namespaces):
+        """Drop every entry whose key starts with one of the namespaces."""
+        with self._lock:
+            for ns in namespaces:
+                self._generation[ns] = self._generation.get(ns, 0) + 1
+            for key in [k for k in self._entries if k[0] in namespaces]:
+                del self._entries[key]
+                self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.maxsize,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+                "expired": self.expired,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+page_cache = PageCache()
@@ -1,7 +1,7 @@
 from flask import Blueprint, request, jsonify
 from db.database import get_connection
 from db.model import get_user_by_username
-import bcrypt
+from utils.hash import verify_password_cached
 import secrets
 
 login_bp = Blueprint("login", __name__)
@@ -22,7 +22,7 @@ def login():
     if not user:
         return jsonify({"status": "error", "error": "user-not-found"}), 401
 
-    if not bcrypt.checkpw(password.encode(), user["password_hash"].encode()):
+    if not verify_password_cached(f"user:{username}", password, user["password_hash"]):
         return jsonify({"status": "error", "error": "invalid-password"}), 401
 
     token = secrets.token_hex(32)
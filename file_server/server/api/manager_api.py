@@ -1,6 +1,9 @@
 from flask import Blueprint, request, jsonify
 from db.model import list_clients, list_users, add_client, update_client, delete_client
+from db.model import iter_clients
 from db.model import get_client
+from utils.streaming import stream_mode, stream_rows
+from utils.hash import forget_credentials
 import bcrypt
 
 manager_bp = Blueprint("manager_api", __name__)
@@ -9,10 +12,22 @@ manager_bp = Blueprint("manager_api", __name__)
 # ========== GET CLIENT LIST ==========
 @manager_bp.route("/clients", methods=["GET"])
 def api_list_clients():
+    mode = stream_mode()
+    if mode:
+        return stream_rows(mode, "data", iter_clients())
+
     clients = list_clients()
     return jsonify({"status": "ok", "data": clients}), 200
 
 
+# ========== PAGE DATA ==========
+@manager_bp.route("/clients/overview", methods=["GET"])
+def api_clients_overview():
+    """Everything the client manager page shows, in one response."""
+    users = [{"user_id": u["user_id"], "username": u["username"]} for u in list_users()]
+    return jsonify({"status": "ok", "clients": list_clients(), "users": users}), 200
+
+
 # ========== ADD CLIENT ==========
 @manager_bp.route("/clients", methods=["POST"])
 def api_add_client():
@@ -57,6 +72,8 @@ def api_update_client(client_id):
 
     password_hash = bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
     update_client(client_id, password_hash, None, None)
+    # other processes miss anyway: their cache keys include the old hash
+    forget_credentials(f"client:{client_id}")
     return jsonify({"status": "ok", "message": "password-updated"}), 200
 
 
@@ -67,4 +84,5 @@ def api_delete_client(client_id):
         return jsonify({"status": "error", "error": "not-found"}), 404
 
     delete_client(client_id)
+    forget_credentials(f"client:{client_id}")
     return jsonify({"status": "ok", "message": "client-deleted"}), 200
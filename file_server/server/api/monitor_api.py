@@ -1,8 +1,27 @@
-from flask import Blueprint, request, jsonify
-from db.model import list_clients, list_clients_by_user, get_files_by_client
+import json, queue
+from itertools import islice
+from flask import Blueprint, Response, request, jsonify
+from db.model import list_client_usage, iter_client_usage
+from utils.tcp_control import (
+    live_progress,
+    live_online,
+    tls_stats,
+    accept_stats,
+    liveness_stats,
+    auth_stats,
+)
+from utils.streaming import stream_mode, stream_rows
+from utils.events import hub
+from utils.blobstore import dedup_stats
 
 monitor_bp = Blueprint("monitor", __name__)
 
+# comment line sent on an idle event stream so proxies keep it open
+EVENT_KEEPALIVE = 15.0
+# client ids per liveness query to the TCP server
+LIVE_STATUS_BATCH = 1000
+
+
 def format_size(bytes_value):
     if bytes_value < 1000 * 1000:
         return f"{round(bytes_value / 1000, 2)} KB"
@@ -12,6 +31,37 @@ def format_size(bytes_value):
 
 
 # ========== MONITOR ==========
+def with_live_status(clients):
+    """Rows with status from the TCP server's heartbeat tracker.
+
+    clients.status is only written on transitions (batched), so the live
+    answer can be a second fresher; the stored value is kept when the TCP
+    server does not answer.
+    """
+    clients = iter(clients)
+    live = True
+    while batch := list(islice(clients, LIVE_STATUS_BATCH)):
+        # a silent server costs one query timeout, not one per batch
+        online = live_online(c["client_id"] for c in batch) if live else None
+        live = online is not None
+        for c in batch:
+            if live:
+                c["status"] = "ONLINE" if c["client_id"] in online else "OFFLINE"
+            yield c
+
+
+def monitor_rows(clients):
+    for c in with_live_status(clients):
+        yield {
+            "client_id": c["client_id"],
+            "owner": c["username"],
+            "status": c.get("status", "OFFLINE"),
+            "file_count": c["file_count"],
+            "used_storage": format_size(c["used_bytes"]),
+            "capacity_max": f"{c['capacity_max']} GB",
+        }
+
+
 @monitor_bp.route("clients/monitor", methods=["POST"])
 def monitor_clients():
     data = request.get_json()
@@ -21,25 +71,112 @@ def monitor_clients():
     if not role or not username:
         return jsonify({"status": "error", "message": "missing-auth-info"}), 400
 
-    if role == "ADMIN":
-        clients = list_clients()
-    else:
-        clients = list_clients_by_user(username)
-
-    result = []
-    for c in clients:
-        files = get_files_by_client(c["client_id"])
-        total_size = sum(f["size"] for f in files)
-
-        result.append(
-            {
-                "client_id": c["client_id"],
-                "owner": c["username"],
-                "status": c.get("status", "OFFLINE"),
-                "file_count": len(files),
-                "used_storage": format_size(total_size),
-                "capacity_max": f"{c['capacity_max']} GB",
-            }
-        )
+    # one aggregated query instead of loading every file of every client
+    owner = None if role == "ADMIN" else username
+    mode = stream_mode()
+    if mode:
+        return stream_rows(mode, "clients", monitor_rows(iter_client_usage(owner)))
 
+    result = list(monitor_rows(list_client_usage(owner)))
     return jsonify({"status": "ok", "clients": result}), 200
+
+
+# ========== LIVE UPLOAD PROGRESS ==========
+@monitor_bp.route("clients/monitor/progress", methods=["GET"])
+def monitor_progress():
+    # straight from the TCP server's memory, ahead of the batched DB writes
+    files = live_progress()
+    return jsonify({"status": "ok", "files": files}), 200
+
+
+# ========== DEDUPLICATED STORAGE ==========
+@monitor_bp.route("clients/monitor/storage", methods=["GET"])
+def monitor_storage():
+    stats = dedup_stats()
+    stats["logical_size"] = format_size(stats["logical_bytes"])
+    stats["stored_size"] = format_size(stats["stored_bytes"])
+    stats["saved_size"] = format_size(stats["bytes_saved"])
+    stats["wire_saved_size"] = format_size(stats["wire_bytes_saved"])
+    stats["disk_size"] = format_size(stats["disk_bytes"])
+    stats["compression_saved_size"] = format_size(stats["compression_bytes_saved"])
+    return jsonify({"status": "ok", "storage": stats}), 200
+
+
+# ========== TCP SERVER METRICS ==========
+def server_stats(key, stats):
+    if stats is None:
+        return jsonify({"status": "error", "message": "tcp-server-unreachable"}), 503
+    return jsonify({"status": "ok", key: stats}), 200
+
+
+@monitor_bp.route("clients/monitor/tls", methods=["GET"])
+def monitor_tls():
+    return server_stats("tls", tls_stats())
+
+
+@monitor_bp.route("clients/monitor/accept", methods=["GET"])
+def monitor_accept():
+    return server_stats("accept", accept_stats())
+
+
+@monitor_bp.route("clients/monitor/auth", methods=["GET"])
+def monitor_auth():
+    return server_stats("auth", auth_stats())
+
+
+@monitor_bp.route("clients/monitor/liveness", methods=["GET"])
+def monitor_liveness():
+    client_id = request.args.get("client_id")
+    if not client_id:
+        return server_stats("liveness", liveness_stats())
+    online = live_online([client_id])
+    if online is None:
+        return server_stats("client", None)
+    status = "ONLINE" if client_id in online else "OFFLINE"
+    return server_stats("client", {"client_id": client_id, "status": status})
+
+
+# ========== LIVE EVENTS (server-sent events) ==========
+def for_client(event, client_id):
+    """The part of an event that concerns client_id; None if nothing does."""
+    if client_id is None:
+        return event
+    if event["type"] == "action":
+        return event if event.get("client_id") == client_id else None
+    uploads = [u for u in event["uploads"] if u["client_id"] == client_id]
+    downloads = [d for d in event["downloads"] if d["client_id"] == client_id]
+    if not uploads and not downloads:
+        return None
+    return {"type": "progress", "uploads": uploads, "downloads": downloads}
+
+
+@monitor_bp.route("clients/monitor/events", methods=["GET"])
+def monitor_events():
+    """Action state changes and transfer progress as they happen.
+
+    Pushed by the TCP server through utils.events.hub; nothing here reads
+    the database. ?client_id= limits the stream to one client.
+    """
+    client_id = request.args.get("client_id")
+    q = hub.listen()
+
+    def stream():
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    event = q.get(timeout=EVENT_KEEPALIVE)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                event = for_client(event, client_id)
+                if event is not None:
+                    yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            hub.unlisten(q)
+
+    return Response(
+        stream(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
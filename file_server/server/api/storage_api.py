@@ -1,7 +1,10 @@
-import os
+import os, json, base64
 from flask import Blueprint, request, jsonify
 from db.model import (
-    get_files_by_client,
+    FILE_COLUMNS,
+    FILE_SORTS,
+    list_files_page,
+    iter_files,
     get_file,
     update_file_status,
     delete_file,
@@ -9,9 +12,15 @@ from db.model import (
     get_action_by_file,
     set_action_status,
 )
+from utils.tcp_control import notify_action, live_progress
+from utils.streaming import stream_mode, stream_rows
+from utils.blobstore import staging_path, release
 
 storage_bp = Blueprint("storage", __name__)
 
+FILE_PAGE_SIZE = int(os.getenv("FILE_PAGE_SIZE", "100"))
+FILE_PAGE_MAX = int(os.getenv("FILE_PAGE_MAX", "1000"))
+
 
 # ========== CHECK TOKEN ==========
 def check_token():
@@ -20,11 +29,101 @@ def check_token():
 
 
 # ========== GET FILE LIST ==========
+def encode_cursor(key):
+    raw = json.dumps(list(key)).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+    value, file_id = json.loads(raw)
+    return value, int(file_id)
+
+
+def parse_file_query(args, streaming=False):
+    """Query string of the file list -> list_files_page kwargs (ValueError if bad).
+
+    A streamed list has no page size unless a limit is given. Parameters:
+    limit, cursor, sort (file_id|filename|size|upload_time), order (asc|desc),
+    fields (comma separated), status, name (prefix), min_size, max_size,
+    since, until (upload_time bounds, "YYYY-MM-DD[ HH:MM:SS]").
+    """
+    limit = args.get("limit", None if streaming else FILE_PAGE_SIZE)
+    if limit is not None:
+        limit = int(limit)
+        if limit < 1 or (limit > FILE_PAGE_MAX and not streaming):
+            raise ValueError("limit")
+    sort = args.get("sort", "file_id")
+    order = args.get("order", "asc")
+    if sort not in FILE_SORTS or order not in ("asc", "desc"):
+        raise ValueError("sort")
+
+    fields = args.get("fields")
+    columns = [c for c in fields.split(",") if c] if fields else list(FILE_COLUMNS)
+    if not set(columns) <= set(FILE_COLUMNS):
+        raise ValueError("fields")
+
+    query = {
+        "limit": limit,
+        "sort": sort,
+        "descending": order == "desc",
+        # the cursor needs file_id and the sort column of every row, the
+        # live progress patch the status
+        "columns": list(dict.fromkeys(columns + ["file_id", sort, "status"])),
+        "status": args.get("status"),
+        "name_prefix": args.get("name"),
+        "since": args.get("since"),
+        "until": args.get("until"),
+    }
+    for key in ("min_size", "max_size"):
+        if args.get(key) is not None:
+            query[key] = int(args[key])
+    if args.get("cursor"):
+        query["after"] = decode_cursor(args["cursor"])
+    return query, columns
+
+
+def present_files(rows, query, columns, page):
+    """Rows as the API returns them; sets page["next_cursor"] past the limit."""
+    limit, sort = query["limit"], query["sort"]
+    extra = set(query["columns"]) - set(columns)
+    live = None
+    last = None
+    for n, f in enumerate(rows):
+        if n == limit:
+            page["next_cursor"] = encode_cursor(last)
+            return
+        last = (f[sort], f["file_id"])
+        if "received" in columns and f["status"] == "UPLOADING":
+            if live is None:
+                # files.received is only flushed every second or so
+                live = live_progress()
+            f["received"] = live.get(f["file_id"], f["received"])
+        for c in extra:
+            del f[c]
+        yield f
+
+
 @storage_bp.route("/storage/<client_id>/files", methods=["GET"])
 def list_files(client_id):
     if not check_token():
         return jsonify({"status": "error", "message": "unauthorized"}), 401
-    return jsonify({"status": "ok", "files": get_files_by_client(client_id)}), 200
+
+    mode = stream_mode()
+    try:
+        query, columns = parse_file_query(request.args, streaming=mode is not None)
+    except (ValueError, TypeError):
+        return jsonify({"status": "error", "message": "invalid-query"}), 400
+
+    page = {"next_cursor": None}
+    if mode:
+        rows = present_files(iter_files(client_id, **query), query, columns, page)
+        return stream_rows(mode, "files", rows, tail=lambda: page)
+
+    files = list(
+        present_files(list_files_page(client_id, **query), query, columns, page)
+    )
+    return jsonify({"status": "ok", "files": files, **page}), 200
 
 
 # ========== REQUEST UPLOAD ==========
@@ -34,6 +133,7 @@ def request_upload(client_id):
         return jsonify({"status": "error", "message": "unauthorized"}), 401
 
     action_id = create_action(client_id, None, "UPLOAD")
+    notify_action(client_id)
 
     return (
         jsonify(
@@ -64,11 +164,7 @@ def cancel_upload(file_id):
     if action:
         set_action_status(action["action_id"], "CANCELED")
 
-    file_path = os.path.join(
-        os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "storage")),
-        f["client_id"],
-        f["filename"],
-    )
+    file_path = staging_path(f["client_id"], f["filename"])
     if os.path.exists(file_path):
         os.remove(file_path)
 
@@ -90,16 +186,8 @@ def remove_file(file_id):
     if f["status"] != "UPLOADED":
         return jsonify({"status": "error", "message": "not-allowed"}), 400
 
-    file_path = os.path.join(
-        os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "storage")),
-        f["client_id"],
-        f["filename"],
-    )
-
-    if os.path.exists(file_path):
-        os.remove(file_path)
-
-    delete_file(file_id)
+    # drops the blob only when no other file refers to the same content
+    release(f)
 
     return jsonify({"status": "ok", "message": "file-deleted"}), 200
 
@@ -115,6 +203,7 @@ def request_download(file_id):
         return jsonify({"status": "error", "message": "file-not-found"}), 404
 
     action_id = create_action(f["client_id"], file_id, "DOWNLOAD")
+    notify_action(f["client_id"])
     return (
         jsonify(
             {
@@ -1,4 +1,5 @@
-from flask import Flask
+from flask import Flask, jsonify
+from db.database import init_db, PoolExhausted
 from api.login_api import login_bp
 from api.manager_api import manager_bp
 from api.monitor_api import monitor_bp
@@ -13,5 +14,12 @@ app.register_blueprint(monitor_bp, url_prefix="/api")
 app.register_blueprint(storage_bp, url_prefix="/api")
 app.register_blueprint(user_bp, url_prefix="/api")
 
+
+@app.errorhandler(PoolExhausted)
+def database_busy(e):
+    return jsonify({"status": "error", "message": "database-busy"}), 503
+
+
 if __name__ == "__main__":
+    init_db()
     app.run(host="0.0.0.0", port=8001, debug=True)
@@ -0,0 +1,95 @@
+"""Reconnect storm behind stalled handshakes.
+
+Opens S "stalled" connections that never send a TLS ClientHello, then has
+N agents connect and log in concurrently. With the handshake in the accept
+loop, a stalled client holds up every connection queued behind it; with
+the handshake in the worker / event loop the storm goes straight through.
+Reports how long the storm takes, login latency percentiles, how many
+agents gave up after --timeout seconds and the server's accept metrics.
+
+    python bench/bench_accept.py --clients 200 --stalled 5
+"""
+
+import argparse, asyncio, socket, time
+
+from harness import (
+    BENCH_CLIENT_ID,
+    BENCH_PASSWORD,
+    make_workdir,
+    start_server,
+    stop_server,
+    client_context,
+    percentile,
+    query_control,
+)
+
+
+async def login(port, ctx, latencies):
+    started = time.perf_counter()
+    reader, writer = await asyncio.open_connection(
+        "127.0.0.1", port, ssl=ctx, server_hostname="localhost"
+    )
+    writer.write(f"LOGIN {BENCH_CLIENT_ID} {BENCH_PASSWORD}\n".encode())
+    await writer.drain()
+    reply = await reader.read(1024)
+    if b"AUTHORIZED" not in reply:
+        raise RuntimeError(f"login failed: {reply!r}")
+    latencies.append(time.perf_counter() - started)
+    writer.close()
+
+
+async def storm(port, clients, timeout):
+    ctx = client_context()
+    latencies = []
+    started = time.perf_counter()
+    results = await asyncio.gather(
+        *(
+            asyncio.wait_for(login(port, ctx, latencies), timeout)
+            for _ in range(clients)
+        ),
+        return_exceptions=True,
+    )
+    elapsed = time.perf_counter() - started
+    gave_up = sum(isinstance(r, asyncio.TimeoutError) for r in results)
+    errors = sum(isinstance(r, Exception) for r in results) - gave_up
+    return elapsed, latencies, gave_up, errors
+
+
+def run(workdir, engine, clients, stalled, timeout):
+    proc, port = start_server(
+        workdir, engine, extra_env={"TLS_HANDSHAKE_TIMEOUT": str(timeout * 2)}
+    )
+    idle = [socket.create_connection(("127.0.0.1", port)) for _ in range(stalled)]
+    try:
+        time.sleep(0.2)
+        elapsed, latencies, gave_up, errors = asyncio.run(storm(port, clients, timeout))
+        ok = latencies or [0]
+        print(
+            f"{engine:8s} stalled={stalled} clients={clients} storm={elapsed:.2f}s "
+            f"login_p50={percentile(ok, 50) * 1000:.0f}ms "
+            f"p99={percentile(ok, 99) * 1000:.0f}ms "
+            f"gave_up={gave_up} errors={errors}"
+        )
+        stats = query_control(proc, {"type": "accept"})
+        print(f"{engine:8s} server: {stats}")
+    finally:
+        for s in idle:
+            s.close()
+        stop_server(proc)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--stalled", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=5.0)
+    parser.add_argument("--engines", nargs="+", default=["thread", "asyncio"])
+    args = parser.parse_args()
+
+    workdir = make_workdir()
+    for engine in args.engines:
+        run(workdir, engine, args.clients, args.stalled, args.timeout)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Transfer compression on compressible and incompressible data.
+
+Uploads, then downloads, a file of log-like text and a file of random bytes
+once per codec (and once without an offer), and reports throughput of file
+bytes, the bytes on the wire and the ratio between them, and checks both
+directions arrive intact. Random data should go out as raw frames at close
+to the uncompressed speed. A server without transfer compression makes no
+COMPRESS reply and gets every byte raw.
+
+    python bench/bench_compress.py --mb 64 --codecs zlib lzma
+"""
+
+import argparse, hashlib, random, time
+
+from harness import (
+    make_workdir,
+    add_bench_clients,
+    start_server,
+    stop_server,
+    connect,
+    upload_file_compressed,
+    download_file_compressed,
+    tree_checksum,
+)
+from tcp.hashing import SEGMENT_SIZE
+
+BLOCK = 4 * 1024 * 1024
+
+
+def log_text(size, seed=1):
+    rnd = random.Random(seed)
+    levels = ["INFO", "INFO", "INFO", "DEBUG", "WARN", "ERROR"]
+    words = "upload chunk client session resume offset segment blob checksum".split()
+    lines, total = [], 0
+    while total < size:
+        line = (
+            f"2026-10-{rnd.randrange(1, 29):02d} {rnd.randrange(24):02d}:"
+            f"{rnd.randrange(60):02d}:{rnd.randrange(60):02d} "
+            f"[{rnd.choice(levels)}] agent-{rnd.randrange(500)} "
+            f"{' '.join(rnd.choices(words, k=rnd.randrange(3, 9)))} "
+            f"id={rnd.randrange(10**6)}\n"
+        )
+        lines.append(line)
+        total += len(line)
+    return "".join(lines).encode()[:size]
+
+
+def split(data):
+    view = memoryview(data)
+    return [view[i : i + BLOCK] for i in range(0, len(view), BLOCK)]
+
+
+def run(engine, datasets, codecs):
+    from db.model import get_files_by_client
+
+    workdir = make_workdir()
+    runs = [(name, offer) for name in datasets for offer in codecs]
+    ids = add_bench_clients(len(runs))
+    proc, port = start_server(workdir, engine)
+    try:
+        for cid, (name, offer) in zip(ids, runs):
+            data, chunks, checksums = datasets[name]
+            mb = len(data) / 2**20
+            wanted = [offer] if offer != "none" else []
+
+            conn = connect(port, client_id=cid)
+            started = time.perf_counter()
+            ok, codec, sent = upload_file_compressed(
+                conn, proc, f"{name}.bin", chunks, len(data), checksums, wanted, cid
+            )
+            up = time.perf_counter() - started
+
+            file_id = get_files_by_client(cid)[0]["file_id"]
+            started = time.perf_counter()
+            digest, _, received = download_file_compressed(
+                conn, proc, file_id, wanted, cid
+            )
+            down = time.perf_counter() - started
+            conn.close()
+
+            print(
+                f"{engine:8s} {name:6s} {offer:5s} codec={codec or '-':5s} "
+                f"ok={ok and digest == checksums[0]} "
+                f"up={mb / up:7.1f}MB/s wire={sent / 2**20:6.1f}MB "
+                f"ratio={len(data) / sent:5.2f} | "
+                f"down={mb / down:7.1f}MB/s wire={received / 2**20:6.1f}MB "
+                f"ratio={len(data) / received:5.2f}"
+            )
+    finally:
+        stop_server(proc)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mb", type=int, default=64)
+    parser.add_argument("--codecs", nargs="*", default=["zlib", "lzma"])
+    parser.add_argument("--engines", nargs="+", default=["thread", "asyncio"])
+    args = parser.parse_args()
+
+    size = args.mb * 1024 * 1024
+    datasets = {}
+    for name, data in (
+        ("text", log_text(size)),
+        ("random", random.Random(b"bench").randbytes(size)),
+    ):
+        chunks = split(data)
+        checksums = (
+            hashlib.sha256(data).hexdigest(),
+            tree_checksum(chunks, SEGMENT_SIZE),
+        )
+        datasets[name] = (data, chunks, checksums)
+    for engine in args.engines:
+        run(engine, datasets, ["none"] + args.codecs)
+
+
+if __name__ == "__main__":
+    main()
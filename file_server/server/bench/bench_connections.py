@@ -0,0 +1,114 @@
+"""Idle-connection load benchmark for the thread and asyncio engines.
+
+Opens N logged-in TLS clients against a fresh server, reports server RSS per
+connection, then has every client send "PING <token>" heartbeats and measures
+the PONG round trip.
+
+    python bench/bench_connections.py --clients 2000 --engines thread asyncio
+"""
+
+import argparse, asyncio, time
+
+from harness import (
+    BENCH_CLIENT_ID,
+    BENCH_PASSWORD,
+    make_workdir,
+    start_server,
+    stop_server,
+    rss_kb,
+    client_context,
+    percentile,
+)
+
+
+async def open_client(port, ctx):
+    reader, writer = await asyncio.open_connection(
+        "127.0.0.1", port, ssl=ctx, server_hostname="localhost"
+    )
+    writer.write(f"LOGIN {BENCH_CLIENT_ID} {BENCH_PASSWORD}\n".encode())
+    await writer.drain()
+    reply = await reader.read(1024)
+    if b"AUTHORIZED" not in reply:
+        raise RuntimeError(f"login failed: {reply!r}")
+    return reader, writer
+
+
+async def heartbeat(reader, writer, rounds, interval, latencies):
+    for n in range(rounds):
+        await asyncio.sleep(interval)
+        sent = time.perf_counter()
+        writer.write(f"PING {n}\n".encode())
+        await writer.drain()
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            if line.startswith(b"PONG"):
+                latencies.append(time.perf_counter() - sent)
+                break
+
+
+async def run_engine(engine, clients, rounds, interval, concurrency):
+    workdir = make_workdir()
+    proc, port = start_server(workdir, engine)
+    ctx = client_context()
+    try:
+        await asyncio.sleep(0.5)
+        base = rss_kb(proc.pid)
+
+        sem = asyncio.Semaphore(concurrency)
+
+        async def limited():
+            async with sem:
+                return await open_client(port, ctx)
+
+        started = time.perf_counter()
+        conns = await asyncio.gather(*(limited() for _ in range(clients)))
+        connect_time = time.perf_counter() - started
+        await asyncio.sleep(1.0)
+        loaded = rss_kb(proc.pid)
+
+        latencies = []
+
+        # spread the first beat over the interval like real agents
+        async def staggered(i, r, w):
+            await asyncio.sleep(interval * i / clients)
+            await heartbeat(r, w, rounds, interval, latencies)
+
+        await asyncio.gather(*(staggered(i, r, w) for i, (r, w) in enumerate(conns)))
+
+        for _, w in conns:
+            w.close()
+
+        per_conn = (loaded - base) / clients
+        print(
+            f"{engine:8s} clients={clients} connect={connect_time:.1f}s "
+            f"rss_base={base / 1024:.1f}MB rss_loaded={loaded / 1024:.1f}MB "
+            f"per_conn={per_conn:.1f}KB "
+            f"ping_p50={percentile(latencies, 50) * 1000:.1f}ms "
+            f"ping_p99={percentile(latencies, 99) * 1000:.1f}ms "
+            f"pongs={len(latencies)}/{clients * rounds}"
+        )
+    finally:
+        stop_server(proc)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--interval", type=float, default=3.0)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--engines", nargs="+", default=["thread", "asyncio"])
+    args = parser.parse_args()
+
+    for engine in args.engines:
+        asyncio.run(
+            run_engine(
+                engine, args.clients, args.rounds, args.interval, args.concurrency
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
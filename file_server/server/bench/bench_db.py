@@ -0,0 +1,106 @@
+"""Micro-benchmark: connect-per-call SQLite vs the pooled WAL connections.
+
+"legacy" reproduces what db/model.py used to do for every call (connect,
+PRAGMA foreign_keys, one statement, commit, close, rollback journal).
+"pooled" calls the real db/model.py functions on top of db/database.py.
+
+    python bench/bench_db.py --ops 5000 --threads 1 8
+"""
+
+import argparse, sqlite3, threading, time
+
+from harness import BENCH_CLIENT_ID, make_workdir
+
+
+def legacy_connection(path):
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA foreign_keys = ON")
+    return conn
+
+
+def make_legacy_ops(path, file_id):
+    def get_client():
+        conn = legacy_connection(path)
+        cur = conn.cursor()
+        cur.execute("SELECT * FROM clients WHERE client_id = ?", (BENCH_CLIENT_ID,))
+        cur.fetchone()
+        conn.close()
+
+    def update_status():
+        conn = legacy_connection(path)
+        cur = conn.cursor()
+        cur.execute(
+            "UPDATE clients SET status = ? WHERE client_id = ?",
+            ("ONLINE", BENCH_CLIENT_ID),
+        )
+        conn.commit()
+        conn.close()
+
+    def update_received(n):
+        conn = legacy_connection(path)
+        cur = conn.cursor()
+        cur.execute("UPDATE files SET received = ? WHERE file_id = ?", (n, file_id))
+        conn.commit()
+        conn.close()
+
+    return get_client, update_status, update_received
+
+
+def make_pooled_ops(file_id):
+    from db import model
+
+    return (
+        lambda: model.get_client(BENCH_CLIENT_ID),
+        lambda: model.update_client_status(BENCH_CLIENT_ID, "ONLINE"),
+        lambda n: model.update_file_received(file_id, n),
+    )
+
+
+def run(label, ops, total_ops, threads):
+    get_client, update_status, update_received = ops
+    per_thread = total_ops // threads
+
+    def worker():
+        for i in range(per_thread):
+            # the TCP server's typical mix: lookups, heartbeats, progress
+            if i % 3 == 0:
+                get_client()
+            elif i % 3 == 1:
+                update_status()
+            else:
+                update_received(i)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    started = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - started
+    done = per_thread * threads
+    print(f"{label:7s} threads={threads:<3d} ops={done} ops/sec={done / elapsed:,.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ops", type=int, default=3000)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 8])
+    args = parser.parse_args()
+
+    for threads in args.threads:
+        # fresh DB each time: the pooled run switches the file to WAL
+        workdir = make_workdir()
+        from db import database, model
+
+        file_id = model.add_file(BENCH_CLIENT_ID, "bench.bin", 1, "UPLOADING")
+        database.close_pool()
+        with sqlite3.connect(database.DB_PATH) as conn:
+            conn.execute("PRAGMA journal_mode = DELETE")
+        run("legacy", make_legacy_ops(database.DB_PATH, file_id), args.ops, threads)
+
+        run("pooled", make_pooled_ops(file_id), args.ops, threads)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Many agents uploading the same file.
+
+Logs in N clients (each its own client id) and has every one upload the
+same payload. Reports upload time, the bytes actually on disk under the
+storage folder and the blob store's dedup counters, then deletes every
+file again and checks nothing is left behind. A server without the blob
+store keeps one copy per client.
+
+    python bench/bench_dedup.py --clients 20 --mb 16
+"""
+
+import argparse, os, time
+
+from harness import (
+    make_workdir,
+    add_bench_clients,
+    start_server,
+    stop_server,
+    connect,
+    upload_file,
+    payload,
+)
+
+
+def disk_bytes(folder):
+    total = 0
+    for root, _, names in os.walk(folder):
+        for name in names:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def run(workdir, engine, ids, size, chunks, checksum):
+    from db.model import get_files_by_client
+
+    proc, port = start_server(workdir, engine)
+    storage = os.path.join(workdir, "storage")
+    try:
+        started = time.perf_counter()
+        ok = 0
+        for cid in ids:
+            conn = connect(port, client_id=cid)
+            ok += upload_file(conn, proc, "same.bin", chunks, size, checksum, cid)
+            conn.close()
+        elapsed = time.perf_counter() - started
+        on_disk = disk_bytes(storage)
+        line = (
+            f"{engine:8s} clients={len(ids)} size={size >> 20}MB ok={ok} "
+            f"time={elapsed:.2f}s logical={len(ids) * size >> 20}MB "
+            f"on_disk={on_disk / 2**20:.1f}MB"
+        )
+        try:
+            from utils.blobstore import dedup_stats, release
+
+            stats = dedup_stats()
+            line += f" blobs={stats['blobs']} dedup_ratio={stats['dedup_ratio']}"
+        except ImportError:
+            release = None
+        print(line)
+
+        if release:
+            for cid in ids:
+                for f in get_files_by_client(cid):
+                    release(f)
+            print(
+                f"{engine:8s} after delete: on_disk={disk_bytes(storage)} {dedup_stats()}"
+            )
+    finally:
+        stop_server(proc)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument("--mb", type=int, default=16)
+    parser.add_argument("--engines", nargs="+", default=["thread", "asyncio"])
+    args = parser.parse_args()
+
+    size = args.mb * 1024 * 1024
+    chunks, checksum = payload(size)
+    workdir = make_workdir()
+    # release() below runs in this process and must see the bench storage
+    os.environ["STORAGE_DIR"] = os.path.join(workdir, "storage")
+    ids = add_bench_clients(args.clients)
+    for engine in args.engines:
+        run(workdir, engine, ids, size, chunks, checksum)
+
+
+if __name__ == "__main__":
+    main()
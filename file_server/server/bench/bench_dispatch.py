@@ -0,0 +1,98 @@
+"""Action-to-client latency and idle server cost with push dispatch.
+
+Connects one probe client plus N idle clients (distinct client ids), then
+repeatedly queues an UPLOAD action for the probe exactly like
+api/storage_api.py does (create_action + notify_action) and times how long
+the "Enter file path" prompt takes to arrive. Also reports server CPU while
+everyone sits idle, which is dominated by per-loop DB polling when that is on.
+
+    python bench/bench_dispatch.py --idle 500 --requests 20
+    python bench/bench_dispatch.py --no-push   # polling fallback only
+"""
+
+import argparse, time
+
+import harness
+from harness import (
+    BENCH_CLIENT_ID,
+    BENCH_PASSWORD,
+    make_workdir,
+    add_bench_clients,
+    start_server,
+    stop_server,
+    client_context,
+    connect,
+    cpu_seconds,
+    percentile,
+    read_until,
+)
+
+
+def login_as(port, ctx, cid):
+    import socket
+
+    raw = socket.create_connection(("127.0.0.1", port))
+    conn = ctx.wrap_socket(raw, server_hostname="localhost")
+    conn.sendall(f"LOGIN {cid} {BENCH_PASSWORD}\n".encode())
+    conn.recv(1024)
+    return conn
+
+
+def run(engine, idle, requests, idle_seconds, push):
+    workdir = make_workdir()
+    idle_ids = add_bench_clients(idle)
+    from db.model import create_action
+
+    proc, port = start_server(workdir, engine)
+    ctx = client_context()
+    try:
+        probe = connect(port, ctx)
+        others = [login_as(port, ctx, cid) for cid in idle_ids]
+
+        # idle phase: nobody has work queued; keep everyone alive with PINGs
+        cpu0, t0 = cpu_seconds(proc.pid), time.time()
+        while time.time() - t0 < idle_seconds:
+            for c in [probe, *others]:
+                c.sendall(b"PING\n")
+            time.sleep(3)
+        idle_cpu = (cpu_seconds(proc.pid) - cpu0) / (time.time() - t0) * 100
+
+        latencies = []
+        for _ in range(requests):
+            started = time.perf_counter()
+            create_action(BENCH_CLIENT_ID, None, "UPLOAD")
+            if push:
+                harness.notify_action(proc, BENCH_CLIENT_ID)
+            read_until(probe, b"Enter file path")
+            latencies.append(time.perf_counter() - started)
+            probe.sendall(b"cancel\n")
+            read_until(probe, b"Upload canceled")
+            probe.sendall(b"PING\n")
+
+        print(
+            f"{engine:8s} push={push} idle_clients={idle} "
+            f"idle_cpu={idle_cpu:.1f}% "
+            f"dispatch_p50={percentile(latencies, 50) * 1000:.1f}ms "
+            f"dispatch_max={max(latencies) * 1000:.1f}ms"
+        )
+        for c in [probe, *others]:
+            c.close()
+    finally:
+        stop_server(proc)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--idle", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=10)
+    parser.add_argument("--idle-seconds", type=float, default=10)
+    parser.add_argument("--engines", nargs="+", default=["thread", "asyncio"])
+    parser.add_argument("--no-push", action="store_true")
+    args = parser.parse_args()
+
+    for engine in args.engines:
+        run(engine, args.idle, args.requests, args.idle_seconds, not args.no_push)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Download throughput and server CPU per GB for different send paths.
+
+DOWNLOAD_BLOCK_SIZE=0 is the old conn.sendfile() path, which on an
+SSLSocket falls back to 8 KB send() calls; the other values read the file
+into a reusable buffer of that size and sendall() it.
+
+    python bench/bench_download.py --mb 1024 --blocks 0 65536 1048576 4194304
+"""
+
+import argparse, time
+
+from harness import (
+    make_workdir,
+    start_server,
+    stop_server,
+    connect,
+    cpu_seconds,
+    add_stored_file,
+    download_file,
+    payload,
+)
+
+
+def run(engine, block, size, chunks, extra_env=None, label=None):
+    workdir = make_workdir()
+    file_id = add_stored_file(workdir, "bench.bin", chunks)
+    env = {"DOWNLOAD_BLOCK_SIZE": str(block), **(extra_env or {})}
+    proc, port = start_server(workdir, engine, extra_env=env)
+    try:
+        conn = connect(port)
+        cpu0 = cpu_seconds(proc.pid)
+        started = time.perf_counter()
+        got = download_file(conn, proc, file_id)
+        elapsed = time.perf_counter() - started
+        cpu = cpu_seconds(proc.pid) - cpu0
+        conn.close()
+        print(
+            f"{engine:8s} {label or f'block={block}':>14s} size={size >> 20}MB "
+            f"ok={got == size} time={elapsed:.2f}s "
+            f"throughput={size / elapsed / 2**20:.1f}MB/s "
+            f"cpu_per_gb={cpu / (size / 2**30):.2f}s"
+        )
+    finally:
+        stop_server(proc)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mb", type=int, default=512)
+    parser.add_argument(
+        "--blocks", type=int, nargs="+", default=[0, 64 * 1024, 1024 * 1024]
+    )
+    parser.add_argument("--engines", nargs="+", default=["thread", "asyncio"])
+    args = parser.parse_args()
+
+    size = args.mb * 1024 * 1024
+    chunks, _ = payload(size)
+    for engine in args.engines:
+        for block in args.blocks:
+            run(engine, block, size, chunks)
+
+
+if __name__ == "__main__":
+    main()
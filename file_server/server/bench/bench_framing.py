@@ -0,0 +1,113 @@
+"""Protocol v1 (text lines) against v2 (length-prefixed frames).
+
+For each engine and protocol, one client uploads many small files, then one
+large file, and downloads the large file again. Small uploads are timed from
+the path prompt to the server's completion reply: a v1 client waits for
+OK START_UPLOAD and "0" before it may send the next part, a v2 client sends
+path, size line, data and CHECKSUM in one go (tcp/framing.py). The large
+transfers show what framing costs in throughput; each is checked against
+its sha256.
+
+    python bench/bench_framing.py --files 200 --kb 16 --mb 64
+"""
+
+import argparse, hashlib, os, socket, time
+
+from harness import (
+    make_workdir,
+    BENCH_CLIENT_ID,
+    start_server,
+    stop_server,
+    connect,
+    connect_v2,
+    request_upload,
+    send_upload,
+    send_upload_v2,
+    download_file_compressed,
+    download_file_v2,
+    payload,
+    percentile,
+)
+
+
+def small_uploads(conn, proc, cid, protocol, files, size):
+    times, ok = [], 0
+    for i in range(files):
+        data = os.urandom(size)
+        checksum = hashlib.sha256(data).hexdigest()
+        request_upload(conn, proc, cid)
+        started = time.perf_counter()
+        if protocol == "v2":
+            done, _ = send_upload_v2(conn, f"small-{i}.bin", [data], size, checksum)
+        else:
+            done = send_upload(conn, f"small-{i}.bin", [data], size, checksum)
+        times.append(time.perf_counter() - started)
+        ok += done
+    return times, ok
+
+
+def run(engine, protocol, args, chunks, checksum):
+    from db.model import get_files_by_client
+
+    cid = BENCH_CLIENT_ID
+    workdir = make_workdir()
+    proc, port = start_server(workdir, engine)
+    size = args.mb * 1024 * 1024
+    try:
+        if protocol == "v2":
+            conn = connect_v2(port, client_id=cid)
+        else:
+            conn = connect(port, client_id=cid)
+            # a v2 Channel turns Nagle off itself; same footing for v1
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        times, ok = small_uploads(conn, proc, cid, protocol, args.files, args.kb * 1024)
+        mean = sum(times) / len(times)
+        print(
+            f"{engine:8s} {protocol} small x{args.files} {args.kb}KB ok={ok} "
+            f"mean={mean * 1000:.2f}ms p50={percentile(times, 50) * 1000:.2f}ms "
+            f"p99={percentile(times, 99) * 1000:.2f}ms ({1 / mean:.0f} uploads/s)"
+        )
+
+        request_upload(conn, proc, cid)
+        started = time.perf_counter()
+        if protocol == "v2":
+            ok, offsets = send_upload_v2(conn, "big.bin", chunks, size, checksum)
+        else:
+            ok, offsets = send_upload(conn, "big.bin", chunks, size, checksum), []
+        up = time.perf_counter() - started
+
+        file_id = next(
+            f["file_id"] for f in get_files_by_client(cid) if f["filename"] == "big.bin"
+        )
+        started = time.perf_counter()
+        if protocol == "v2":
+            digest, _ = download_file_v2(conn, proc, file_id, cid)
+        else:
+            digest, _, _ = download_file_compressed(conn, proc, file_id, [], cid)
+        down = time.perf_counter() - started
+        conn.close()
+        print(
+            f"{engine:8s} {protocol} large {args.mb}MB ok={ok and digest == checksum} "
+            f"up={args.mb / up:.1f}MB/s down={args.mb / down:.1f}MB/s "
+            f"progress_frames={len(offsets)}"
+        )
+    finally:
+        stop_server(proc)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=200)
+    parser.add_argument("--kb", type=int, default=16)
+    parser.add_argument("--mb", type=int, default=64)
+    parser.add_argument("--engines", nargs="+", default=["thread", "asyncio"])
+    args = parser.parse_args()
+
+    chunks, checksum = payload(args.mb * 1024 * 1024)
+    for engine in args.engines:
+        for protocol in ("v1", "v2"):
+            run(engine, protocol, args, chunks, checksum)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Heartbeat load: N distinct agents PINGing every few seconds.
+
+Logs in N clients (each its own client id), lets every one send "PING
+<token>" every --interval seconds for --rounds rounds, and reports the
+PONG round trip, the server CPU spent on the heartbeats and the number of
+clients.status writes the server made meanwhile (from the liveness
+tracker's counters; a server without the tracker writes once per PING).
+
+    python bench/bench_heartbeat.py --clients 1000 --engines asyncio
+"""
+
+import argparse, asyncio, time
+
+from harness import (
+    BENCH_PASSWORD,
+    make_workdir,
+    add_bench_clients,
+    start_server,
+    stop_server,
+    cpu_seconds,
+    client_context,
+    percentile,
+    query_control,
+)
+
+
+async def open_client(port, ctx, cid, sem):
+    async with sem:
+        reader, writer = await asyncio.open_connection(
+            "127.0.0.1", port, ssl=ctx, server_hostname="localhost"
+        )
+        writer.write(f"LOGIN {cid} {BENCH_PASSWORD}\n".encode())
+        await writer.drain()
+        reply = await reader.read(1024)
+        if b"AUTHORIZED" not in reply:
+            raise RuntimeError(f"login failed: {reply!r}")
+        return reader, writer
+
+
+async def heartbeat(reader, writer, delay, rounds, interval, latencies):
+    await asyncio.sleep(delay)
+    for n in range(rounds):
+        sent = time.perf_counter()
+        writer.write(f"PING {n}\n".encode())
+        await writer.drain()
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            if line.startswith(b"PONG"):
+                latencies.append(time.perf_counter() - sent)
+                break
+        await asyncio.sleep(interval)
+
+
+async def run(workdir, engine, ids, rounds, interval):
+    proc, port = start_server(workdir, engine)
+    ctx = client_context()
+    try:
+        sem = asyncio.Semaphore(100)
+        conns = await asyncio.gather(*(open_client(port, ctx, c, sem) for c in ids))
+        await asyncio.sleep(2.0)  # let the login transitions flush
+        before = query_control(proc, {"type": "liveness"})
+        cpu0 = cpu_seconds(proc.pid)
+
+        latencies = []
+        started = time.perf_counter()
+        await asyncio.gather(
+            *(
+                heartbeat(r, w, interval * i / len(conns), rounds, interval, latencies)
+                for i, (r, w) in enumerate(conns)
+            )
+        )
+        elapsed = time.perf_counter() - started
+        cpu = cpu_seconds(proc.pid) - cpu0
+        after = query_control(proc, {"type": "liveness"})
+        if before and after:
+            writes = after["status_writes"] - before["status_writes"]
+        else:
+            writes = len(latencies)  # one UPDATE per PING
+        print(
+            f"{engine:8s} clients={len(ids)} pings={len(latencies)} "
+            f"({len(latencies) / elapsed:.0f}/s) "
+            f"pong_p50={percentile(latencies, 50) * 1000:.1f}ms "
+            f"p99={percentile(latencies, 99) * 1000:.1f}ms "
+            f"server_cpu={cpu:.2f}s status_writes={writes}"
+        )
+        for _, w in conns:
+            w.close()
+    finally:
+        stop_server(proc)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--interval", type=float, default=3.0)
+    parser.add_argument("--engines", nargs="+", default=["thread", "asyncio"])
+    args = parser.parse_args()
+
+    workdir = make_workdir()
+    ids = add_bench_clients(args.clients)
+    for engine in args.engines:
+        asyncio.run(run(workdir, engine, ids, args.rounds, args.interval))
+
+
+if __name__ == "__main__":
+    main()
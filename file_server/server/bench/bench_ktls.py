@@ -0,0 +1,71 @@
+"""Download throughput and server CPU per GB with and without kernel TLS.
+
+Runs the thread engine twice on the same file, once plain and once with
+TCP_KTLS=1, and prints the server's "[TLS]" startup line so it is clear
+which path was really active (kTLS silently falls back to userspace TLS
+on hosts without the tls kernel module or a kTLS-enabled OpenSSL).
+
+    python bench/bench_ktls.py --mb 2048
+"""
+
+import argparse, os, time
+
+from harness import (
+    make_workdir,
+    start_server,
+    stop_server,
+    connect,
+    cpu_seconds,
+    add_stored_file,
+    download_file,
+    payload,
+)
+
+
+def tls_mode(workdir):
+    with open(os.path.join(workdir, "server-thread.log")) as f:
+        for line in f:
+            if line.startswith("[TLS]"):
+                return line[len("[TLS]") :].strip()
+    return "unknown"
+
+
+def run(ktls, size, chunks, rounds):
+    workdir = make_workdir()
+    file_id = add_stored_file(workdir, "bench.bin", chunks)
+    proc, port = start_server(
+        workdir, "thread", extra_env={"TCP_KTLS": "1" if ktls else "0"}
+    )
+    try:
+        conn = connect(port)
+        cpu0 = cpu_seconds(proc.pid)
+        started = time.perf_counter()
+        ok = all(download_file(conn, proc, file_id) == size for _ in range(rounds))
+        elapsed = time.perf_counter() - started
+        cpu = cpu_seconds(proc.pid) - cpu0
+        conn.close()
+        total = size * rounds
+        print(
+            f"ktls={'on ' if ktls else 'off'} ok={ok} "
+            f"throughput={total / elapsed / 2**20:.1f}MB/s "
+            f"cpu_per_gb={cpu / (total / 2**30):.2f}s "
+            f"path={tls_mode(workdir)}"
+        )
+    finally:
+        stop_server(proc)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mb", type=int, default=512)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    size = args.mb * 1024 * 1024
+    chunks, _ = payload(size)
+    for ktls in (False, True):
+        run(ktls, size, chunks, args.rounds)
+
+
+if __name__ == "__main__":
+    main()
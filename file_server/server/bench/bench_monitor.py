@@ -0,0 +1,76 @@
+"""Monitor page data: per-client file scans (N+1) vs one aggregated query.
+
+"n+1" reproduces what api/monitor_api.py used to do: list the clients,
+then load every file row of each client to count them and sum the sizes.
+"grouped" calls db.model.list_client_usage.
+
+    python bench/bench_monitor.py --clients 2000 --files 50
+"""
+
+import argparse, time
+
+from harness import make_workdir, add_bench_clients
+
+
+def fill(clients, files):
+    from db.database import get_connection
+
+    ids = add_bench_clients(clients)
+    with get_connection() as conn:
+        conn.executemany(
+            """
+            INSERT INTO files (client_id, filename, size, received, upload_time, status)
+            VALUES (?, ?, ?, ?, datetime('now'), 'UPLOADED')
+            """,
+            (
+                (cid, f"f{n}.bin", 1000 + n, 1000 + n)
+                for cid in ids
+                for n in range(files)
+            ),
+        )
+
+
+def n_plus_one():
+    from db.model import list_clients, get_files_by_client
+
+    usage = {}
+    for c in list_clients():
+        files = get_files_by_client(c["client_id"])
+        usage[c["client_id"]] = (len(files), sum(f["size"] for f in files))
+    return usage
+
+
+def grouped():
+    from db.model import list_client_usage
+
+    return {
+        c["client_id"]: (c["file_count"], c["used_bytes"]) for c in list_client_usage()
+    }
+
+
+def run(label, fn, rounds):
+    fn()  # warm the page cache and the statement cache
+    started = time.perf_counter()
+    for _ in range(rounds):
+        result = fn()
+    elapsed = (time.perf_counter() - started) / rounds
+    print(f"{label:8s} clients={len(result)} per_request={elapsed * 1000:.1f}ms")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--files", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    make_workdir()
+    fill(args.clients, args.files)
+    old = run("n+1", n_plus_one, args.rounds)
+    new = run("grouped", grouped, args.rounds)
+    print(f"same totals: {old == new}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""One large upload over 1..N parallel streams.
+
+Each run starts a fresh server and uploads the same payload, asking for the
+given number of streams (1 = the classic single-stream upload). With more
+streams the server receives, decrypts and hashes ranges on several threads
+and pwrite()s them into the preallocated file.
+
+With --resume it instead drops a two-stream upload of --ranges ranges after
+two whole ranges per stream, then resumes it (in place and across a server
+restart) and reports which ranges had to be sent again.
+
+    python bench/bench_parallel.py --mb 1024 --streams 1 2 4 8
+    python bench/bench_parallel.py --resume --ranges 11
+"""
+
+import argparse, os, time
+
+from harness import (
+    BENCH_CLIENT_ID,
+    make_workdir,
+    start_server,
+    stop_server,
+    connect,
+    cpu_seconds,
+    upload_file_parallel,
+    payload,
+    tree_checksum,
+    request_upload,
+    notify_action,
+    read_until,
+    send_ranges,
+)
+
+SEGMENT_SIZE = 64 * 1024 * 1024
+# smaller ranges for the resume run, so it needs no large payload
+RESUME_SEGMENT = 4 * 1024 * 1024
+
+
+def run(engine, streams, size, chunks, checksums):
+    workdir = make_workdir()
+    proc, port = start_server(
+        workdir, engine, extra_env={"UPLOAD_MAX_STREAMS": str(max(streams, 2))}
+    )
+    try:
+        conn = connect(port)
+        cpu0 = cpu_seconds(proc.pid)
+        started = time.perf_counter()
+        ok = upload_file_parallel(
+            conn, proc, port, "bench.bin", chunks, size, checksums, streams
+        )
+        elapsed = time.perf_counter() - started
+        cpu = cpu_seconds(proc.pid) - cpu0
+        conn.close()
+        print(
+            f"{engine:8s} streams={streams} size={size >> 20}MB ok={ok} "
+            f"time={elapsed:.2f}s throughput={size / elapsed / 2**20:.1f}MB/s "
+            f"server_cpu={cpu / elapsed * 100:.0f}%"
+        )
+    finally:
+        stop_server(proc)
+
+
+def run_resume(engine, ranges, restart):
+    workdir = make_workdir()
+    from db.model import get_interrupted_action
+
+    env = {
+        "HASH_SEGMENT_SIZE": str(RESUME_SEGMENT),
+        "UPLOAD_STREAM_IDLE_TIMEOUT": "3",
+    }
+    # the last range is a partial one
+    size = (ranges - 1) * RESUME_SEGMENT + RESUME_SEGMENT // 3
+    chunks, checksum = payload(size, RESUME_SEGMENT)
+    tree = tree_checksum(chunks, RESUME_SEGMENT)
+    proc, port = start_server(workdir, engine, extra_env=env)
+    try:
+        conn = connect(port)
+        request_upload(conn, proc)
+        conn.sendall(b"resume.bin\n")
+        read_until(conn, b"OK START_UPLOAD")
+        conn.sendall(f"{size} STREAMS 2\n".encode())
+        header = read_until(conn, b"\n").decode().strip()
+        first = send_ranges(port, header, chunks, RESUME_SEGMENT, limit=2)
+        read_until(conn, b"RANGES INTERRUPTED")
+        conn.close()
+        # the reply goes out just before the action is marked INTERRUPTED
+        while not get_interrupted_action(BENCH_CLIENT_ID):
+            time.sleep(0.05)
+        if restart:
+            stop_server(proc)
+            proc, port = start_server(workdir, engine, extra_env=env)
+
+        conn = connect(port)
+        notify_action(proc, BENCH_CLIENT_ID)
+        reply = read_until(conn, b"\n")
+        while not reply.rstrip(b"\n").split(b"\n")[-1].startswith(b"RANGES"):
+            reply += read_until(conn, b"\n")
+        header = reply.rstrip(b"\n").split(b"\n")[-1].decode()
+        second = send_ranges(port, header, chunks, RESUME_SEGMENT)
+        read_until(conn, b"RANGES DONE")
+        conn.sendall(f"CHECKSUM {checksum} {tree}\n".encode())
+        reply = read_until(conn, b"\n")
+        while b"completed" not in reply and b"ERROR" not in reply:
+            reply += conn.recv(4096)
+        conn.close()
+        done = sorted(set(first) - set(second))
+        print(
+            f"{engine:8s} ranges={ranges} restart={restart} "
+            f"done_before_drop={len(done)} resent={len(second)} {second} "
+            f"ok={b'completed' in reply}"
+        )
+    finally:
+        stop_server(proc)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mb", type=int, default=512)
+    parser.add_argument("--streams", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--engines", nargs="+", default=["thread", "asyncio"])
+    parser.add_argument("--resume", action="store_true")
+    parser.add_argument("--ranges", type=int, default=11)
+    args = parser.parse_args()
+
+    print(f"cpus={os.cpu_count()}")
+    if args.resume:
+        for engine in args.engines:
+            for restart in (False, True):
+                run_resume(engine, args.ranges, restart)
+        return
+    size = args.mb * 1024 * 1024
+    chunks, checksum = payload(size)
+    checksums = (checksum, tree_checksum(chunks, SEGMENT_SIZE))
+    for engine in args.engines:
+        for streams in args.streams:
+            run(engine, streams, size, chunks, checksums)
+
+
+if __name__ == "__main__":
+    main()
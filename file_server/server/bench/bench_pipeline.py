@@ -0,0 +1,84 @@
+"""Aggregate upload throughput with concurrent uploads, pipeline on vs off.
+
+Starts one server per UPLOAD_PIPELINE_DEPTH value (0 = write and hash inline
+on the connection thread) and runs N clients uploading at the same time.
+Reports wall-clock throughput over all uploads and server CPU use; the
+pipeline pays off on multi-core machines, where hashing and disk writes of
+one upload overlap with its socket reads.
+
+    python bench/bench_pipeline.py --clients 8 --mb 256 --depths 0 2 4 8
+"""
+
+import argparse, os, threading, time
+
+from harness import (
+    make_workdir,
+    add_bench_clients,
+    start_server,
+    stop_server,
+    connect,
+    cpu_seconds,
+    upload_file,
+    payload,
+)
+
+
+def run(engine, depth, clients, size, chunks, checksum):
+    workdir = make_workdir()
+    ids = add_bench_clients(clients)
+    proc, port = start_server(
+        workdir, engine, extra_env={"UPLOAD_PIPELINE_DEPTH": str(depth)}
+    )
+    try:
+        conns = [connect(port, client_id=cid) for cid in ids]
+        results = [False] * clients
+        start = threading.Barrier(clients + 1)
+
+        def worker(i):
+            start.wait()
+            results[i] = upload_file(
+                conns[i], proc, f"bench-{i}.bin", chunks, size, checksum, ids[i]
+            )
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(clients)]
+        for t in threads:
+            t.start()
+        cpu0 = cpu_seconds(proc.pid)
+        start.wait()
+        started = time.perf_counter()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - started
+        cpu = cpu_seconds(proc.pid) - cpu0
+        for c in conns:
+            c.close()
+
+        total = size * clients
+        print(
+            f"{engine:8s} depth={depth} clients={clients} size={size >> 20}MB "
+            f"ok={all(results)} time={elapsed:.2f}s "
+            f"throughput={total / elapsed / 2**20:.1f}MB/s "
+            f"server_cpu={cpu / elapsed * 100:.0f}%"
+        )
+    finally:
+        stop_server(proc)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--mb", type=int, default=128)
+    parser.add_argument("--depths", type=int, nargs="+", default=[0, 4])
+    parser.add_argument("--engines", nargs="+", default=["thread", "asyncio"])
+    args = parser.parse_args()
+
+    print(f"cpus={os.cpu_count()}")
+    size = args.mb * 1024 * 1024
+    chunks, checksum = payload(size)
+    for engine in args.engines:
+        for depth in args.depths:
+            run(engine, depth, args.clients, size, chunks, checksum)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Reconnect storm: every agent logs in again at once, auth cache off vs on.
+
+Creates N clients whose password hash uses a realistic bcrypt cost, lets
+them all log in and stay connected for longer than the cache TTL (the
+"before the blip" state), drops every connection and then reconnects all
+of them concurrently. Reports how long the storm takes to be fully
+authorized, login latency percentiles, the server CPU it burned and the
+server's cache hits/misses over both waves (the "auth" control query), with
+AUTH_CACHE_TTL=0 (bcrypt on every LOGIN) and with the credential cache at
+--ttl seconds (short, so the sessions can outlive it).
+
+    python bench/bench_reconnect.py --clients 200 --cost 12 --ttl 5
+"""
+
+import argparse, asyncio, time
+
+import bcrypt
+
+from harness import (
+    BENCH_CLIENT_ID,
+    BENCH_PASSWORD,
+    make_workdir,
+    start_server,
+    stop_server,
+    cpu_seconds,
+    client_context,
+    percentile,
+    query_control,
+)
+
+
+def add_clients(count, cost):
+    from db.model import get_client, add_client
+
+    base = get_client(BENCH_CLIENT_ID)
+    pw_hash = bcrypt.hashpw(BENCH_PASSWORD.encode(), bcrypt.gensalt(cost)).decode()
+    ids = [f"storm-{i}" for i in range(count)]
+    for cid in ids:
+        add_client(cid, pw_hash, 100, base["user_id"])
+    return ids
+
+
+async def login(port, ctx, cid, latencies):
+    started = time.perf_counter()
+    reader, writer = await asyncio.open_connection(
+        "127.0.0.1", port, ssl=ctx, server_hostname="localhost"
+    )
+    writer.write(f"LOGIN {cid} {BENCH_PASSWORD}\n".encode())
+    await writer.drain()
+    reply = await reader.read(1024)
+    if b"AUTHORIZED" not in reply:
+        raise RuntimeError(f"login failed: {reply!r}")
+    latencies.append(time.perf_counter() - started)
+    return writer
+
+
+async def wave(port, ids, hold=0.0):
+    ctx = client_context()
+    latencies = []
+    started = time.perf_counter()
+    writers = await asyncio.gather(*(login(port, ctx, cid, latencies) for cid in ids))
+    elapsed = time.perf_counter() - started
+    await asyncio.sleep(hold)
+    for w in writers:
+        w.close()
+    await asyncio.sleep(0.5)  # let the server notice the drops
+    return elapsed, latencies
+
+
+async def run(workdir, engine, ids, ttl):
+    env = {"AUTH_CACHE_TTL": str(ttl)}
+    proc, port = start_server(workdir, engine, extra_env=env)
+    try:
+        # everyone connected, for longer than the TTL, before the blip
+        await wave(port, ids, hold=ttl + 1)
+        cpu0 = cpu_seconds(proc.pid)
+        elapsed, latencies = await wave(port, ids)
+        cpu = cpu_seconds(proc.pid) - cpu0
+        print(
+            f"{engine:8s} cache={'on ' if ttl else 'off'} clients={len(ids)} "
+            f"storm={elapsed:.2f}s login_p50={percentile(latencies, 50) * 1000:.0f}ms "
+            f"p99={percentile(latencies, 99) * 1000:.0f}ms server_cpu={cpu:.2f}s"
+        )
+        auth = query_control(proc, {"type": "auth"}) or {}
+        print(
+            f"{engine:8s} auth cache: hits={auth.get('hits')} misses={auth.get('misses')}"
+        )
+    finally:
+        stop_server(proc)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--cost", type=int, default=12)
+    parser.add_argument("--ttl", type=float, default=5.0)
+    parser.add_argument("--engines", nargs="+", default=["thread", "asyncio"])
+    args = parser.parse_args()
+
+    workdir = make_workdir()
+    ids = add_clients(args.clients, args.cost)
+    for engine in args.engines:
+        for ttl in (0, args.ttl):
+            asyncio.run(run(workdir, engine, ids, ttl))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""TLS handshake throughput: full handshakes vs resumed sessions.
+
+Opens N connections one after another and completes only the TLS
+handshake on each, first without a session (full handshake: certificate
+signature + key exchange) and then presenting the session ticket of an
+earlier logged-in connection. Reports handshakes/s, server CPU per
+handshake and the server's own full/resumed counters from the control
+channel.
+
+    python bench/bench_resume.py --handshakes 500
+"""
+
+import argparse, socket, time
+
+from harness import (
+    make_workdir,
+    start_server,
+    stop_server,
+    cpu_seconds,
+    client_context,
+    connect,
+    percentile,
+    query_control,
+)
+
+
+def handshakes(port, ctx, count, session=None):
+    latencies, reused = [], 0
+    started = time.perf_counter()
+    for _ in range(count):
+        t0 = time.perf_counter()
+        raw = socket.create_connection(("127.0.0.1", port))
+        conn = ctx.wrap_socket(raw, server_hostname="localhost", session=session)
+        latencies.append(time.perf_counter() - t0)
+        reused += conn.session_reused
+        conn.close()
+    return time.perf_counter() - started, latencies, reused
+
+
+def run(workdir, engine, count):
+    proc, port = start_server(workdir, engine)
+    try:
+        ctx = client_context()
+        # a logged-in connection, read far enough for the tickets to arrive
+        conn = connect(port, ctx)
+        session = conn.session
+        conn.close()
+        for label, sess in (("full", None), ("resumed", session)):
+            before = query_control(proc, {"type": "tls"})
+            cpu0 = cpu_seconds(proc.pid)
+            elapsed, latencies, reused = handshakes(port, ctx, count, sess)
+            cpu = cpu_seconds(proc.pid) - cpu0
+            after = query_control(proc, {"type": "tls"})
+            print(
+                f"{engine:8s} {label:8s} n={count} {count / elapsed:7.0f} hs/s "
+                f"p50={percentile(latencies, 50) * 1000:.2f}ms "
+                f"p99={percentile(latencies, 99) * 1000:.2f}ms "
+                f"server_cpu/hs={cpu / count * 1e6:.0f}us reused={reused} "
+                f"server full+{after['full'] - before['full']} "
+                f"resumed+{after['resumed'] - before['resumed']}"
+            )
+        print(f"{engine:8s} server resumption_ratio={after['resumption_ratio']}")
+    finally:
+        stop_server(proc)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--handshakes", type=int, default=500)
+    parser.add_argument("--engines", nargs="+", default=["thread", "asyncio"])
+    args = parser.parse_args()
+
+    workdir = make_workdir()
+    for engine in args.engines:
+        run(workdir, engine, args.handshakes)
+
+
+if __name__ == "__main__":
+    main()
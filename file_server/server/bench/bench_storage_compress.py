@@ -0,0 +1,122 @@
+"""At-rest compression of stored blobs.
+
+Uploads a file of log-like text and a file of random bytes, downloads both,
+runs one pass of the compression job (utils/blobstore.py) in this process
+and downloads them again. Reports the job's speed, the bytes on disk
+before and after, and download throughput from the raw and from the
+compressed blob; every download is checked against the original sha256.
+Random data should be left raw. seek= is the mean time to open the stored
+content and read one byte at a random offset, as a resumed download does.
+
+    python bench/bench_storage_compress.py --mb 64 --codecs zlib lzma
+"""
+
+import argparse, hashlib, os, random, time
+
+from harness import (
+    make_workdir,
+    add_bench_clients,
+    start_server,
+    stop_server,
+    connect,
+    upload_file,
+    download_file_compressed,
+)
+from bench_compress import log_text, split
+from bench_dedup import disk_bytes
+
+
+def download(port, proc, cid, file_id):
+    conn = connect(port, client_id=cid)
+    started = time.perf_counter()
+    digest, _, got = download_file_compressed(conn, proc, file_id, [], cid)
+    elapsed = time.perf_counter() - started
+    conn.close()
+    return digest, got / 2**20 / elapsed
+
+
+def seek_ms(f, count=200):
+    from utils.blobstore import open_stored
+
+    offsets = random.Random(f["file_id"]).choices(range(f["size"]), k=count)
+    started = time.perf_counter()
+    for offset in offsets:
+        with open_stored(f) as stored:
+            stored.seek(offset)
+            stored.read(1)
+    return (time.perf_counter() - started) / count * 1000
+
+
+def run(workdir, engine, codec, datasets, ids):
+    from db.model import get_files_by_client
+    from utils.blobstore import compress_idle_blobs, dedup_stats
+
+    proc, port = start_server(workdir, engine)
+    storage = os.path.join(workdir, "storage")
+    try:
+        files = []
+        for cid, (name, data) in zip(ids, datasets):
+            checksum = hashlib.sha256(data).hexdigest()
+            conn = connect(port, client_id=cid)
+            upload_file(conn, proc, name, split(data), len(data), checksum, cid)
+            conn.close()
+            files.append((cid, name, checksum, get_files_by_client(cid)[0]))
+
+        before = disk_bytes(storage)
+        raw = [download(port, proc, cid, f["file_id"]) for cid, _, _, f in files]
+        started = time.perf_counter()
+        count, saved = compress_idle_blobs(codec, min_age=0)
+        elapsed = time.perf_counter() - started
+        after = disk_bytes(storage)
+        total = sum(len(data) for _, data in datasets) / 2**20
+        print(
+            f"{engine:8s} {codec:5s} job: {count} blobs {elapsed:.2f}s "
+            f"({total / elapsed:.1f}MB/s) disk {before / 2**20:.1f}MB -> "
+            f"{after / 2**20:.1f}MB saved={saved / 2**20:.1f}MB"
+        )
+
+        for (cid, name, checksum, f), (digest_raw, speed_raw) in zip(files, raw):
+            digest, speed = download(port, proc, cid, f["file_id"])
+            f = get_files_by_client(cid)[0]
+            print(
+                f"{engine:8s} {codec:5s} {name:10s} "
+                f"stored={f['stored_codec'] or 'raw'} "
+                f"{f['stored_size'] / 2**20:.1f}MB "
+                f"ok={digest_raw == checksum and digest == checksum} "
+                f"download raw={speed_raw:.1f}MB/s now={speed:.1f}MB/s "
+                f"seek={seek_ms(f):.2f}ms"
+            )
+        stats = dedup_stats()
+        print(
+            f"{engine:8s} {codec:5s} store: compressed_blobs="
+            f"{stats['compressed_blobs']} disk_bytes={stats['disk_bytes']}"
+        )
+    finally:
+        stop_server(proc)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mb", type=int, default=64)
+    parser.add_argument("--codecs", nargs="+", default=["zlib", "lzma"])
+    parser.add_argument("--engines", nargs="+", default=["thread", "asyncio"])
+    args = parser.parse_args()
+
+    size = args.mb * 1024 * 1024
+    workdir = make_workdir()
+    # the compression job runs in this process and must see the bench storage
+    os.environ["STORAGE_DIR"] = os.path.join(workdir, "storage")
+    ids = iter(add_bench_clients(2 * len(args.engines) * len(args.codecs)))
+    for engine in args.engines:
+        for n, codec in enumerate(args.codecs):
+            # fresh content per run, or the blobs are deduplicated away
+            seed = f"{engine}-{n}"
+            datasets = [
+                ("text.log", log_text(size, seed=seed)),
+                ("random.bin", random.Random(seed).randbytes(size)),
+            ]
+            run(workdir, engine, codec, datasets, [next(ids), next(ids)])
+
+
+if __name__ == "__main__":
+    main()
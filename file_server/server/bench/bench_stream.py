@@ -0,0 +1,83 @@
+"""Peak memory and time to first byte of a huge file list, buffered vs streamed.
+
+Fills one client with N file rows (default 1M), then fetches the whole list
+once per mode from a fresh API process and reports that process' peak RSS
+(VmHWM), the time to the first response byte and the total time.
+"buffered" is the regular jsonify path (with FILE_PAGE_MAX raised so one
+page holds every row), "json" and "ndjson" the ?stream= modes.
+
+    python bench/bench_stream.py --rows 1000000
+"""
+
+import argparse, http.client, time
+
+from harness import (
+    BENCH_CLIENT_ID,
+    make_workdir,
+    start_api,
+    stop_server,
+    rss_kb,
+    peak_rss_kb,
+)
+
+
+def fill(rows):
+    from db.database import get_connection
+
+    with get_connection() as conn:
+        conn.executemany(
+            """
+            INSERT INTO files (client_id, filename, size, received, upload_time, status)
+            VALUES (?, ?, ?, ?, datetime('now'), 'UPLOADED')
+            """,
+            ((BENCH_CLIENT_ID, f"file-{n:07d}.bin", n, n) for n in range(rows)),
+        )
+
+
+def run(workdir, mode, rows):
+    proc, port = start_api(workdir, extra_env={"FILE_PAGE_MAX": str(rows)})
+    try:
+        base = rss_kb(proc.pid)
+        query = f"limit={rows}" if mode == "buffered" else f"stream={mode}"
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=600)
+        started = time.perf_counter()
+        conn.request(
+            "GET",
+            f"/api/storage/{BENCH_CLIENT_ID}/files?{query}",
+            headers={"Authorization": "Bearer bench"},
+        )
+        resp = conn.getresponse()
+        resp.read(1)
+        ttfb = time.perf_counter() - started
+        size = 1
+        while True:
+            block = resp.read(1024 * 1024)
+            if not block:
+                break
+            size += len(block)
+        elapsed = time.perf_counter() - started
+        conn.close()
+        print(
+            f"{mode:8s} rows={rows} status={resp.status} body={size / 2**20:.0f}MB "
+            f"ttfb={ttfb * 1000:.0f}ms total={elapsed:.2f}s "
+            f"peak_rss={peak_rss_kb(proc.pid) / 1024:.0f}MB "
+            f"(+{(peak_rss_kb(proc.pid) - base) / 1024:.0f}MB over idle)"
+        )
+    finally:
+        stop_server(proc)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--modes", nargs="+", default=["buffered", "json", "ndjson"])
+    args = parser.parse_args()
+
+    workdir = make_workdir()
+    fill(args.rows)
+    for mode in args.modes:
+        run(workdir, mode, args.rows)
+
+
+if __name__ == "__main__":
+    main()
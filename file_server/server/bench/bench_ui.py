@@ -0,0 +1,93 @@
+"""Page render latency of server-ui with and without the pooled backend session.
+
+Runs the API from app.py on a free port and renders the monitor, storage
+and client manager pages through the server-ui app in this process.
+"fresh" sends every backend call through requests.request, a new
+connection each time, which is what the routes used to do; "pooled"
+uses utils/backend.py's keep-alive session as shipped. Werkzeug's
+development server closes every connection, so against `python app.py`
+the pooled session saves only the per-call Session setup; behind a
+keep-alive WSGI server it also saves the TCP handshakes. The last lines
+compare the client manager's old two backend calls with the combined
+/api/clients/overview.
+
+    python bench/bench_ui.py --renders 300
+"""
+
+import argparse, os, sys, time
+
+from harness import SERVER_DIR, make_workdir, start_api, stop_server, percentile
+
+UI_DIR = os.path.join(os.path.dirname(SERVER_DIR), "server-ui")
+
+
+def load_ui(port):
+    # the server-ui package layout (routes/, utils/, config.py) clashes with
+    # the server's utils/ package, so it gets the import path to itself
+    os.environ["BACKEND_URL"] = f"http://127.0.0.1:{port}"
+    sys.path.insert(0, UI_DIR)
+    for name in list(sys.modules):
+        if name == "utils" or name.startswith("utils.") or name == "config":
+            del sys.modules[name]
+    from app import app
+    from utils import backend
+
+    return app, backend
+
+
+def run(label, client, pages, renders):
+    for path in pages:
+        client.get(path)  # warm up
+    for path in pages:
+        times = []
+        for _ in range(renders):
+            started = time.perf_counter()
+            r = client.get(path)
+            times.append(time.perf_counter() - started)
+            assert r.status_code == 200, (path, r.status_code)
+        print(
+            f"{label:6s} {path:28s} p50={percentile(times, 50) * 1000:.2f}ms "
+            f"p99={percentile(times, 99) * 1000:.2f}ms"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--renders", type=int, default=200)
+    args = parser.parse_args()
+
+    workdir = make_workdir()
+    api, port = start_api(workdir)
+    try:
+        app, backend = load_ui(port)
+        client = app.test_client()
+        with client.session_transaction() as s:
+            s.update({"token": "bench", "username": "bench", "role": "ADMIN"})
+        pages = ["/client-monitor", "/client-storage/bench-client", "/client-manager"]
+
+        pooled = backend.session
+        backend.session = backend.requests  # requests.request: new connection
+        run("fresh", client, pages, args.renders)
+        backend.session = pooled
+        run("pooled", client, pages, args.renders)
+
+        for label, paths in (
+            ("2 calls", ["/api/clients", "/api/users"]),
+            ("overview", ["/api/clients/overview"]),
+        ):
+            times = []
+            for _ in range(args.renders):
+                started = time.perf_counter()
+                for path in paths:
+                    backend.get(path).json()
+                times.append(time.perf_counter() - started)
+            print(
+                f"manager data {label:8s} p50={percentile(times, 50) * 1000:.2f}ms "
+                f"p99={percentile(times, 99) * 1000:.2f}ms"
+            )
+    finally:
+        stop_server(api)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""Upload throughput over loopback TLS for different receive buffer sizes.
+
+Starts one server per UPLOAD_BUFFER_SIZE value and pushes the same payload
+through the v1 upload dialogue.
+
+    python bench/bench_upload.py --mb 512 --buffers 4096 262144 1048576 4194304
+"""
+
+import argparse, time
+
+from harness import (
+    make_workdir,
+    start_server,
+    stop_server,
+    connect,
+    upload_file,
+    payload,
+)
+
+
+def run(engine, buffer_size, size, chunks, checksum):
+    workdir = make_workdir()
+    proc, port = start_server(
+        workdir, engine, extra_env={"UPLOAD_BUFFER_SIZE": str(buffer_size)}
+    )
+    try:
+        conn = connect(port)
+        started = time.perf_counter()
+        ok = upload_file(conn, proc, "bench.bin", chunks, size, checksum)
+        elapsed = time.perf_counter() - started
+        conn.close()
+        print(
+            f"{engine:8s} buffer={buffer_size:>8d} size={size >> 20}MB "
+            f"ok={ok} time={elapsed:.2f}s throughput={size / elapsed / 2**20:.1f}MB/s"
+        )
+    finally:
+        stop_server(proc)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mb", type=int, default=256)
+    parser.add_argument(
+        "--buffers", type=int, nargs="+", default=[4096, 256 * 1024, 1024 * 1024]
+    )
+    parser.add_argument("--engines", nargs="+", default=["thread"])
+    args = parser.parse_args()
+
+    size = args.mb * 1024 * 1024
+    chunks, checksum = payload(size)
+    for engine in args.engines:
+        for buffer_size in args.buffers:
+            run(engine, buffer_size, size, chunks, checksum)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,598 @@
+"""Shared helpers for the benchmarks in this folder.
+
+Every benchmark runs against a throw-away SQLite database and storage folder
+in a temp dir, never against data/data.db.
+"""
+
+import os, sys, ssl, time, socket, subprocess, tempfile
+
+SERVER_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, SERVER_DIR)
+
+BENCH_CLIENT_ID = "bench-client"
+BENCH_PASSWORD = "bench-pass"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def make_workdir():
+    """Create a temp dir with an initialised DB holding one bench client."""
+    workdir = tempfile.mkdtemp(prefix="fs-bench-")
+    db_path = os.path.join(workdir, "data.db")
+    os.environ["DATA_DB_PATH"] = db_path
+
+    import bcrypt
+    from db import database
+    from db.database import init_db
+    from db.model import create_user, add_client, get_user_by_username
+
+    database.DB_PATH = db_path
+    database.close_pool()
+    init_db()
+    create_user("bench", bcrypt.hashpw(b"bench", bcrypt.gensalt(4)).decode(), "ADMIN")
+    user = get_user_by_username("bench")
+    pw_hash = bcrypt.hashpw(BENCH_PASSWORD.encode(), bcrypt.gensalt(4)).decode()
+    add_client(BENCH_CLIENT_ID, pw_hash, 100, user["user_id"])
+    return workdir
+
+
+def add_bench_clients(count):
+    """Extra clients bench-client-1..count sharing the bench password."""
+    from db.model import get_client, add_client
+
+    base = get_client(BENCH_CLIENT_ID)
+    ids = [f"{BENCH_CLIENT_ID}-{i}" for i in range(1, count + 1)]
+    for cid in ids:
+        add_client(cid, base["password_hash"], 100, base["user_id"])
+    return ids
+
+
+def start_server(workdir, engine="thread", extra_args=(), extra_env=None):
+    port = free_port()
+    control_port = free_port()
+    env = dict(os.environ)
+    env.update(
+        {
+            "DATA_DB_PATH": os.path.join(workdir, "data.db"),
+            "TCP_HOST": "127.0.0.1",
+            "TCP_PORT": str(port),
+            "TCP_CONTROL_PORT": str(control_port),
+            "STORAGE_DIR": os.path.join(workdir, "storage"),
+            "PYTHONUNBUFFERED": "1",
+        }
+    )
+    env.update(extra_env or {})
+    log = open(os.path.join(workdir, f"server-{engine}.log"), "wb")
+    proc = subprocess.Popen(
+        [sys.executable, "tcp/tcp_server.py", "--engine", engine, *extra_args],
+        cwd=SERVER_DIR,
+        env=env,
+        stdout=log,
+        stderr=subprocess.STDOUT,
+    )
+    deadline = time.time() + 15
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            proc.control_port = control_port
+            proc.control_key = control_key(workdir)
+            return proc, port
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("server did not start")
+
+
+API_MAIN = (
+    "import sys; from werkzeug.serving import make_server; from app import app; "
+    "make_server('127.0.0.1', int(sys.argv[1]), app, threaded=True).serve_forever()"
+)
+
+
+def start_api(workdir, extra_env=None):
+    """Run the Flask API (app.py) on a free port; stop it with stop_server."""
+    port = free_port()
+    env = dict(os.environ)
+    env.update(
+        {
+            "DATA_DB_PATH": os.path.join(workdir, "data.db"),
+            "TCP_CONTROL_PORT": str(free_port()),
+            "PYTHONUNBUFFERED": "1",
+        }
+    )
+    env.update(extra_env or {})
+    log = open(os.path.join(workdir, "api.log"), "wb")
+    proc = subprocess.Popen(
+        [sys.executable, "-c", API_MAIN, str(port)],
+        cwd=SERVER_DIR,
+        env=env,
+        stdout=log,
+        stderr=subprocess.STDOUT,
+    )
+    deadline = time.time() + 15
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return proc, port
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("api did not start")
+
+
+def stop_server(proc):
+    proc.terminate()
+    try:
+        proc.wait(5)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+def control_key(workdir):
+    """The control channel key the server and API of this workdir share."""
+    from utils.tcp_control import load_key
+
+    return load_key(os.path.join(workdir, "control.key"))
+
+
+def notify_action(proc, client_id):
+    """What api/storage_api.py does after create_action."""
+    from utils.tcp_control import seal
+
+    msg = seal({"type": "action", "client_id": client_id}, proc.control_key)
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.sendto(msg, ("127.0.0.1", proc.control_port))
+
+
+def query_control(proc, message, timeout=2):
+    """Reply of the server's control channel to message; None if silent."""
+    from utils.tcp_control import seal, unseal
+
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.settimeout(timeout)
+        s.sendto(seal(message, proc.control_key), ("127.0.0.1", proc.control_port))
+        try:
+            return unseal(s.recvfrom(65535)[0], proc.control_key)
+        except socket.timeout:
+            return None
+
+
+def cpu_seconds(pid):
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def rss_kb(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def peak_rss_kb(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1])
+    return 0
+
+
+def client_context():
+    ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    ctx.check_hostname = False
+    ctx.verify_mode = ssl.CERT_NONE
+    return ctx
+
+
+def connect(port, ctx=None, client_id=BENCH_CLIENT_ID):
+    """Blocking TLS client that is already logged in as `client_id`."""
+    ctx = ctx or client_context()
+    raw = socket.create_connection(("127.0.0.1", port))
+    conn = ctx.wrap_socket(raw, server_hostname="localhost")
+    conn.sendall(f"LOGIN {client_id} {BENCH_PASSWORD}\n".encode())
+    reply = conn.recv(1024)
+    if b"AUTHORIZED" not in reply:
+        raise RuntimeError(f"login failed: {reply!r}")
+    return conn
+
+
+def connect_v2(port, ctx=None, client_id=BENCH_CLIENT_ID):
+    """Client logged in with LOGIN2: a tcp.framing.Channel.
+
+    A server without protocol v2 is logged into again with LOGIN, and the
+    plain v1 socket is returned.
+    """
+    from tcp.framing import Channel, LOGIN_V2
+
+    ctx = ctx or client_context()
+    raw = socket.create_connection(("127.0.0.1", port))
+    conn = ctx.wrap_socket(raw, server_hostname="localhost")
+    conn.sendall(f"{LOGIN_V2} {client_id} {BENCH_PASSWORD}\n".encode())
+    reply = conn.recv(1024)
+    if reply.startswith(b"ERROR UNKNOWN_COMMAND"):
+        conn.close()
+        return connect(port, ctx, client_id)
+    if not reply.startswith(b"OK AUTHORIZED V2"):
+        raise RuntimeError(f"login failed: {reply!r}")
+    return Channel(conn)
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[k]
+
+
+def read_until(conn, marker):
+    buf = b""
+    while marker not in buf:
+        chunk = conn.recv(65536)
+        if not chunk:
+            raise RuntimeError(f"connection closed waiting for {marker!r}")
+        buf += chunk
+    return buf
+
+
+def request_upload(conn, proc, client_id=BENCH_CLIENT_ID):
+    """Queue an UPLOAD action like the API does and wait for the prompt."""
+    from db.model import create_action
+
+    create_action(client_id, None, "UPLOAD")
+    notify_action(proc, client_id)
+    read_until(conn, b"Enter file path")
+
+
+def upload_file(conn, proc, name, chunks, size, checksum, client_id=BENCH_CLIENT_ID):
+    """Run the v1 upload dialogue; chunks is an iterable of bytes-like."""
+    request_upload(conn, proc, client_id)
+    return send_upload(conn, name, chunks, size, checksum)
+
+
+def send_upload(conn, name, chunks, size, checksum):
+    """The v1 upload dialogue once the client was prompted for a path."""
+    conn.sendall(f"{name}\n".encode())
+    read_until(conn, b"OK START_UPLOAD")
+    conn.sendall(f"{size}\n".encode())
+    read_until(conn, b"\n")
+    for chunk in chunks:
+        conn.sendall(chunk)
+    conn.sendall(f"CHECKSUM {checksum}\n".encode())
+    reply = read_until(conn, b"\n")
+    while b"completed" not in reply and b"ERROR" not in reply:
+        reply += conn.recv(4096)
+    return b"completed" in reply
+
+
+def send_upload_v2(chan, name, chunks, size, checksum):
+    """Pipelined v2 upload once prompted; returns (ok, PROGRESS offsets).
+
+    Path, size line, data and CHECKSUM go out at once; the server's replies
+    are read after.
+    """
+    from tcp.framing import ACK, PROGRESS, CHECKSUM, unpack_progress
+
+    chan.send(f"{name}\n".encode())
+    chan.send(f"{size}\n".encode())
+    for chunk in chunks:
+        chan.sendall(chunk)
+    chan.send_frame(CHECKSUM, checksum.encode())
+    offsets = []
+    while True:
+        kind, message = chan.read_frame()
+        if kind is None:
+            return False, offsets
+        if kind == PROGRESS:
+            offsets.append(unpack_progress(message))
+        elif kind == ACK:
+            return True, offsets
+        elif message.startswith(b"ERROR"):
+            return False, offsets
+
+
+def send_ranges(port, header, chunks, block=4 * 1024 * 1024, ctx=None, limit=None):
+    """Serve a "RANGES <file_id> <token> <range_size> <streams>" reply.
+
+    Opens the granted number of STREAM connections and sends each RANGE the
+    server hands out from `chunks` (block-sized pieces of the payload).
+    With a limit each stream drops after that many ranges, half-way into
+    the next one. Returns the indexes of the ranges handed out.
+    """
+    import threading
+
+    _, file_id, token, _, streams = header.split()
+    ctx = ctx or client_context()
+    errors = []
+    handed = []
+
+    def stream():
+        try:
+            raw = socket.create_connection(("127.0.0.1", port))
+            conn = ctx.wrap_socket(raw, server_hostname="localhost")
+            conn.sendall(f"STREAM {file_id} {token}\n".encode())
+            sent = 0
+            while True:
+                line = read_until(conn, b"\n").decode().split()
+                if line[0] != "RANGE":
+                    break
+                handed.append(int(line[1]))
+                start, length = int(line[2]), int(line[3])
+                first = start // block
+                pieces = chunks[first : (start + length + block - 1) // block]
+                if limit is not None and sent == limit:
+                    conn.sendall(b"".join(pieces)[: length // 2])
+                    time.sleep(0.2)
+                    break
+                for chunk in pieces:
+                    conn.sendall(chunk)
+                sent += 1
+            conn.close()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=stream) for _ in range(int(streams))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    if errors:
+        raise errors[0]
+    return sorted(handed)
+
+
+def upload_file_parallel(conn, proc, port, name, chunks, size, checksums, streams):
+    """v1 upload dialogue asking for `streams` parallel streams.
+
+    checksums is (sha256, tree); falls back to one stream when the server
+    answers with an offset instead of RANGES.
+    """
+    request_upload(conn, proc)
+    conn.sendall(f"{name}\n".encode())
+    read_until(conn, b"OK START_UPLOAD")
+    conn.sendall(f"{size} STREAMS {streams}\n".encode())
+    reply = read_until(conn, b"\n").decode().strip()
+    if reply.startswith("RANGES"):
+        send_ranges(port, reply, chunks)
+        read_until(conn, b"RANGES DONE")
+    else:
+        for chunk in chunks:
+            conn.sendall(chunk)
+    conn.sendall(f"CHECKSUM {checksums[0]} {checksums[1]}\n".encode())
+    reply = read_until(conn, b"\n")
+    while b"completed" not in reply and b"ERROR" not in reply:
+        reply += conn.recv(4096)
+    return b"completed" in reply
+
+
+def upload_file_chunked(conn, proc, name, chunks, checksums, client_id=BENCH_CLIENT_ID):
+    """Chunked upload dialogue (tcp/chunks.py); returns (ok, bytes sent).
+
+    chunks come from cdc_chunks. Bytes sent counts the manifest and the
+    chunk data; a server that does not answer MANIFEST gets the whole file.
+    """
+    import hashlib
+    from tcp.chunks import parse_runs
+
+    size = sum(len(c) for c in chunks)
+    request_upload(conn, proc, client_id)
+    conn.sendall(f"{name}\n".encode())
+    read_until(conn, b"OK START_UPLOAD")
+    conn.sendall(f"{size} CHUNKS {len(chunks)}\n".encode())
+    reply = read_until(conn, b"\n").decode().strip()
+    if reply == "MANIFEST":
+        manifest = "".join(
+            f"{hashlib.sha256(c).hexdigest()} {len(c)}\n" for c in chunks
+        ).encode()
+        conn.sendall(manifest)
+        need = read_until(conn, b"\n").decode().split()
+        sent = len(manifest)
+        for i in parse_runs(need[2:]):
+            conn.sendall(chunks[i])
+            sent += len(chunks[i])
+    else:
+        for chunk in chunks:
+            conn.sendall(chunk)
+        sent = size
+    conn.sendall(f"CHECKSUM {checksums[0]} {checksums[1]}\n".encode())
+    reply = read_until(conn, b"\n")
+    while b"completed" not in reply and b"ERROR" not in reply:
+        reply += conn.recv(4096)
+    return b"completed" in reply, sent
+
+
+def tree_checksum(chunks, segment_size):
+    """The TREE value of a payload (see tcp/hashing.py)."""
+    import hashlib
+    from tcp.hashing import tree_digest
+
+    digests = []
+    seg, used = hashlib.sha256(), 0
+    for chunk in chunks:
+        view = memoryview(chunk)
+        while len(view):
+            part = view[: segment_size - used]
+            seg.update(part)
+            used += len(part)
+            view = view[len(part) :]
+            if used == segment_size:
+                digests.append(seg.hexdigest())
+                seg, used = hashlib.sha256(), 0
+    if used:
+        digests.append(seg.hexdigest())
+    return tree_digest(digests)
+
+
+def add_stored_file(workdir, name, chunks, client_id=BENCH_CLIENT_ID):
+    """Put an already uploaded file in storage and the DB; returns file_id."""
+    from db.model import add_file, finish_file_upload
+
+    folder = os.path.join(workdir, "storage", client_id)
+    os.makedirs(folder, exist_ok=True)
+    size = 0
+    with open(os.path.join(folder, name), "wb") as f:
+        for chunk in chunks:
+            size += f.write(chunk)
+    file_id = add_file(client_id, name, size, "UPLOADING")
+    finish_file_upload(file_id)
+    return file_id
+
+
+def download_file(conn, proc, file_id, client_id=BENCH_CLIENT_ID):
+    """Run the download dialogue and drain the bytes; returns bytes received."""
+    from db.model import create_action
+
+    create_action(client_id, file_id, "DOWNLOAD")
+    notify_action(proc, client_id)
+    read_until(conn, b"Enter save path")
+    conn.sendall(b"/tmp\n")
+    head = read_until(conn, b"\n")
+    meta, rest = head.split(b"\n", 1)
+    size = int(meta.split(b"|")[0])
+    got = len(rest)
+    buf = bytearray(1024 * 1024)
+    while got < size:
+        n = conn.recv_into(buf)
+        if not n:
+            break
+        got += n
+    read_until(conn, b"completed")
+    return got
+
+
+def download_file_v2(chan, proc, file_id, client_id=BENCH_CLIENT_ID):
+    """Download dialogue over a v2 Channel.
+
+    Returns (sha256 of the bytes received, the sha256 the server reported).
+    """
+    import hashlib
+    from db.model import create_action
+    from tcp.framing import CONTROL, ACK, CHECKSUM
+
+    create_action(client_id, file_id, "DOWNLOAD")
+    notify_action(proc, client_id)
+    read_until(chan, b"Enter save path")
+    chan.send(b"/tmp\n")
+    kind, meta = chan.read_frame()
+    if kind != CONTROL or b"|" not in meta:
+        raise RuntimeError(f"no download: {meta!r}")
+    size = int(meta.split(b"|")[0])
+    h = hashlib.sha256()
+    got = 0
+    view = memoryview(bytearray(1024 * 1024))
+    while got < size:
+        n = chan.recv_into(view)
+        if not n:
+            break
+        h.update(view[:n])
+        got += n
+    reported = None
+    while True:
+        kind, message = chan.read_frame()
+        if kind == CHECKSUM:
+            reported = message.decode()
+        if kind in (ACK, None):
+            return h.hexdigest(), reported
+
+
+def frames(chunks, codec):
+    """Framed form of chunks as a client sends it (tcp/codecs.py)."""
+    from tcp.codecs import FrameEncoder, FRAME_SIZE
+
+    encoder = FrameEncoder(codec)
+    for chunk in chunks:
+        view = memoryview(chunk)
+        for start in range(0, len(view), FRAME_SIZE):
+            yield encoder.encode(view[start : start + FRAME_SIZE])
+
+
+def upload_file_compressed(
+    conn, proc, name, chunks, size, checksums, codecs, client_id=BENCH_CLIENT_ID
+):
+    """Upload dialogue offering "COMPRESS <codecs>"; returns (ok, codec, sent).
+
+    No offer is made if codecs is empty.
+
+    sent counts the bytes of file data put on the wire; a server that makes
+    no COMPRESS reply gets them raw.
+    """
+    request_upload(conn, proc, client_id)
+    conn.sendall(f"{name}\n".encode())
+    read_until(conn, b"OK START_UPLOAD")
+    offer = f" COMPRESS {','.join(codecs)}" if codecs else ""
+    conn.sendall(f"{size}{offer}\n".encode())
+    reply = read_until(conn, b"0\n").decode().split()
+    codec = reply[1] if reply[0] == "COMPRESS" and reply[1] != "none" else None
+    sent = 0
+    for piece in frames(chunks, codec) if codec else chunks:
+        conn.sendall(piece)
+        sent += len(piece)
+    conn.sendall(f"CHECKSUM {checksums[0]} {checksums[1]}\n".encode())
+    reply = read_until(conn, b"\n")
+    while b"completed" not in reply and b"ERROR" not in reply:
+        reply += conn.recv(4096)
+    return b"completed" in reply, codec, sent
+
+
+def download_file_compressed(conn, proc, file_id, codecs, client_id=BENCH_CLIENT_ID):
+    """Download dialogue offering "COMPRESS <codecs>" (no offer if empty).
+
+    Returns (sha256 of the bytes received, codec, bytes on the wire).
+    """
+    import hashlib
+    from db.model import create_action
+
+    create_action(client_id, file_id, "DOWNLOAD")
+    notify_action(proc, client_id)
+    read_until(conn, b"Enter save path")
+    offer = f"COMPRESS {','.join(codecs)}\n" if codecs else ""
+    conn.sendall(f"/tmp\n{offer}".encode())
+    head = read_until(conn, b"\n")
+    meta, rest = head.split(b"\n", 1)
+    size = int(meta.split(b"|")[0])
+    codec = None
+    if codecs:
+        while b"\n" not in rest:
+            rest += conn.recv(1)
+        line, rest = rest.split(b"\n", 1)
+        codec = line.split()[1].decode()
+        codec = None if codec == "none" else codec
+    source = conn
+    if codec:
+        from tcp.codecs import FrameReader
+
+        source = FrameReader(conn, codec, rest)
+    h = hashlib.sha256(b"" if codec else rest)
+    got = 0 if codec else len(rest)
+    view = memoryview(bytearray(1024 * 1024))
+    while got < size:
+        n = source.recv_into(view[: size - got])
+        if not n:
+            break
+        h.update(view[:n])
+        got += n
+    read_until(conn, b"completed")
+    return h.hexdigest(), codec, source.wire_bytes if codec else got
+
+
+def payload(total, block=4 * 1024 * 1024, seed=b"bench"):
+    """Deterministic (chunks, sha256) of `total` bytes without holding them all."""
+    import hashlib, random
+
+    rnd = random.Random(seed)
+    base = rnd.randbytes(block)
+    h = hashlib.sha256()
+    chunks = []
+    left = total
+    while left > 0:
+        chunk = memoryview(base)[: min(block, left)]
+        chunks.append(chunk)
+        h.update(chunk)
+        left -= len(chunk)
+    return chunks, h.hexdigest()
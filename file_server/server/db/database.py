@@ -1,19 +1,143 @@
 import sqlite3
 import os
+import queue
+import threading
+from contextlib import contextmanager
 
 DB_PATH = os.getenv("DATA_DB_PATH", "data/data.db")
 
+# The Flask API and the TCP server both write this file, so wait for the
+# other process' write lock instead of failing with "database is locked".
+BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+# seconds to wait for a pooled connection before giving up
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+STATEMENT_CACHE = 256
 
-def get_connection():
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+_pool = queue.LifoQueue()
+_pool_lock = threading.Lock()
+_pool_created = 0
+_pool_path = None
+
+
+class PoolExhausted(RuntimeError):
+    """No pooled connection came free within POOL_TIMEOUT."""
+
+
+def _connect():
+    conn = sqlite3.connect(
+        DB_PATH,
+        check_same_thread=False,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        cached_statements=STATEMENT_CACHE,
+    )
     conn.row_factory = sqlite3.Row
+    # WAL lets readers run alongside the single writer; NORMAL only fsyncs
+    # at checkpoints, which is still safe against corruption in WAL mode.
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
     conn.execute("PRAGMA foreign_keys = ON")
     return conn
 
 
+def _acquire():
+    global _pool_created, _pool_path
+    with _pool_lock:
+        if _pool_path != DB_PATH:
+            # DB_PATH was repointed (tests, benchmarks): drop the old pool
+            _drain_pool()
+            _pool_path = DB_PATH
+        try:
+            return _pool.get_nowait()
+        except queue.Empty:
+            pass
+        if _pool_created < POOL_SIZE:
+            _pool_created += 1
+            try:
+                return _connect()
+            except Exception:
+                _pool_created -= 1
+                raise
+    try:
+        return _pool.get(timeout=POOL_TIMEOUT)
+    except queue.Empty:
+        raise PoolExhausted(f"no database connection free after {POOL_TIMEOUT}s")
+
+
+def _release(conn):
+    _pool.put(conn)
+
+
+def _drain_pool():
+    global _pool_created
+    while True:
+        try:
+            _pool.get_nowait().close()
+        except queue.Empty:
+            break
+    _pool_created = 0
+
+
+def close_pool():
+    with _pool_lock:
+        _drain_pool()
+
+
+@contextmanager
+def get_connection():
+    """Borrow a pooled connection; commits on success, rolls back on error.
+
+    Fetch results inside the ``with`` block: the connection goes back to the
+    pool (and to another thread) as soon as the block exits.
+    """
+    conn = _acquire()
+    try:
+        yield conn
+        if conn.in_transaction:
+            conn.commit()
+    except BaseException:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    finally:
+        _release(conn)
+
+
+# Columns added after databases were already deployed; CREATE TABLE IF NOT
+# EXISTS leaves existing tables alone, so init_db adds them when missing.
+_LATE_COLUMNS = [
+    ("actions", "progress", "INTEGER"),
+    ("files", "blob_hash", "TEXT"),
+    # bytes of a chunked upload the client actually sent; NULL: all of them
+    ("files", "wire_bytes", "INTEGER"),
+    # transfer codec an upload was started with; a resume keeps it
+    ("files", "upload_codec", "TEXT"),
+    # at-rest compression of the file's blob (utils/blobstore.py): the codec,
+    # NULL if stored raw, and the bytes on disk; NULL size: not looked at yet
+    ("files", "stored_codec", "TEXT"),
+    ("files", "stored_size", "INTEGER"),
+]
+
+
 def init_db():
-    conn = get_connection()
-    cursor = conn.cursor()
+    """Create missing tables; safe to run on every start of either process."""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        _create_tables(cursor)
+        _add_missing_columns(cursor)
+        # a blob's files, for at-rest compression; needs the late column
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_files_blob ON files(blob_hash)")
+
+
+def _add_missing_columns(cursor):
+    for table, column, decl in _LATE_COLUMNS:
+        existing = {row[1] for row in cursor.execute(f"PRAGMA table_info({table})")}
+        if column not in existing:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+def _create_tables(cursor):
 
     # ui_users
     cursor.execute(
@@ -49,12 +173,29 @@ def init_db():
         client_id TEXT NOT NULL,
         filename TEXT NOT NULL,
         size INTEGER NOT NULL,
+        received INTEGER DEFAULT 0,
+        checksum TEXT,
         upload_time DATETIME NOT NULL,
-        status TEXT NOT NULL CHECK(status IN ('UPLOADING', 'UPLOADED')),
+        status TEXT NOT NULL CHECK(status IN ('UPLOADING', 'UPLOADED', 'CANCELED')),
         FOREIGN KEY (client_id) REFERENCES clients(client_id)
     )
     """
     )
+    # per-client lookups and the monitor's usage totals read only this index;
+    # with the others it also serves each sort order of the paged file list
+    # (the implicit rowid tail breaks ties by file_id)
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_files_client ON files(client_id, size)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_files_client_id ON files(client_id, file_id)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_files_client_name ON files(client_id, filename)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_files_client_time ON files(client_id, upload_time)"
+    )
 
     # actions
     cursor.execute(
@@ -64,7 +205,7 @@ def init_db():
         client_id TEXT NOT NULL,
         file_id INTEGER,
         action_type TEXT NOT NULL CHECK(action_type IN ('UPLOAD', 'DOWNLOAD')),
-        status TEXT NOT NULL CHECK(status IN ('PENDING', 'RUNNING', 'DONE', 'CANCELED')),
+        status TEXT NOT NULL CHECK(status IN ('PENDING', 'RUNNING', 'DONE', 'CANCELED', 'INTERRUPTED')),
         progress INTEGER,
         FOREIGN KEY (client_id) REFERENCES clients(client_id),
         FOREIGN KEY (file_id) REFERENCES files(file_id)
@@ -72,5 +213,58 @@ def init_db():
     """
     )
 
-    conn.commit()
-    conn.close()
+    # content-addressed store: one row per distinct stored content, counted
+    # from files.blob_hash (utils/blobstore.py)
+    cursor.execute(
+        """
+    CREATE TABLE IF NOT EXISTS blobs (
+        blob_hash TEXT PRIMARY KEY,
+        size INTEGER NOT NULL,
+        refcount INTEGER NOT NULL,
+        created_at DATETIME NOT NULL
+    )
+    """
+    )
+
+    # chunk store of chunked uploads (tcp/chunks.py): where each chunk's
+    # content sits inside a stored blob; goes with the blob
+    cursor.execute(
+        """
+    CREATE TABLE IF NOT EXISTS chunks (
+        chunk_hash TEXT PRIMARY KEY,
+        blob_hash TEXT NOT NULL,
+        start INTEGER NOT NULL,
+        length INTEGER NOT NULL,
+        FOREIGN KEY (blob_hash) REFERENCES blobs(blob_hash) ON DELETE CASCADE
+    )
+    """
+    )
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_chunks_blob ON chunks(blob_hash)")
+
+    # per-segment digests of uploads in progress (resume checkpoints)
+    cursor.execute(
+        """
+    CREATE TABLE IF NOT EXISTS file_segments (
+        file_id INTEGER NOT NULL,
+        seg_index INTEGER NOT NULL,
+        digest TEXT NOT NULL,
+        PRIMARY KEY (file_id, seg_index),
+        FOREIGN KEY (file_id) REFERENCES files(file_id)
+    )
+    """
+    )
+
+    # byte ranges of parallel (multi-stream) uploads; digest set when done
+    cursor.execute(
+        """
+    CREATE TABLE IF NOT EXISTS file_ranges (
+        file_id INTEGER NOT NULL,
+        range_index INTEGER NOT NULL,
+        start INTEGER NOT NULL,
+        length INTEGER NOT NULL,
+        digest TEXT,
+        PRIMARY KEY (file_id, range_index),
+        FOREIGN KEY (file_id) REFERENCES files(file_id)
+    )
+    """
+    )
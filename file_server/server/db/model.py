@@ -1,303 +1,790 @@
 from datetime import datetime
 from db.database import get_connection
 
+# Every function borrows a pooled connection for one statement (or one
+# transaction). Cursors are consumed inside the ``with`` block so no
+# statement stays open on a connection that is back in the pool.
+# The iter_* variants read in keyset batches of STREAM_BATCH rows, each on
+# a connection borrowed for that batch only: a slow consumer (a streamed
+# HTTP response) holds neither a connection nor a WAL read snapshot while
+# it writes. Each batch sees the database as of its own query.
+
+STREAM_BATCH = 500
+
+
+def _iter_batches(sql, params, key):
+    """Yield rows as dicts, one batch query at a time.
+
+    sql selects, in ``key`` order, up to :limit rows with ``key`` past
+    :after ("" on the first batch).
+    """
+    params = dict(params, after="", limit=STREAM_BATCH)
+    while True:
+        with get_connection() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        for r in rows:
+            yield dict(r)
+        if len(rows) < STREAM_BATCH:
+            return
+        params["after"] = rows[-1][key]
+
 
 # UI_USERS
 def create_user(username, password_hash, role):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        INSERT INTO ui_users (username, password_hash, role)
-        VALUES (?, ?, ?)
-        """,
-        (username, password_hash, role),
-    )
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        conn.execute(
+            """
+            INSERT INTO ui_users (username, password_hash, role)
+            VALUES (?, ?, ?)
+            """,
+            (username, password_hash, role),
+        )
 
 
 def get_user_by_username(username):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM ui_users WHERE username = ?", (username,))
-    row = cur.fetchone()
-    conn.close()
+    with get_connection() as conn:
+        row = conn.execute(
+            "SELECT * FROM ui_users WHERE username = ?", (username,)
+        ).fetchone()
     return dict(row) if row else None
 
 
 def list_users():
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT user_id, username FROM ui_users")
-    rows = cur.fetchall()
-    conn.close()
+    with get_connection() as conn:
+        rows = conn.execute("SELECT user_id, username FROM ui_users").fetchall()
     return [dict(r) for r in rows]
 
 
 # CLIENTS
 def add_client(client_id, password_hash, capacity_max, user_id):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        INSERT INTO clients (client_id, password_hash, capacity_max, user_id, status)
-        VALUES (?, ?, ?, ?, 'OFFLINE')
-        """,
-        (client_id, password_hash, capacity_max, user_id),
-    )
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        conn.execute(
+            """
+            INSERT INTO clients (client_id, password_hash, capacity_max, user_id, status)
+            VALUES (?, ?, ?, ?, 'OFFLINE')
+            """,
+            (client_id, password_hash, capacity_max, user_id),
+        )
 
 
 def update_client_status(client_id, status):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        UPDATE clients
-        SET status = ?
-        WHERE client_id = ?
-        """,
-        (status, client_id),
-    )
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        conn.execute(
+            """
+            UPDATE clients
+            SET status = ?
+            WHERE client_id = ?
+            """,
+            (status, client_id),
+        )
+
+
+def set_client_statuses(statuses):
+    """Write many (client_id, status) pairs in one transaction."""
+    with get_connection() as conn:
+        conn.executemany(
+            "UPDATE clients SET status = ? WHERE client_id = ?",
+            [(status, client_id) for client_id, status in statuses],
+        )
+
+
+def reset_client_statuses():
+    """Mark every client OFFLINE (the TCP server starts with no sessions)."""
+    with get_connection() as conn:
+        conn.execute("UPDATE clients SET status = 'OFFLINE' WHERE status != 'OFFLINE'")
 
 
 def get_client(client_id):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM clients WHERE client_id = ?", (client_id,))
-    row = cur.fetchone()
-    conn.close()
+    with get_connection() as conn:
+        row = conn.execute(
+            "SELECT * FROM clients WHERE client_id = ?", (client_id,)
+        ).fetchone()
     return dict(row) if row else None
 
 
 def update_client(client_id, password_hash, capacity_max, user_id):
-    conn = get_connection()
-    cur = conn.cursor()
-
-    cur.execute(
-        """
-        UPDATE clients
-        SET password_hash=?
-        WHERE client_id=?
-    """,
-        (password_hash, client_id),
-    )
-
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        conn.execute(
+            """
+            UPDATE clients
+            SET password_hash=?
+            WHERE client_id=?
+            """,
+            (password_hash, client_id),
+        )
 
 
 def delete_client(client_id):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("DELETE FROM clients WHERE client_id=?", (client_id,))
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        conn.execute("DELETE FROM clients WHERE client_id=?", (client_id,))
+
+
+_CLIENTS_SQL = """
+    SELECT
+        c.client_id,
+        c.capacity_max,
+        c.status,
+        u.username,
+        u.user_id
+    FROM clients c
+    JOIN ui_users u ON c.user_id = u.user_id
+"""
 
 
 def list_clients():
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT 
-            c.client_id,
-            c.capacity_max,
-            c.status,
-            u.username,
-            u.user_id
-        FROM clients c
-        JOIN ui_users u ON c.user_id = u.user_id
-    """
-    )
-    rows = cur.fetchall()
-    conn.close()
+    with get_connection() as conn:
+        rows = conn.execute(_CLIENTS_SQL).fetchall()
     return [dict(r) for r in rows]
 
 
+def iter_clients():
+    sql = _CLIENTS_SQL + "WHERE c.client_id > :after ORDER BY c.client_id LIMIT :limit"
+    return _iter_batches(sql, {}, "client_id")
+
+
 def list_clients_by_user(username):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT 
+    with get_connection() as conn:
+        rows = conn.execute(
+            """
+            SELECT
+                c.client_id,
+                c.capacity_max,
+                c.status,
+                u.username,
+                u.user_id
+            FROM clients c
+            JOIN ui_users u ON c.user_id = u.user_id
+            WHERE u.username = ?
+            """,
+            (username,),
+        ).fetchall()
+    return [dict(r) for r in rows]
+
+
+def _client_usage_query(username):
+    where = "WHERE u.username = ?" if username is not None else ""
+    sql = f"""
+        SELECT
             c.client_id,
             c.capacity_max,
             c.status,
             u.username,
-            u.user_id
+            u.user_id,
+            COALESCE(f.file_count, 0) AS file_count,
+            COALESCE(f.used_bytes, 0) AS used_bytes
         FROM clients c
         JOIN ui_users u ON c.user_id = u.user_id
-        WHERE u.username = ?
-    """,
-        (username,),
-    )
-    rows = cur.fetchall()
-    conn.close()
+        LEFT JOIN (
+            SELECT client_id, COUNT(*) AS file_count, SUM(size) AS used_bytes
+            FROM files
+            GROUP BY client_id
+        ) f ON f.client_id = c.client_id
+        {where}
+    """
+    return sql, (username,) if username is not None else ()
+
+
+def list_client_usage(username=None):
+    """Clients with their file count and stored bytes, in one query.
+
+    Restricted to one UI user's clients when username is given.
+    """
+    sql, args = _client_usage_query(username)
+    with get_connection() as conn:
+        rows = conn.execute(sql, args).fetchall()
     return [dict(r) for r in rows]
 
 
-# FILES
-def add_file(client_id, filename, size, status):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        INSERT INTO files (client_id, filename, size, received, checksum, upload_time, status)
-        VALUES (?, ?, ?, 0, NULL, datetime('now'), ?)
-    """,
-        (client_id, filename, size, status),
-    )
+def iter_client_usage(username=None):
+    """list_client_usage in client_id order, files counted batch by batch."""
+    where = "AND u.username = :username" if username is not None else ""
+    sql = f"""
+        WITH batch AS (
+            SELECT c.client_id, c.capacity_max, c.status, u.username, u.user_id
+            FROM clients c
+            JOIN ui_users u ON c.user_id = u.user_id
+            WHERE c.client_id > :after {where}
+            ORDER BY c.client_id
+            LIMIT :limit
+        )
+        SELECT
+            b.*,
+            COALESCE(f.file_count, 0) AS file_count,
+            COALESCE(f.used_bytes, 0) AS used_bytes
+        FROM batch b
+        LEFT JOIN (
+            SELECT client_id, COUNT(*) AS file_count, SUM(size) AS used_bytes
+            FROM files
+            WHERE client_id IN (SELECT client_id FROM batch)
+            GROUP BY client_id
+        ) f ON f.client_id = b.client_id
+        ORDER BY b.client_id
+    """
+    return _iter_batches(sql, {"username": username}, "client_id")
+
 
-    file_id = cur.lastrowid
-    conn.commit()
-    conn.close()
+# FILES
+def add_file(client_id, filename, size, status, upload_codec=None):
+    with get_connection() as conn:
+        cur = conn.execute(
+            """
+            INSERT INTO files (client_id, filename, size, received, checksum, upload_time, status, upload_codec)
+            VALUES (?, ?, ?, 0, NULL, datetime('now'), ?, ?)
+            """,
+            (client_id, filename, size, status, upload_codec),
+        )
+        file_id = cur.lastrowid
     return file_id
 
 
 def update_file_status(file_id, status):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        UPDATE files
-        SET status = ?
-        WHERE file_id = ?
-        """,
-        (status, file_id),
-    )
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        conn.execute(
+            """
+            UPDATE files
+            SET status = ?
+            WHERE file_id = ?
+            """,
+            (status, file_id),
+        )
 
 
 def update_file_received(file_id, received):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        UPDATE files
-        SET received = ?
-        WHERE file_id = ?
-    """,
-        (received, file_id),
-    )
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        conn.execute(
+            """
+            UPDATE files
+            SET received = ?
+            WHERE file_id = ?
+            """,
+            (received, file_id),
+        )
+
+
+def save_upload_checkpoint(file_id, received, segments=()):
+    """Persist received bytes and newly completed segment digests together."""
+    with get_connection() as conn:
+        conn.execute(
+            "UPDATE files SET received = ? WHERE file_id = ?", (received, file_id)
+        )
+        conn.executemany(
+            """
+            INSERT OR REPLACE INTO file_segments (file_id, seg_index, digest)
+            VALUES (?, ?, ?)
+            """,
+            [(file_id, index, digest) for index, digest in segments],
+        )
+
+
+def get_file_segments(file_id):
+    with get_connection() as conn:
+        rows = conn.execute(
+            """
+            SELECT digest FROM file_segments
+            WHERE file_id = ?
+            ORDER BY seg_index
+            """,
+            (file_id,),
+        ).fetchall()
+    return [r["digest"] for r in rows]
+
+
+def plan_file_ranges(file_id, size, range_size):
+    """Split a parallel upload into ranges; any previous plan is dropped."""
+    ranges = [
+        (file_id, index, start, min(range_size, size - start))
+        for index, start in enumerate(range(0, size, range_size))
+    ]
+    with get_connection() as conn:
+        conn.execute("DELETE FROM file_ranges WHERE file_id=?", (file_id,))
+        conn.executemany(
+            """
+            INSERT INTO file_ranges (file_id, range_index, start, length)
+            VALUES (?, ?, ?, ?)
+            """,
+            ranges,
+        )
+        conn.execute("UPDATE files SET received = 0 WHERE file_id = ?", (file_id,))
+
+
+def get_file_ranges(file_id):
+    with get_connection() as conn:
+        rows = conn.execute(
+            """
+            SELECT range_index, start, length, digest FROM file_ranges
+            WHERE file_id = ?
+            ORDER BY range_index
+            """,
+            (file_id,),
+        ).fetchall()
+    return [dict(r) for r in rows]
+
+
+def complete_file_range(file_id, range_index, digest):
+    """Record a finished range; files.received becomes the bytes done so far."""
+    with get_connection() as conn:
+        conn.execute(
+            """
+            UPDATE file_ranges SET digest = ?
+            WHERE file_id = ? AND range_index = ?
+            """,
+            (digest, file_id, range_index),
+        )
+        conn.execute(
+            """
+            UPDATE files
+            SET received = (
+                SELECT COALESCE(SUM(length), 0) FROM file_ranges
+                WHERE file_id = ? AND digest IS NOT NULL
+            )
+            WHERE file_id = ?
+            """,
+            (file_id, file_id),
+        )
 
 
 def get_files_by_client(client_id):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT * FROM files
-        WHERE client_id = ?
-        """,
-        (client_id,),
-    )
-    rows = cur.fetchall()
-    conn.close()
+    with get_connection() as conn:
+        rows = conn.execute(
+            """
+            SELECT * FROM files
+            WHERE client_id = ?
+            """,
+            (client_id,),
+        ).fetchall()
+    return [dict(r) for r in rows]
+
+
+FILE_COLUMNS = (
+    "file_id",
+    "client_id",
+    "filename",
+    "size",
+    "received",
+    "checksum",
+    "upload_time",
+    "status",
+)
+FILE_SORTS = ("file_id", "filename", "size", "upload_time")
+
+
+def _files_query(
+    client_id,
+    limit=None,
+    after=None,
+    sort="file_id",
+    descending=False,
+    columns=FILE_COLUMNS,
+    status=None,
+    name_prefix=None,
+    min_size=None,
+    max_size=None,
+    since=None,
+    until=None,
+):
+    where = ["client_id = ?"]
+    args = [client_id]
+    if status:
+        where.append("status = ?")
+        args.append(status)
+    if name_prefix:
+        # a range instead of LIKE, so the filename index can be used
+        where.append("filename >= ? AND filename < ?")
+        args += [name_prefix, name_prefix + "\U0010ffff"]
+    if min_size is not None:
+        where.append("size >= ?")
+        args.append(min_size)
+    if max_size is not None:
+        where.append("size <= ?")
+        args.append(max_size)
+    if since:
+        where.append("upload_time >= ?")
+        args.append(since)
+    if until:
+        where.append("upload_time < ?")
+        args.append(until)
+
+    op, order = ("<", "DESC") if descending else (">", "ASC")
+    if after is not None:
+        if sort == "file_id":
+            where.append(f"file_id {op} ?")
+            args.append(after[1])
+        else:
+            where.append(f"({sort}, file_id) {op} (?, ?)")
+            args += list(after)
+    order_by = "file_id" if sort == "file_id" else f"{sort} {order}, file_id"
+
+    sql = f"""
+        SELECT {", ".join(columns)} FROM files
+        WHERE {" AND ".join(where)}
+        ORDER BY {order_by} {order}
+    """
+    if limit is not None:
+        sql += " LIMIT ?"
+        args.append(limit + 1)
+    return sql, args
+
+
+def list_files_page(client_id, limit, **query):
+    """One page of a client's files, keyset-paginated.
+
+    ``after`` is the (sort value, file_id) of the last row of the previous
+    page; rows strictly past it are returned, so a page costs the same at
+    any depth. Returns up to ``limit`` + 1 rows: the extra one only tells
+    the caller there is a next page. ``columns`` must come from
+    FILE_COLUMNS and ``sort`` from FILE_SORTS. Filters: status,
+    name_prefix, min_size, max_size, since, until.
+    """
+    sql, args = _files_query(client_id, limit, **query)
+    with get_connection() as conn:
+        rows = conn.execute(sql, args).fetchall()
     return [dict(r) for r in rows]
 
 
+def iter_files(client_id, limit=None, sort="file_id", columns=FILE_COLUMNS, **query):
+    """list_files_page as a generator; limit None streams every match.
+
+    Reads list_files_page by list_files_page, so rows always carry file_id
+    and the sort column: the next batch starts after them.
+    """
+    columns = list(dict.fromkeys([*columns, "file_id", sort]))
+    # like list_files_page, one row past the limit tells of a next page
+    left = None if limit is None else limit + 1
+    while left is None or left > 0:
+        size = STREAM_BATCH if left is None else min(STREAM_BATCH, left)
+        rows = list_files_page(client_id, size - 1, sort=sort, columns=columns, **query)
+        yield from rows
+        if len(rows) < size:
+            return
+        if left is not None:
+            left -= size
+        query["after"] = (rows[-1][sort], rows[-1]["file_id"])
+
+
 def get_file(file_id):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM files WHERE file_id = ?", (file_id,))
-    row = cur.fetchone()
-    conn.close()
+    with get_connection() as conn:
+        row = conn.execute(
+            "SELECT * FROM files WHERE file_id = ?", (file_id,)
+        ).fetchone()
     return dict(row) if row else None
 
 
-def delete_file(file_id):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("UPDATE actions SET file_id=NULL WHERE file_id=?", (file_id,))
-    cur.execute("DELETE FROM files WHERE file_id=?", (file_id,))
-    conn.commit()
-    conn.close()
+def delete_file(file_id, drop_blob=None):
+    """Delete a file row and release its blob reference.
+
+    When that was the blob's last reference the blobs row goes too and
+    drop_blob(blob_hash) runs before the commit, while this transaction
+    holds the write lock, so no upload can start referencing the blob again
+    before its content is gone.
+    """
+    with get_connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute(
+            "SELECT blob_hash FROM files WHERE file_id=?", (file_id,)
+        ).fetchone()
+        conn.execute("UPDATE actions SET file_id=NULL WHERE file_id=?", (file_id,))
+        conn.execute("DELETE FROM file_segments WHERE file_id=?", (file_id,))
+        conn.execute("DELETE FROM file_ranges WHERE file_id=?", (file_id,))
+        conn.execute("DELETE FROM files WHERE file_id=?", (file_id,))
+        blob_hash = row["blob_hash"] if row else None
+        if blob_hash is None:
+            return
+        left = conn.execute(
+            "UPDATE blobs SET refcount = refcount - 1 WHERE blob_hash=? RETURNING refcount",
+            (blob_hash,),
+        ).fetchone()
+        if left and left["refcount"] <= 0:
+            conn.execute("DELETE FROM blobs WHERE blob_hash=?", (blob_hash,))
+            if drop_blob:
+                drop_blob(blob_hash)
+
+
+def filename_taken(client_id, filename):
+    """True if the client already has a live file under this name."""
+    with get_connection() as conn:
+        row = conn.execute(
+            """
+            SELECT 1 FROM files
+            WHERE client_id=? AND filename=? AND status != 'CANCELED'
+            LIMIT 1
+            """,
+            (client_id, filename),
+        ).fetchone()
+    return row is not None
+
+
+def blob_stats():
+    """Totals of the blob store; logical bytes count every reference."""
+    with get_connection() as conn:
+        row = conn.execute(
+            """
+            SELECT
+                COUNT(*) AS blobs,
+                COALESCE(SUM(refcount), 0) AS files,
+                COALESCE(SUM(size), 0) AS stored_bytes,
+                COALESCE(SUM(size * refcount), 0) AS logical_bytes
+            FROM blobs
+            """
+        ).fetchone()
+        chunked = conn.execute(
+            """
+            SELECT
+                COUNT(*) AS chunked_uploads,
+                COALESCE(SUM(size - wire_bytes), 0) AS wire_bytes_saved
+            FROM files
+            WHERE wire_bytes IS NOT NULL
+            """
+        ).fetchone()
+        chunks = conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+        compressed = conn.execute(
+            """
+            SELECT
+                COUNT(*) AS compressed_blobs,
+                COALESCE(SUM(b.size - c.stored_size), 0) AS compression_bytes_saved
+            FROM blobs b
+            JOIN (
+                SELECT blob_hash, MAX(stored_size) AS stored_size FROM files
+                WHERE stored_codec IS NOT NULL GROUP BY blob_hash
+            ) c ON c.blob_hash = b.blob_hash
+            """
+        ).fetchone()
+    return {**dict(row), **dict(chunked), "chunks": chunks, **dict(compressed)}
+
+
+def list_uncompressed_blobs(min_age, limit):
+    """Blobs older than min_age seconds with files at-rest compression has
+    not looked at; stored_size is set if it looked at the blob before."""
+    with get_connection() as conn:
+        rows = conn.execute(
+            """
+            SELECT
+                b.blob_hash,
+                b.size,
+                MAX(f.checksum) AS checksum,
+                MAX(f.stored_size) AS stored_size
+            FROM blobs b JOIN files f ON f.blob_hash = b.blob_hash
+            WHERE b.created_at <= datetime('now', ?)
+            GROUP BY b.blob_hash
+            HAVING SUM(f.stored_size IS NULL) > 0
+            LIMIT ?
+            """,
+            (f"-{int(min_age)} seconds", limit),
+        ).fetchall()
+    return [dict(r) for r in rows]
+
+
+def set_blob_storage(blob_hash, codec, stored_size, store=None):
+    """Record how a blob is stored on every file that refers to it.
+
+    store() runs inside the write transaction, after the blob is known to
+    still exist, to put the compressed copy in place; a compressed blob
+    also leaves the chunk store, whose offsets are into the raw content.
+    Returns False if the blob is gone.
+    """
+    with get_connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        if not conn.execute(
+            "SELECT 1 FROM blobs WHERE blob_hash=?", (blob_hash,)
+        ).fetchone():
+            return False
+        conn.execute(
+            "UPDATE files SET stored_codec=?, stored_size=? WHERE blob_hash=?",
+            (codec, stored_size, blob_hash),
+        )
+        if codec:
+            conn.execute("DELETE FROM chunks WHERE blob_hash=?", (blob_hash,))
+        if store:
+            store()
+    return True
+
+
+# chunk hashes per lookup query (SQLite caps bound parameters)
+_CHUNK_LOOKUP_BATCH = 500
+
+
+def find_chunks(chunk_hashes, client_id):
+    """{chunk_hash: (blob_hash, start, length)} for the hashes in the store.
+
+    Only chunks of blobs that a file of client_id's owner (any of that
+    user's clients) already refers to are returned: knowing a chunk's hash
+    must not be enough to get another tenant's content.
+    """
+    chunk_hashes = list(chunk_hashes)
+    found = {}
+    with get_connection() as conn:
+        for i in range(0, len(chunk_hashes), _CHUNK_LOOKUP_BATCH):
+            batch = chunk_hashes[i : i + _CHUNK_LOOKUP_BATCH]
+            rows = conn.execute(
+                f"""
+                SELECT ch.chunk_hash, ch.blob_hash, ch.start, ch.length
+                FROM chunks ch
+                WHERE ch.chunk_hash IN ({",".join("?" * len(batch))})
+                AND EXISTS (
+                    SELECT 1 FROM files f
+                    JOIN clients c ON c.client_id = f.client_id
+                    WHERE f.blob_hash = ch.blob_hash
+                    AND c.user_id = (
+                        SELECT user_id FROM clients WHERE client_id = ?
+                    )
+                )
+                """,
+                (*batch, client_id),
+            )
+            for r in rows:
+                found[r["chunk_hash"]] = (r["blob_hash"], r["start"], r["length"])
+    return found
+
+
+def list_blob_hashes(prefix):
+    """Hashes of stored blobs starting with prefix (one BLOB_DIR shard)."""
+    with get_connection() as conn:
+        rows = conn.execute(
+            "SELECT blob_hash FROM blobs WHERE blob_hash >= ? AND blob_hash < ?",
+            (prefix, prefix + "\U0010ffff"),
+        )
+        return {r["blob_hash"] for r in rows}
 
 
 def update_file_progress(file_id, received):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        UPDATE files
-        SET received = ?, status='UPLOADING'
-        WHERE file_id = ?
-    """,
-        (received, file_id),
-    )
-    conn.commit()
-    conn.close()
-
-
-def finish_file_upload(file_id, checksum=None):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        UPDATE files
-        SET status='UPLOADED',
-            received = size,
-            checksum = COALESCE(?, checksum),
-            upload_time=datetime('now')
-        WHERE file_id = ?
-    """,
-        (checksum, file_id),
-    )
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        conn.execute(
+            """
+            UPDATE files
+            SET received = ?, status='UPLOADING'
+            WHERE file_id = ?
+            """,
+            (received, file_id),
+        )
+
+
+def finish_file_upload(
+    file_id, checksum=None, blob_hash=None, store_blob=None, chunks=(), wire_bytes=None
+):
+    """Mark an upload UPLOADED; with blob_hash, as a reference to that blob.
+
+    store_blob(first) runs inside the write transaction once the reference
+    is counted; first is True when no file held the blob before, so the
+    caller has to put the content in place. chunks, (chunk_hash, start,
+    length) inside the blob, go into the chunk store alongside; wire_bytes
+    is what the client sent of a chunked upload.
+    """
+    with get_connection() as conn:
+        if blob_hash is not None:
+            conn.execute("BEGIN IMMEDIATE")
+            refs = conn.execute(
+                """
+                INSERT INTO blobs (blob_hash, size, refcount, created_at)
+                SELECT ?, size, 1, datetime('now') FROM files WHERE file_id = ?
+                ON CONFLICT(blob_hash) DO UPDATE SET refcount = refcount + 1
+                RETURNING refcount
+                """,
+                (blob_hash, file_id),
+            ).fetchone()
+            conn.execute(
+                "UPDATE files SET blob_hash=?, wire_bytes=? WHERE file_id=?",
+                (blob_hash, wire_bytes, file_id),
+            )
+            conn.executemany(
+                """
+                INSERT OR IGNORE INTO chunks (chunk_hash, blob_hash, start, length)
+                VALUES (?, ?, ?, ?)
+                """,
+                ((h, blob_hash, start, length) for h, start, length in chunks),
+            )
+            if refs and store_blob:
+                store_blob(refs["refcount"] == 1)
+        conn.execute("DELETE FROM file_segments WHERE file_id=?", (file_id,))
+        conn.execute("DELETE FROM file_ranges WHERE file_id=?", (file_id,))
+        conn.execute(
+            """
+            UPDATE files
+            SET status='UPLOADED',
+                received = size,
+                checksum = COALESCE(?, checksum),
+                upload_time=datetime('now')
+            WHERE file_id = ?
+            """,
+            (checksum, file_id),
+        )
 
 
 def attach_file_to_action(action_id, file_id):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        UPDATE actions
-        SET file_id = ?
-        WHERE action_id = ?
-        """,
-        (file_id, action_id),
-    )
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        rows = conn.execute(
+            f"""
+            UPDATE actions
+            SET file_id = ?
+            WHERE action_id = ?
+            RETURNING {_ACTION_EVENT_COLUMNS}
+            """,
+            (file_id, action_id),
+        ).fetchall()
+    _action_changed(rows)
 
 
 # ACTIONS
+# Called with the action's row after it is created, changes status or gets
+# its file; the live event feed hooks in here. Listeners must be quick and
+# must not raise.
+_action_listeners = []
+_ACTION_EVENT_COLUMNS = "action_id, client_id, file_id, action_type, status"
+
+
+def on_action_change(listener):
+    _action_listeners.append(listener)
+
+
+def _action_changed(rows):
+    for row in rows:
+        for listener in _action_listeners:
+            listener(dict(row))
+
+
 def create_action(client_id, file_id, action_type):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        INSERT INTO actions (client_id, file_id, action_type, status)
-        VALUES (?, ?, ?, 'PENDING')
-    """,
-        (client_id, file_id, action_type),
+    with get_connection() as conn:
+        cur = conn.execute(
+            """
+            INSERT INTO actions (client_id, file_id, action_type, status)
+            VALUES (?, ?, ?, 'PENDING')
+            """,
+            (client_id, file_id, action_type),
+        )
+        action_id = cur.lastrowid
+    _action_changed(
+        [
+            {
+                "action_id": action_id,
+                "client_id": client_id,
+                "file_id": file_id,
+                "action_type": action_type,
+                "status": "PENDING",
+            }
+        ]
     )
-    conn.commit()
-    conn.close()
+    return action_id
 
 
 def set_action_status(action_id, status):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        UPDATE actions
-        SET status = ?
-        WHERE action_id = ?
-    """,
-        (status, action_id),
-    )
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        rows = conn.execute(
+            f"""
+            UPDATE actions
+            SET status = ?
+            WHERE action_id = ?
+            RETURNING {_ACTION_EVENT_COLUMNS}
+            """,
+            (status, action_id),
+        ).fetchall()
+    _action_changed(rows)
+
+
+def update_action_progress(action_id, progress):
+    """Bytes of a download sent so far (shown while it runs)."""
+    with get_connection() as conn:
+        conn.execute(
+            "UPDATE actions SET progress = ? WHERE action_id = ?",
+            (progress, action_id),
+        )
 
 
 def mark_action_running(action_id):
@@ -324,53 +811,45 @@ def mark_action_resumed(action_id):
 
 
 def get_action(action_id):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM actions WHERE action_id=?", (action_id,))
-    row = cur.fetchone()
-    conn.close()
+    with get_connection() as conn:
+        row = conn.execute(
+            "SELECT * FROM actions WHERE action_id=?", (action_id,)
+        ).fetchone()
     return dict(row) if row else None
 
 
 def get_action_by_file(file_id):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM actions WHERE file_id=?", (file_id,))
-    row = cur.fetchone()
-    conn.close()
+    with get_connection() as conn:
+        row = conn.execute(
+            "SELECT * FROM actions WHERE file_id=?", (file_id,)
+        ).fetchone()
     return dict(row) if row else None
 
 
 def get_pending_actions_by_client(client_id):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT * FROM actions
-        WHERE client_id = ?
-        AND status IN ('PENDING', 'RUNNING')
-    """,
-        (client_id,),
-    )
-    rows = cur.fetchall()
-    conn.close()
+    with get_connection() as conn:
+        rows = conn.execute(
+            """
+            SELECT * FROM actions
+            WHERE client_id = ?
+            AND status IN ('PENDING', 'RUNNING')
+            """,
+            (client_id,),
+        ).fetchall()
     return [dict(r) for r in rows]
 
 
 def get_interrupted_action(client_id):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT action_id, client_id, file_id, action_type, status
-        FROM actions
-        WHERE client_id=? AND status='INTERRUPTED'
-        ORDER BY action_id ASC LIMIT 1
-    """,
-        (client_id,),
-    )
-    row = cur.fetchone()
-    conn.close()
+    with get_connection() as conn:
+        row = conn.execute(
+            """
+            SELECT action_id, client_id, file_id, action_type, status
+            FROM actions
+            WHERE client_id=? AND status='INTERRUPTED'
+            ORDER BY action_id ASC LIMIT 1
+            """,
+            (client_id,),
+        ).fetchone()
     if not row:
         return None
     return dict(row)
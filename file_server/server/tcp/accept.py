@@ -0,0 +1,126 @@
+import threading, time
+from collections import deque
+
+from tcp.control import register_handler
+
+# Accept-side metrics. Both engines hand a fresh connection off right after
+# accept() and run the TLS handshake elsewhere (a worker thread or the event
+# loop), so a stalled client costs one handshake timeout on its own
+# connection instead of holding up everyone queued behind it.
+
+# accept rate is averaged over this many seconds
+ACCEPT_RATE_WINDOW = 10
+# handshake durations kept for the latency percentiles
+HANDSHAKE_SAMPLES = 1024
+
+
+class PendingHandshake:
+    """One accepted connection whose handshake has not finished yet."""
+
+    __slots__ = ("stats", "started", "finished")
+
+    def __init__(self, stats):
+        self.stats = stats
+        self.started = time.monotonic()
+        self.finished = False
+
+    def done(self):
+        self.stats._finish(self, "ok")
+
+    def failed(self, timed_out=False):
+        self.stats._finish(self, "timed_out" if timed_out else "failed")
+
+    def abandoned(self):
+        """The connection went away with the handshake unfinished."""
+        self.failed()
+
+
+class AcceptStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._per_second = deque()  # [second, accepts] for the rate window
+        self._durations = deque(maxlen=HANDSHAKE_SAMPLES)
+        self._pending = set()
+        self.accepted = 0
+        self.counts = {"ok": 0, "failed": 0, "timed_out": 0}
+        self.backlog = None
+        self.handshake_timeout = None
+
+    def configure(self, backlog, handshake_timeout):
+        self.backlog = backlog
+        self.handshake_timeout = handshake_timeout
+
+    def accept(self):
+        """Count an accepted connection; returns its PendingHandshake."""
+        pending = PendingHandshake(self)
+        second = int(pending.started)
+        with self._lock:
+            self.accepted += 1
+            self._pending.add(pending)
+            if self._per_second and self._per_second[-1][0] == second:
+                self._per_second[-1][1] += 1
+            else:
+                self._per_second.append([second, 1])
+                while self._per_second[0][0] <= second - ACCEPT_RATE_WINDOW:
+                    self._per_second.popleft()
+        return pending
+
+    def _finish(self, pending, outcome):
+        elapsed = time.monotonic() - pending.started
+        with self._lock:
+            # first outcome wins (asyncio: finalizer and sweep may both fire)
+            if pending.finished:
+                return
+            pending.finished = True
+            self._pending.discard(pending)
+            self.counts[outcome] += 1
+            if outcome == "ok":
+                self._durations.append(elapsed)
+
+    def _sweep(self):
+        """Time out handshakes the engine lost track of.
+
+        asyncio drops a connection that fails its handshake without telling
+        the application; anything still pending well past the handshake
+        timeout is gone.
+        """
+        if not self.handshake_timeout:
+            return
+        cutoff = time.monotonic() - self.handshake_timeout - 1
+        with self._lock:
+            stale = [p for p in self._pending if p.started < cutoff]
+        for pending in stale:
+            pending.failed(timed_out=True)
+
+    def stats(self, message=None):
+        self._sweep()
+        now = int(time.monotonic())
+        with self._lock:
+            handshaking = len(self._pending)
+            recent = sum(n for s, n in self._per_second if s > now - ACCEPT_RATE_WINDOW)
+            durations = sorted(self._durations)
+
+        def ms(pct):
+            if not durations:
+                return None
+            index = min(len(durations) - 1, int(len(durations) * pct / 100))
+            return round(durations[index] * 1000, 2)
+
+        return {
+            "accepted": self.accepted,
+            "accept_rate": round(recent / ACCEPT_RATE_WINDOW, 1),
+            "handshaking": handshaking,
+            "handshakes_ok": self.counts["ok"],
+            "handshakes_failed": self.counts["failed"],
+            "handshakes_timed_out": self.counts["timed_out"],
+            "handshake_ms_p50": ms(50),
+            "handshake_ms_p99": ms(99),
+            "backlog": self.backlog,
+            "handshake_timeout": self.handshake_timeout,
+        }
+
+    def start(self):
+        register_handler("accept", self.stats)
+
+
+accepts = AcceptStats()
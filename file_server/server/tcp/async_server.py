@@ -0,0 +1,993 @@
+"""Asyncio engine for the TCP transfer server.
+
+Speaks the same LOGIN / PING / upload / download / OFFSET-resume protocol,
+as v1 text or v2 frames (tcp/framing.py), as ``handle_client`` in
+tcp_server.py, but every connection is a small state machine driven by one
+event loop instead of an OS thread, so one process can hold 10k+ mostly
+idle agents. Blocking SQLite and bcrypt calls are pushed to
+the default executor with ``asyncio.to_thread``.
+"""
+
+import asyncio, ssl, os, time, hashlib, weakref
+
+from db.model import (
+    get_client,
+    add_file,
+    update_file_status,
+    get_pending_actions_by_client,
+    get_action_by_file,
+    set_action_status,
+    get_file,
+    filename_taken,
+    get_interrupted_action,
+    attach_file_to_action,
+    get_file_segments,
+    get_file_ranges,
+    update_action_progress,
+)
+
+from utils.hash import verify_password_cached, keep_credentials
+from tcp.common import (
+    HOST,
+    PORT,
+    STORAGE_DIR,
+    ACTION_POLL_INTERVAL,
+    UPLOAD_BUFFER_SIZE,
+    DOWNLOAD_BLOCK_SIZE,
+    RESUME_REPLY_TIMEOUT,
+    TLS_HANDSHAKE_TIMEOUT,
+    TCP_BACKLOG,
+    get_unique_filename,
+    parse_ping,
+    parse_download_offset,
+)
+from tcp.dispatcher import dispatcher
+from tcp.progress import progress, FLUSH_INTERVAL, FLUSH_BYTES
+from tcp.events import feed
+from utils.blobstore import open_stored, content_size, staging_path, promote
+from tcp.tls import sessions
+from tcp.accept import accepts
+from tcp.liveness import liveness
+from tcp.pipeline import UploadPipeline
+from tcp.ranges import (
+    MAX_STREAMS,
+    STREAM_IDLE_TIMEOUT,
+    parse_size_line,
+    wants_ranges,
+    open_ranged_upload,
+    find_ranged_upload,
+)
+from tcp.chunks import (
+    MANIFEST_TIMEOUT,
+    ChunkedUpload,
+    CheckedManifest,
+    manifest_count,
+    wants_chunks,
+    parse_manifest,
+    prefer_ranges,
+)
+from tcp.codecs import (
+    AsyncFrameReader,
+    FrameEncoder,
+    FRAME_SIZE,
+    HEADER_SIZE,
+    parse_offer,
+    choose_codec,
+    codec_line,
+)
+from tcp.framing import (
+    LOGIN_V2,
+    CONTROL,
+    DATA,
+    ACK,
+    PROGRESS,
+    CHECKSUM,
+    AsyncChannel,
+    pack_progress,
+)
+from tcp.hashing import (
+    UploadHasher,
+    resume_hasher,
+    suspend as suspend_hasher,
+    verify_upload,
+)
+
+
+async def db(fn, *args):
+    return await asyncio.to_thread(fn, *args)
+
+
+def write_range_block(upload, h, data, offset):
+    if not upload.write(data, offset):
+        return False
+    h.update(data)
+    return True
+
+
+async def read_text(reader, timeout=None):
+    """One message as text; "" on timeout, None once the connection is gone."""
+    try:
+        data = await asyncio.wait_for(reader.read(4096), timeout)
+    except asyncio.TimeoutError:
+        return ""
+    except (ConnectionError, OSError):
+        return None
+    if not data:
+        return None
+    return data.decode(errors="ignore").strip()
+
+
+class ClientSession:
+    """One connected agent: IDLE -> (RESUME | ACTION) -> UPLOAD/DOWNLOAD -> IDLE."""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        # v2 (tcp/framing.py): self.reader is then the channel, and upload
+        # bytes come from its DATA frames
+        self.channel = None
+        self.data_reader = reader
+        self.addr = writer.get_extra_info("peername")
+        self.cid = None
+        self.waiting_for_path = False
+        self.current_action = None
+        self.wake_event = asyncio.Event()
+        self.actions_dirty = True
+        self.last_poll = 0
+        self._wake = None
+
+    async def send(self, data, kind=CONTROL):
+        """data as is on v1; a `kind` frame on v2."""
+        if self.channel:
+            self.channel.write(kind, data)
+        else:
+            self.writer.write(data)
+        await self.writer.drain()
+
+    async def report_progress(self, file_id):
+        """PROGRESS frame with the offset just checkpointed; none on v1."""
+        if self.channel:
+            await self.send(pack_progress(progress.received(file_id)), PROGRESS)
+
+    def touch(self):
+        liveness.beat(self.cid)
+
+    async def next_input(self, timeout):
+        """Wait for client data or a dispatcher wake-up; None means EOF.
+
+        Cancelling a pending StreamReader.read does not consume data, so the
+        read can be dropped safely when the wake-up wins.
+        """
+        read = asyncio.ensure_future(self.reader.read(4096))
+        woken = asyncio.ensure_future(self.wake_event.wait())
+        done, pending = await asyncio.wait(
+            {read, woken}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+        )
+        for task in pending:
+            task.cancel()
+
+        if self.wake_event.is_set():
+            self.wake_event.clear()
+            self.actions_dirty = True
+
+        if read not in done:
+            return ""
+        try:
+            data = read.result()
+        except (ConnectionError, OSError):
+            return None
+        if not data:
+            return None
+        return data.decode(errors="ignore").strip()
+
+    # ========== LOGIN ==========
+    async def login(self):
+        raw = await self.reader.read(1024)
+        if not raw:
+            return False
+        parts = raw.decode(errors="ignore").strip().split(" ", 2)
+
+        if parts[0] == "STREAM":
+            await self.serve_stream(parts)
+            return False
+
+        if len(parts) != 3 or parts[0] not in ("LOGIN", LOGIN_V2):
+            await self.send(b"ERROR UNKNOWN_COMMAND\n")
+            return False
+
+        command, cid, pwd = parts
+        user = await db(get_client, cid)
+
+        if not user or not await db(
+            verify_password_cached, f"client:{cid}", pwd, user["password_hash"]
+        ):
+            await self.send(b"ERROR INVALID_CREDENTIALS\n")
+            return False
+
+        self.cid = cid
+        loop = asyncio.get_running_loop()
+        self._wake = lambda: loop.call_soon_threadsafe(self.wake_event.set)
+        dispatcher.register(cid, self._wake)
+        liveness.login(cid)
+        if command == LOGIN_V2:
+            await self.send(b"OK AUTHORIZED V2\n")
+            self.channel = AsyncChannel(self.reader, self.writer)
+            self.reader, self.data_reader = self.channel, self.channel.data
+        else:
+            await self.send(b"OK AUTHORIZED\n")
+        print(f"[AUTH] {cid} {command}")
+        return True
+
+    async def run(self):
+        print(f"[CONNECTED] {self.addr}")
+        try:
+            if not await self.login():
+                return
+
+            while True:
+                if not self.waiting_for_path and liveness.expired(self.cid):
+                    print(f"[TIMEOUT] {self.cid} => OFFLINE")
+                    break
+
+                if self.waiting_for_path:
+                    data = await read_text(self.reader, None)
+                    if data is None:
+                        break
+                else:
+                    data = await self.next_input(1.0)
+                    if data is None:
+                        break
+
+                await self.step(data)
+
+        except Exception as e:
+            print(f"[ERROR] {self.cid} crashed: {e}")
+
+        finally:
+            if self._wake:
+                dispatcher.unregister(self.cid, self._wake)
+                liveness.logout(self.cid)
+                keep_credentials(f"client:{self.cid}")
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except Exception:
+                pass
+            print(f"[DISCONNECTED] {self.addr}")
+
+    async def step(self, data):
+        cid = self.cid
+
+        # ========== HEARTBEAT ==========
+        if not self.waiting_for_path and data.startswith("PING"):
+            self.touch()
+            token = parse_ping(data)
+            if token:
+                await self.send(f"PONG {token}\n".encode())
+            return
+
+        # actions are pushed through the dispatcher; polling is the fallback
+        poll_due = not self.waiting_for_path and (
+            self.actions_dirty or time.time() - self.last_poll > ACTION_POLL_INTERVAL
+        )
+        if poll_due:
+            self.actions_dirty = False
+            self.last_poll = time.time()
+
+        # ========== RESUME ==========
+        if poll_due:
+            interrupted = await db(get_interrupted_action, cid)
+            if interrupted:
+                self.current_action = interrupted
+                liveness.hold(cid)
+                file_info = await db(get_file, interrupted["file_id"])
+                if not file_info:
+                    await db(set_action_status, interrupted["action_id"], "CANCELED")
+                    self.actions_dirty = True
+                    return
+
+                received = file_info["received"]
+                if interrupted["action_type"] == "DOWNLOAD":
+                    print(f"[RESUME DETECTED] {cid} download {file_info['filename']}")
+                    await self.resume_download(file_info)
+                    return
+
+                print(
+                    f"[RESUME DETECTED] {cid} {file_info['filename']} "
+                    f"{received}/{file_info['size']}"
+                )
+                await self.resume(file_info)
+                return
+
+        # ========== NEW ACTION ==========
+        if poll_due:
+            actions = await db(get_pending_actions_by_client, cid)
+            if not actions:
+                return
+            action = actions[0]
+            action_type = action.get("action_type")
+
+            if not action_type:
+                await db(set_action_status, action["action_id"], "CANCELED")
+                self.actions_dirty = True
+                return
+            if action["status"] in ("DONE", "CANCELED"):
+                return
+
+            self.current_action = action
+            self.waiting_for_path = True
+            await db(set_action_status, action["action_id"], "RUNNING")
+            liveness.hold(cid)
+
+            if action_type == "UPLOAD":
+                await self.send(b"\nUpload request\nEnter file path:\n\n")
+            elif action_type == "DOWNLOAD":
+                await self.send(b"\nDownload request\nEnter save path:\n\n")
+            return
+
+        if not self.waiting_for_path or not self.current_action or not data:
+            return
+
+        if self.current_action["action_type"] == "UPLOAD":
+            await self.upload(data)
+        elif self.current_action["action_type"] == "DOWNLOAD":
+            await self.download(data)
+
+    def finish(self):
+        self.waiting_for_path = False
+        # the action just ended, the next one may already be queued
+        self.actions_dirty = True
+
+    # ========== UPLOAD ==========
+    async def upload(self, data):
+        cid = self.cid
+        action = self.current_action
+        folder = os.path.join(STORAGE_DIR, cid)
+        os.makedirs(folder, exist_ok=True)
+
+        req = data.strip()
+        if req.lower() == "cancel":
+            await db(set_action_status, action["action_id"], "CANCELED")
+            await self.send(b"Upload canceled.\n")
+            self.finish()
+            return
+
+        clean = req.replace("\\", "/")
+        filename = await db(
+            get_unique_filename,
+            folder,
+            os.path.basename(clean),
+            lambda name: filename_taken(cid, name),
+        )
+        await self.send(b"OK START_UPLOAD\n")
+
+        size_line = await read_text(self.reader, 5.0) or ""
+        file_size, streams = parse_size_line(size_line)
+        chunk_count = manifest_count(size_line)
+        chunked = wants_chunks(file_size, chunk_count)
+        ranged = not chunked and wants_ranges(file_size, streams)
+        # range streams are never framed
+        offer = parse_offer(size_line)
+        codec = None if ranged else choose_codec(offer)
+        file_id = await db(add_file, cid, filename, file_size, "UPLOADING", codec)
+        action["file_id"] = file_id
+        await db(attach_file_to_action, action["action_id"], file_id)
+
+        save_path = os.path.join(folder, filename)
+        print(f"[NEW UPLOAD] {cid} uploading {filename}")
+        if offer is not None:
+            await self.send(codec_line(codec).encode())
+
+        manifest = None
+        if chunked:
+            manifest = await self.run_chunked_upload(
+                file_id, save_path, file_size, chunk_count, codec, streams
+            )
+            if manifest is None:
+                return
+            ranged = True
+
+        if ranged:
+            upload = await db(
+                open_ranged_upload, file_id, save_path, file_size, False, self.cid
+            )
+            upload.manifest = manifest
+            await self.send(upload.header(streams).encode())
+            await self.run_ranged_upload(upload)
+            return
+
+        open(save_path, "wb").close()
+        await self.send(b"0\n")
+        await self.run_upload(
+            file_id, save_path, UploadHasher.fresh(), 0, file_size, codec=codec
+        )
+
+    async def resume(self, file_info):
+        cid = self.cid
+        action = self.current_action
+        file_id = file_info["file_id"]
+        filename = file_info["filename"]
+        file_size = file_info["size"]
+        received = file_info["received"]
+        save_path = staging_path(cid, filename)
+
+        if await db(get_file_ranges, file_id):
+            upload = await db(
+                open_ranged_upload, file_id, save_path, file_size, True, self.cid
+            )
+            self.waiting_for_path = True
+            await db(set_action_status, action["action_id"], "RUNNING")
+            print(f"[RESUME] {cid} {filename} {len(upload.pending)} ranges left")
+            await self.send(upload.header(MAX_STREAMS).encode())
+            self.touch()
+            await self.run_ranged_upload(upload)
+            return
+
+        segments = await db(get_file_segments, file_id)
+        try:
+            hasher = await db(resume_hasher, file_id, save_path, received, segments)
+        except OSError as e:
+            print(f"[RESUME] {cid} {filename} restarting from 0: {e}")
+            received = 0
+            hasher = UploadHasher.fresh()
+            os.makedirs(os.path.dirname(save_path), exist_ok=True)
+            open(save_path, "wb").close()
+
+        self.waiting_for_path = True
+        await db(set_action_status, action["action_id"], "RUNNING")
+        # the upload goes on framed if it started that way
+        codec = file_info.get("upload_codec")
+        reply = f"OFFSET {received}\n"
+        if codec:
+            reply = codec_line(codec) + reply
+        await self.send(reply.encode())
+        self.touch()
+
+        # the client streams right after OFFSET, there is no prompt;
+        # a client that lost its upload path answers "cancel"
+        # (framed, the CHECKSUM line may follow sooner than UPLOAD_BUFFER_SIZE)
+        want = HEADER_SIZE if codec else UPLOAD_BUFFER_SIZE
+        try:
+            head = await self.read_head(min(want, file_size - received))
+        except (ConnectionError, OSError):
+            head = b""
+        if head.strip().lower() == b"cancel":
+            print(f"[RESUME CANCELED] {cid} {filename}")
+            await db(set_action_status, action["action_id"], "CANCELED")
+            await db(update_file_status, file_id, "CANCELED")
+            self.finish()
+            return
+
+        print(f"[RESUME] {cid} {filename} from {received}/{file_size}")
+        await self.run_upload(
+            file_id, save_path, hasher, received, file_size, head, codec
+        )
+
+    async def read_head(self, n):
+        """Same contract as recv_head in tcp/framing.py."""
+        if not self.channel:
+            return await self.reader.read(n)
+        if n <= 0:
+            return b""
+        head = await self.data_reader.read(n)
+        if not head and self.channel.take_cancel():
+            return b"cancel"
+        return head
+
+    async def canceled_by_client(self, file_id):
+        """Same contract as canceled_by_client in tcp_server.py."""
+        if not self.channel or not self.channel.take_cancel():
+            return False
+        await db(set_action_status, self.current_action["action_id"], "CANCELED")
+        await db(update_file_status, file_id, "CANCELED")
+        return True
+
+    async def run_upload(
+        self, file_id, save_path, hasher, received, file_size, head=b"", codec=None
+    ):
+        """Same contract as run_upload in tcp_server.py."""
+        cid = self.cid
+        action = self.current_action
+        source = self.data_reader
+        if codec:
+            source, head = AsyncFrameReader(source, codec, head), b""
+        with open(save_path, "r+b") as f:
+            # drop bytes written after the last checkpoint; the client resends them
+            f.truncate(received)
+            f.seek(received)
+            state = await self.receive_upload(
+                f, hasher, file_id, received, file_size, head, source
+            )
+
+        if state == "INTERRUPTED" and await self.canceled_by_client(file_id):
+            state = "CANCELED"
+        if state == "CANCELED":
+            print(f"[UPLOAD CANCELED] {cid}")
+            try:
+                os.remove(save_path)
+            except OSError:
+                pass
+            self.finish()
+            return
+        if state == "INTERRUPTED":
+            print(f"[INTERRUPTED] {cid}")
+            await db(set_action_status, action["action_id"], "INTERRUPTED")
+            suspend_hasher(file_id, hasher)
+            self.finish()
+            return
+
+        try:
+            await self.complete_upload(file_id, hasher, save_path)
+        finally:
+            progress.stop(file_id, flush=False)
+        self.finish()
+        self.touch()
+
+    async def receive_upload(
+        self, f, hasher, file_id, received_now, file_size, head, source
+    ):
+        """Same contract as receive_upload in tcp_server.py; reads source."""
+        pipeline = UploadPipeline(f, hasher)
+        progress.start(
+            file_id,
+            f,
+            received_now,
+            hasher,
+            self.cid,
+            written=lambda: received_now + pipeline.completed,
+        )
+        try:
+            state = await self.pump_upload(
+                pipeline, file_id, received_now, file_size, head, source
+            )
+            await db(pipeline.close)
+        except BaseException:
+            # bytes a failed write never stored must not be checkpointed
+            try:
+                await db(pipeline.close)
+                intact = True
+            except Exception:
+                intact = False
+            progress.stop(file_id, flush=intact)
+            raise
+
+        if state != "DONE":
+            await db(progress.stop, file_id, state == "INTERRUPTED")
+        return state
+
+    async def pump_upload(
+        self, pipeline, file_id, received_now, file_size, head, source
+    ):
+        """Keep the loop on socket reads; the pipeline writes and hashes."""
+        part = head
+        while True:
+            if part:
+                if not pipeline.acquire(blocking=False):
+                    await db(pipeline.acquire)
+                pipeline.submit(part)
+                received_now += len(part)
+
+                if progress.advance(file_id, len(part)):
+                    await db(pipeline.drain)
+                    await db(progress.flush, file_id)
+                    await self.report_progress(file_id)
+                    current = await db(get_action_by_file, file_id)
+                    if current and current["status"] == "CANCELED":
+                        return "CANCELED"
+
+            if received_now >= file_size:
+                return "DONE"
+            try:
+                part = await source.read(
+                    min(UPLOAD_BUFFER_SIZE, file_size - received_now)
+                )
+            except (ConnectionError, OSError):
+                part = b""
+            if not part:
+                return "INTERRUPTED"
+
+    async def complete_upload(self, file_id, hasher, save_path, chunked=None):
+        action = self.current_action
+        ck_line = await read_text(self.reader, 2.0) or ""
+        checksum = await db(verify_upload, ck_line, hasher, save_path)
+
+        if checksum is None:
+            await db(update_file_status, file_id, "CANCELED")
+            await db(set_action_status, action["action_id"], "CANCELED")
+            await self.send(b"ERROR CHECKSUM MISMATCH\n")
+            return False
+
+        # keyed by the tree digest: computed here from the bytes received
+        extra = ()
+        if chunked:
+            # a CheckedManifest reads the whole file
+            extra = (await db(chunked.index_entries), chunked.wire_bytes)
+        await db(promote, file_id, save_path, hasher.tree_hexdigest(), checksum, *extra)
+        await db(set_action_status, action["action_id"], "DONE")
+        await self.send(b"\nUpload completed!\n", ACK)
+        return True
+
+    # ========== CHUNKED UPLOAD ==========
+    async def read_lines(self, count, timeout):
+        """Same contract as recv_lines in tcp_server.py."""
+        lines, tail = [], b""
+        while len(lines) < count:
+            try:
+                data = await asyncio.wait_for(self.reader.read(65536), timeout)
+            except (asyncio.TimeoutError, ConnectionError, OSError):
+                break
+            if not data:
+                break
+            *done, tail = (tail + data).split(b"\n")
+            lines.extend(done)
+        return [line.decode(errors="ignore") for line in lines[:count]]
+
+    async def run_chunked_upload(
+        self, file_id, save_path, file_size, count, codec=None, streams=1
+    ):
+        """Same contract as run_chunked_upload in tcp_server.py."""
+        cid = self.cid
+        action = self.current_action
+        await self.send(b"MANIFEST\n")
+        lines = await self.read_lines(count, MANIFEST_TIMEOUT)
+        manifest = parse_manifest(lines, count, file_size)
+        if manifest is None:
+            print(f"[UPLOAD CANCELED] {cid} bad chunk manifest")
+            await db(update_file_status, file_id, "CANCELED")
+            await db(set_action_status, action["action_id"], "CANCELED")
+            await self.send(b"ERROR BAD MANIFEST\n")
+            self.finish()
+            return
+
+        with open(save_path, "w+b") as f:
+            upload = await db(ChunkedUpload, file_id, f, manifest, cid)
+            try:
+                print(f"[CHUNKS] {cid} needs {len(upload.needed)}/{count} chunks")
+                if prefer_ranges(upload, file_size, streams):
+                    print(f"[CHUNKS] {cid} too little stored, using ranges")
+                    return manifest
+                await self.send(upload.need_line().encode())
+                source = self.data_reader
+                if codec:
+                    source = AsyncFrameReader(source, codec)
+                state = await self.receive_chunks(upload, file_id, source)
+            finally:
+                upload.close()
+
+        if state == "INTERRUPTED" and await self.canceled_by_client(file_id):
+            state = "CANCELED"
+        if state == "DONE":
+            try:
+                await self.complete_upload(file_id, upload.hasher, save_path, upload)
+            finally:
+                progress.stop(file_id, flush=False)
+            self.touch()
+        elif state == "MISMATCH":
+            print(f"[UPLOAD CANCELED] {cid} chunk {upload.index} does not match")
+            await db(update_file_status, file_id, "CANCELED")
+            await db(set_action_status, action["action_id"], "CANCELED")
+            await self.send(b"ERROR CHUNK MISMATCH\n")
+        elif state == "CANCELED":
+            print(f"[UPLOAD CANCELED] {cid}")
+            try:
+                os.remove(save_path)
+            except OSError:
+                pass
+        else:
+            print(f"[INTERRUPTED] {cid}")
+            await db(set_action_status, action["action_id"], "INTERRUPTED")
+            suspend_hasher(file_id, upload.hasher)
+        self.finish()
+
+    async def receive_chunks(self, upload, file_id, source):
+        """Same contract as receive_chunks in tcp_server.py."""
+        progress.start(file_id, upload.f, 0, upload.hasher, self.cid)
+        state = "DONE"
+        try:
+            while not upload.done:
+                if upload.next_stored:
+                    n = await db(upload.copy_stored, FLUSH_BYTES)
+                else:
+                    try:
+                        data = await source.readexactly(upload.next_length)
+                    except (asyncio.IncompleteReadError, ConnectionError, OSError):
+                        state = "INTERRUPTED"
+                        break
+                    if not upload.accept(data):
+                        state = "MISMATCH"
+                        break
+                    n = len(data)
+
+                if progress.advance(file_id, n):
+                    await db(progress.flush, file_id)
+                    await self.report_progress(file_id)
+                    current = await db(get_action_by_file, file_id)
+                    if current and current["status"] == "CANCELED":
+                        state = "CANCELED"
+                        break
+        except BaseException:
+            progress.stop(file_id, flush=False)
+            raise
+
+        if state != "DONE":
+            await db(progress.stop, file_id, state == "INTERRUPTED")
+        return state
+
+    # ========== PARALLEL UPLOAD ==========
+    async def serve_stream(self, parts):
+        """Same contract as serve_stream in tcp_server.py."""
+        upload = None
+        if len(parts) == 3 and parts[1].isdigit():
+            upload = find_ranged_upload(int(parts[1]), parts[2])
+        if not upload or not upload.attach():
+            await self.send(b"ERROR UNKNOWN_STREAM\n")
+            return
+
+        try:
+            while True:
+                claimed = await db(upload.claim)
+                if claimed is None:
+                    await self.send(b"END\n")
+                    return
+                index, start, length = claimed
+                try:
+                    await self.send(f"RANGE {index} {start} {length}\n".encode())
+                    digest = await self.receive_range(upload, start, length)
+                except BaseException:
+                    upload.release(index)
+                    raise
+                if digest is None:
+                    upload.release(index)
+                    return
+                await db(upload.complete, index, digest)
+        finally:
+            upload.detach()
+
+    async def receive_range(self, upload, start, length):
+        h = hashlib.sha256()
+        pos, end = start, start + length
+        while pos < end:
+            try:
+                part = await asyncio.wait_for(
+                    self.reader.read(min(UPLOAD_BUFFER_SIZE, end - pos)),
+                    STREAM_IDLE_TIMEOUT,
+                )
+            except (asyncio.TimeoutError, ConnectionError, OSError):
+                part = b""
+            if not part:
+                return None
+            if not await db(write_range_block, upload, h, part, pos):
+                return None
+            pos += len(part)
+        return h.hexdigest()
+
+    async def run_ranged_upload(self, upload):
+        """Same contract as run_ranged_upload in tcp_server.py."""
+        cid = self.cid
+        action = self.current_action
+        file_id = upload.file_id
+        state = "DONE"
+        read = asyncio.ensure_future(self.reader.read(4096))
+        try:
+            while not await db(upload.wait, 1.0):
+                if read.done():
+                    try:
+                        data = read.result()
+                    except (ConnectionError, OSError):
+                        data = b""
+                    if not data:
+                        state = "INTERRUPTED"
+                        break
+                    if data.decode(errors="ignore").strip().lower() == "cancel":
+                        await db(set_action_status, action["action_id"], "CANCELED")
+                        await db(update_file_status, file_id, "CANCELED")
+                        state = "CANCELED"
+                        break
+                    read = asyncio.ensure_future(self.reader.read(4096))
+                if upload.stalled():
+                    state = "INTERRUPTED"
+                    break
+                current = await db(get_action_by_file, file_id)
+                if current and current["status"] == "CANCELED":
+                    state = "CANCELED"
+                    break
+        finally:
+            read.cancel()
+            upload.close()
+
+        if state == "DONE":
+            await self.send(b"RANGES DONE\n")
+            index = None
+            if upload.manifest:
+                index = CheckedManifest(upload.path, upload.manifest)
+            await self.complete_upload(file_id, upload.hasher(), upload.path, index)
+            self.finish()
+            self.touch()
+            return
+
+        try:
+            await self.send(f"RANGES {state}\n".encode())
+        except (ConnectionError, OSError):
+            pass
+        if state == "CANCELED":
+            print(f"[UPLOAD CANCELED] {cid}")
+            try:
+                os.remove(upload.path)
+            except OSError:
+                pass
+        else:
+            print(f"[INTERRUPTED] {cid}")
+            await db(set_action_status, action["action_id"], "INTERRUPTED")
+        self.finish()
+
+    # ========== DOWNLOAD ==========
+    async def download(self, data):
+        action = self.current_action
+        req = data.strip()
+        if req.lower() == "cancel":
+            await db(set_action_status, action["action_id"], "CANCELED")
+            await self.send(b"Download canceled.\n")
+            self.finish()
+            return
+
+        file_info = await db(get_file, action["file_id"])
+        file_size = content_size(file_info)
+
+        if file_size is None:
+            await self.send(b"ERROR FILE NOT FOUND ON SERVER\n")
+            self.finish()
+            return
+
+        await self.send(f"{file_size}|{file_info['filename']}\n".encode())
+        # a COMPRESS offer comes with the save path
+        offer = parse_offer(data)
+        codec = choose_codec(offer)
+        if offer is not None:
+            await self.send(codec_line(codec).encode())
+        await self.run_download(file_info, 0, file_size, codec)
+
+    async def resume_download(self, file_info):
+        """Same contract as resume_download in tcp_server.py."""
+        cid = self.cid
+        action = self.current_action
+        filename = file_info["filename"]
+        file_size = content_size(file_info)
+        if file_size is None:
+            await db(set_action_status, action["action_id"], "CANCELED")
+            await self.send(b"ERROR FILE NOT FOUND ON SERVER\n")
+            self.actions_dirty = True
+            return
+
+        self.waiting_for_path = True
+        await db(set_action_status, action["action_id"], "RUNNING")
+        await self.send(f"DOWNLOAD_RESUME {file_size}|{filename}\n".encode())
+
+        offset = None
+        deadline = time.time() + RESUME_REPLY_TIMEOUT
+        while offset is None and time.time() < deadline:
+            reply = await read_text(self.reader, max(deadline - time.time(), 0.1))
+            if not reply or reply.lower() == "cancel":
+                break
+            self.touch()  # PINGs while the user decides
+            offset = parse_download_offset(reply, file_size)
+
+        if offset is None:
+            print(f"[RESUME CANCELED] {cid} download {filename}")
+            await db(set_action_status, action["action_id"], "CANCELED")
+            self.finish()
+            return
+
+        # a COMPRESS offer comes with the OFFSET line
+        offer = parse_offer(reply)
+        codec = choose_codec(offer)
+        if offer is not None:
+            await self.send(codec_line(codec).encode())
+        print(f"[RESUME] {cid} download {filename} from {offset}/{file_size}")
+        await self.run_download(file_info, offset, file_size, codec)
+
+    async def run_download(self, file_info, offset, file_size, codec=None):
+        action_id = self.current_action["action_id"]
+        sent = offset
+        flushed, flushed_at = sent, time.monotonic()
+        block = DOWNLOAD_BLOCK_SIZE if DOWNLOAD_BLOCK_SIZE > 0 else 8192
+        encoder = FrameEncoder(codec) if codec else None
+        if encoder:
+            block = FRAME_SIZE
+        try:
+            # a compressed file decodes a frame to seek
+            with await db(open_stored, file_info) as f:
+                await db(f.seek, offset)
+                while sent < file_size:
+                    data = await asyncio.to_thread(f.read, block)
+                    if not data:
+                        break
+                    n = len(data)
+                    if encoder:
+                        data = await asyncio.to_thread(encoder.encode, data)
+                    await self.send(data, DATA)
+                    sent += n
+                    feed.download(self.current_action, sent, file_size)
+                    if (
+                        sent - flushed >= FLUSH_BYTES
+                        or time.monotonic() - flushed_at >= FLUSH_INTERVAL
+                    ):
+                        await db(update_action_progress, action_id, sent)
+                        flushed, flushed_at = sent, time.monotonic()
+        except (ConnectionError, OSError):
+            feed.download_end(action_id)
+            print(f"[INTERRUPTED] {self.cid} download at {sent}/{file_size}")
+            await db(update_action_progress, action_id, sent)
+            await db(set_action_status, action_id, "INTERRUPTED")
+            self.finish()
+            return
+
+        feed.download_end(action_id)
+        if self.channel and file_info.get("checksum"):
+            await self.send(file_info["checksum"].encode(), CHECKSUM)
+        await self.send(b"\nDownload completed!\n", ACK)
+        await db(update_action_progress, action_id, file_size)
+        await db(set_action_status, action_id, "DONE")
+        self.finish()
+        self.touch()
+
+
+async def handle_connection(reader, writer):
+    await ClientSession(reader, writer).run()
+
+
+class _AcceptedProtocol(asyncio.StreamReaderProtocol):
+    def connection_made(self, transport):
+        # the ClientHello must reach start_tls, not the stream buffer;
+        # start_tls resumes reading once the TLS layer is in place
+        transport.pause_reading()
+        super().connection_made(transport)
+
+
+def connection_factory():
+    """Protocol for one accepted connection, made before its TLS handshake.
+
+    The listener is plain TCP: the callback runs the handshake with the
+    session context current at accept time, as wrap_socket does in the
+    thread engine, so a ticket key rotation applies to the next connection
+    without rebinding the listener.
+    """
+    pending = accepts.accept()
+
+    async def connected(reader, writer):
+        try:
+            await asyncio.wait_for(
+                writer.start_tls(sessions.context), TLS_HANDSHAKE_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            pending.failed(timed_out=True)
+        except (ssl.SSLError, ConnectionError, OSError):
+            pending.failed()
+        else:
+            pending.done()
+            sessions.record(writer.get_extra_info("ssl_object"))
+            await handle_connection(reader, writer)
+            return
+        sessions.record_failure()
+        writer.transport.abort()
+
+    reader = asyncio.StreamReader(limit=UPLOAD_BUFFER_SIZE)
+    protocol = _AcceptedProtocol(reader, connected)
+    weakref.finalize(protocol, pending.abandoned)
+    return protocol
+
+
+async def serve(host=HOST, port=PORT, backlog=TCP_BACKLOG):
+    accepts.configure(backlog, TLS_HANDSHAKE_TIMEOUT)
+    # same as asyncio.start_server, with a protocol factory that sees each
+    # connection at accept time; limit lets one read() return up to a full
+    # upload buffer of queued data
+    server = await asyncio.get_running_loop().create_server(
+        connection_factory, host, port, backlog=backlog, reuse_address=True
+    )
+    print(f"[TCP] Listening on {host}:{port} (SSL ENABLED, engine=asyncio)")
+    async with server:
+        await server.serve_forever()
+
+
+def start_async_server(backlog=TCP_BACKLOG):
+    asyncio.run(serve(backlog=backlog))
@@ -0,0 +1,270 @@
+import os, hashlib
+
+from db.model import find_chunks
+from utils.blobstore import blob_path
+from tcp.hashing import UploadHasher
+from tcp.ranges import wants_ranges
+
+# Chunk-level dedup. A client that offers "CHUNKS <n>" on its size line gets
+# "MANIFEST" back and sends n "<sha256> <length>" lines, one per content-
+# defined chunk of the file (cut as in cdc_chunks). The server answers
+# "NEED <k> <runs>" with the chunks it does not have (runs like "3-7 9",
+# inclusive) and the client sends only those, in manifest order, followed
+# by the usual CHECKSUM line. The file is rebuilt in its staging path from
+# stored chunks and received ones, then verified and promoted like any
+# other upload.
+#
+# The chunk store is an index: the chunks table records where a chunk sits
+# inside a stored blob, so it takes no disk of its own and goes away with
+# the blob. Chunks of a chunked upload are indexed when it is promoted.
+
+# The chunker parameters must match the client's, or nothing is ever found
+# again.
+CHUNK_MIN_SIZE = 16 * 1024
+CHUNK_MAX_SIZE = 256 * 1024
+# cut where the top 16 bits of the gear hash are zero: on average 64 KB
+# past CHUNK_MIN_SIZE
+CHUNK_MASK = 0xFFFF << 48
+# bigger manifests are refused and the file is uploaded whole
+CHUNK_MANIFEST_MAX = int(os.getenv("UPLOAD_CHUNK_MANIFEST_MAX", "262144"))
+# seconds the client gets for each piece of its manifest
+MANIFEST_TIMEOUT = float(os.getenv("UPLOAD_MANIFEST_TIMEOUT", "30"))
+# 0 turns chunked uploads off; the client's STREAMS offer then applies
+CHUNKED_UPLOADS = os.getenv("UPLOAD_CHUNKED", "1") not in ("", "0")
+# A client may offer CHUNKS and STREAMS together (the shipped one does).
+# The manifest decides: when more than this share of the file's bytes
+# would still have to be sent, and the file is big enough for parallel
+# ranges, the manifest is answered with the RANGES header instead of NEED.
+# Dedup then only serves files the store mostly has; everything else keeps
+# the throughput of parallel streams, at the cost of the manifest and one
+# read of the finished file to index its chunks (CheckedManifest).
+CHUNKED_MAX_NEED = float(os.getenv("UPLOAD_CHUNKED_MAX_NEED", "0.5"))
+
+# gear[b]: the first 8 bytes of sha256(b), big-endian
+GEAR = [
+    int.from_bytes(hashlib.sha256(bytes([b])).digest()[:8], "big") for b in range(256)
+]
+_MASK64 = (1 << 64) - 1
+
+
+def cdc_chunks(data):
+    """Reference content-defined chunker; yields memoryview slices of data.
+
+    Gear rolling hash, h = (h << 1) + GEAR[byte], restarted CHUNK_MIN_SIZE
+    bytes into each chunk; the chunk ends after the first byte that leaves
+    h & CHUNK_MASK == 0, or at CHUNK_MAX_SIZE. h only depends on the last
+    64 bytes, so an edit moves the cut points next to it and no others.
+    """
+    view = memoryview(data)
+    gear, mask = GEAR, CHUNK_MASK
+    start, size = 0, len(view)
+    while start < size:
+        end = min(start + CHUNK_MAX_SIZE, size)
+        cut, h = end, 0
+        for i in range(start + CHUNK_MIN_SIZE, end):
+            h = ((h << 1) + gear[view[i]]) & _MASK64
+            if not h & mask:
+                cut = i + 1
+                break
+        yield view[start:cut]
+        start = cut
+
+
+def manifest_count(line):
+    """n of a size line offering "CHUNKS <n>", or None."""
+    parts = line.split()
+    for key, value in zip(parts[1::2], parts[2::2]):
+        if key == "CHUNKS" and value.isdigit():
+            return int(value)
+    return None
+
+
+def wants_chunks(size, count):
+    return (
+        CHUNKED_UPLOADS
+        and hasattr(os, "pread")
+        and count is not None
+        and 0 < count <= CHUNK_MANIFEST_MAX
+        and size > 0
+    )
+
+
+def prefer_ranges(upload, size, streams):
+    """True if a planned chunked upload should go over range streams."""
+    return wants_ranges(size, streams) and upload.needed_bytes > CHUNKED_MAX_NEED * size
+
+
+def parse_manifest(lines, count, size):
+    """[(sha256, length)] of the manifest lines, or None unless they add up."""
+    if len(lines) != count:
+        return None
+    manifest = []
+    total = 0
+    for line in lines:
+        parts = line.split()
+        if len(parts) != 2 or len(parts[0]) != 64 or not parts[1].isdigit():
+            return None
+        try:
+            bytes.fromhex(parts[0])
+        except ValueError:
+            return None
+        length = int(parts[1])
+        if not 0 < length <= CHUNK_MAX_SIZE:
+            return None
+        manifest.append((parts[0].lower(), length))
+        total += length
+    return manifest if total == size else None
+
+
+def format_runs(indexes):
+    """Sorted indexes -> "0-4 7 9-10"."""
+    runs = []
+    for i in indexes:
+        if runs and runs[-1][1] == i - 1:
+            runs[-1][1] = i
+        else:
+            runs.append([i, i])
+    return " ".join(f"{a}-{b}" if a != b else str(a) for a, b in runs)
+
+
+def parse_runs(tokens):
+    """The indexes of "0-4 7 9-10" tokens (the client's side of NEED)."""
+    indexes = []
+    for token in tokens:
+        first, _, last = token.partition("-")
+        indexes.extend(range(int(first), int(last or first) + 1))
+    return indexes
+
+
+class ChunkedUpload:
+    """One chunked upload being rebuilt in its staging file.
+
+    The engine drives it: copy_stored() appends the chunks the server has,
+    up to the next one the client sends, and accept() appends that one once
+    its digest checks out. Stored chunks are read from blobs opened when
+    the plan is made, so a blob deleted meanwhile stays readable.
+    """
+
+    def __init__(self, file_id, f, manifest, client_id):
+        self.file_id = file_id
+        self.f = f
+        self.manifest = manifest
+        self.hasher = UploadHasher.fresh()
+        self.index = 0
+        self.wire_bytes = 0
+        self._fds = {}  # blob_hash -> fd (None: could not be opened)
+        self._sources = {}  # manifest index -> (fd, start); fd None: this file
+        self._first = {}  # chunk hash -> (start, length) of its first copy here
+
+        stored = find_chunks({h for h, _ in manifest}, client_id)
+        offset = 0
+        for i, (h, length) in enumerate(manifest):
+            if h in self._first:
+                self._sources[i] = (None, self._first[h][0])
+            elif h in stored and stored[h][2] == length:
+                fd = self._open(stored[h][0])
+                if fd is not None:
+                    self._sources[i] = (fd, stored[h][1])
+            self._first.setdefault(h, (offset, length))
+            offset += length
+        self.needed = [i for i in range(len(manifest)) if i not in self._sources]
+
+    def _open(self, blob_hash):
+        if blob_hash not in self._fds:
+            try:
+                self._fds[blob_hash] = os.open(blob_path(blob_hash), os.O_RDONLY)
+            except OSError:
+                self._fds[blob_hash] = None
+        return self._fds[blob_hash]
+
+    @property
+    def needed_bytes(self):
+        return sum(self.manifest[i][1] for i in self.needed)
+
+    def need_line(self):
+        return f"NEED {len(self.needed)} {format_runs(self.needed)}".rstrip() + "\n"
+
+    @property
+    def done(self):
+        return self.index == len(self.manifest)
+
+    @property
+    def next_stored(self):
+        """True if the next chunk comes from the store, not the client."""
+        return self.index in self._sources
+
+    @property
+    def next_length(self):
+        """Length of the chunk the client has to send next."""
+        return self.manifest[self.index][1]
+
+    def _append(self, data):
+        self.f.write(data)
+        self.hasher.update(data)
+        self.index += 1
+
+    def copy_stored(self, limit):
+        """Append stored chunks up to the next one the client sends.
+
+        Stops after about `limit` bytes so the caller can checkpoint; returns
+        the bytes appended.
+        """
+        copied = 0
+        while not self.done and copied < limit:
+            source = self._sources.get(self.index)
+            if source is None:
+                break
+            fd, start = source
+            length = self.manifest[self.index][1]
+            if fd is None:
+                self.f.flush()  # an earlier chunk of this very file
+                fd = self.f.fileno()
+            data = os.pread(fd, length, start)
+            if len(data) != length:
+                raise IOError(f"stored chunk {self.index} is short")
+            self._append(data)
+            copied += length
+        return copied
+
+    def accept(self, data):
+        """Append the chunk the client sent; False if it is not the promised one."""
+        if hashlib.sha256(data).hexdigest() != self.manifest[self.index][0]:
+            return False
+        self._append(data)
+        self.wire_bytes += len(data)
+        return True
+
+    def index_entries(self):
+        """(chunk_hash, start, length) for the chunk store once promoted."""
+        return [(h, start, length) for h, (start, length) in self._first.items()]
+
+    def close(self):
+        for fd in self._fds.values():
+            if fd is not None:
+                os.close(fd)
+        self._fds.clear()
+
+
+class CheckedManifest:
+    """The manifest of a chunked upload that went over range streams.
+
+    Indexed like a ChunkedUpload, but only chunks whose digest matches the
+    verified file: stored chunks are copied into later uploads unchecked.
+    """
+
+    wire_bytes = None
+
+    def __init__(self, path, manifest):
+        self.path = path
+        self.manifest = manifest
+
+    def index_entries(self):
+        entries, seen, start = [], set(), 0
+        with open(self.path, "rb") as f:
+            for h, length in self.manifest:
+                data = f.read(length)
+                if h not in seen and hashlib.sha256(data).hexdigest() == h:
+                    seen.add(h)
+                    entries.append((h, start, length))
+                start += length
+        return entries
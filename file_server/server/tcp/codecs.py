@@ -0,0 +1,349 @@
+import os, struct, zlib, lzma, asyncio
+
+try:
+    import zstandard
+except ImportError:  # optional, faster than zlib at a similar ratio
+    zstandard = None
+try:
+    import lz4.block
+except ImportError:  # optional, fastest, lower ratio
+    lz4 = None
+
+# Negotiated transfer compression. A client lists the codecs it takes, best
+# first: "COMPRESS zstd,zlib" on the size line of an upload, or on a line of
+# its own after a download's save path or OFFSET reply. The server answers
+# "COMPRESS <codec>" ("none" when nothing fits) right before the data, and
+# the data then travels as frames:
+#
+#     <kind:u8> <raw length:u32> <payload length:u32> <payload>
+#
+# kind RAW carries the bytes as they are, COMPRESSED the codec's output.
+# Frames are independent and offsets still count raw bytes, so a transfer
+# resumed at any offset just starts a new frame there; an upload keeps the
+# codec it was started with (files.upload_codec). A client that makes no
+# offer sees no change.
+
+# raw bytes per frame the server sends
+FRAME_SIZE = int(os.getenv("COMPRESS_FRAME_SIZE", str(1024 * 1024)))
+# largest frame accepted from a client
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+# compressed first to judge a frame; a sample that does not shrink below
+# MIN_RATIO sends the frame raw, and the next SKIP_FRAMES frames unsampled
+SAMPLE_SIZE = 16 * 1024
+MIN_RATIO = float(os.getenv("COMPRESS_MIN_RATIO", "0.9"))
+SKIP_FRAMES = 8
+# codecs the server agrees to; empty turns compression off
+ENABLED = os.getenv("TRANSFER_CODECS", "zstd,lz4,zlib,lzma").split(",")
+ZLIB_LEVEL = int(os.getenv("COMPRESS_ZLIB_LEVEL", "1"))
+LZMA_PRESET = int(os.getenv("COMPRESS_LZMA_PRESET", "1"))
+
+RAW, COMPRESSED = 0, 1
+_HEADER = struct.Struct(">BII")
+HEADER_SIZE = _HEADER.size
+# an entry of a FramedFile index: where an indexed frame's header starts
+_INDEX_ENTRY = struct.Struct(">Q")
+
+_codecs = {}
+
+
+class FrameError(OSError):
+    """A frame that does not decode; handled like a dropped connection."""
+
+
+def register_codec(name, compress, decompress):
+    """Make a codec negotiable.
+
+    compress(data) -> bytes; decompress(payload, size) must return exactly
+    `size` bytes (and never more) or raise.
+    """
+    _codecs[name] = (compress, decompress)
+
+
+def _zlib_decompress(payload, size):
+    d = zlib.decompressobj()
+    out = d.decompress(payload, size)
+    if not d.eof:
+        raise FrameError("zlib frame longer than announced")
+    return out
+
+
+def _lzma_decompress(payload, size):
+    d = lzma.LZMADecompressor()
+    out = d.decompress(payload, max_length=size)
+    if not d.eof:
+        raise FrameError("lzma frame longer than announced")
+    return out
+
+
+register_codec("zlib", lambda data: zlib.compress(data, ZLIB_LEVEL), _zlib_decompress)
+register_codec(
+    "lzma", lambda data: lzma.compress(data, preset=LZMA_PRESET), _lzma_decompress
+)
+if zstandard:
+    register_codec(
+        "zstd",
+        lambda data: zstandard.ZstdCompressor(level=3).compress(data),
+        lambda payload, size: zstandard.ZstdDecompressor().decompress(
+            payload, max_output_size=size
+        ),
+    )
+if lz4:
+    register_codec(
+        "lz4",
+        lambda data: lz4.block.compress(data, store_size=False),
+        lambda payload, size: lz4.block.decompress(payload, uncompressed_size=size),
+    )
+
+
+def has_codec(name):
+    return name in _codecs
+
+
+def parse_offer(text):
+    """Codecs offered by a "COMPRESS a,b" in text; None without an offer."""
+    tokens = text.split()
+    offer = None
+    for key, value in zip(tokens, tokens[1:]):
+        if key == "COMPRESS":
+            offer = value.split(",")
+    return offer
+
+
+def choose_codec(offer):
+    """The first offered codec the server has and allows, or None."""
+    for name in offer or ():
+        if name in _codecs and name in ENABLED:
+            return name
+    return None
+
+
+def codec_line(codec):
+    return f"COMPRESS {codec or 'none'}\n"
+
+
+class FrameEncoder:
+    """Frames of one outgoing transfer; data that does not shrink goes raw."""
+
+    def __init__(self, codec):
+        self.compress = _codecs[codec][0]
+        self.skip = 0
+
+    def encode(self, data):
+        payload, kind = data, RAW
+        if self.skip:
+            self.skip -= 1
+        elif len(self.compress(data[:SAMPLE_SIZE])) > MIN_RATIO * min(
+            len(data), SAMPLE_SIZE
+        ):
+            self.skip = SKIP_FRAMES
+        else:
+            packed = self.compress(data)
+            if len(packed) < len(data):
+                payload, kind = packed, COMPRESSED
+        return b"".join((_HEADER.pack(kind, len(data), len(payload)), payload))
+
+
+def parse_header(header):
+    """(kind, raw size, payload length) of a frame header."""
+    kind, size, length = _HEADER.unpack(header)
+    if not 0 < size <= MAX_FRAME_SIZE:
+        raise FrameError(f"frame of {size} bytes")
+    if kind == RAW and length != size:
+        raise FrameError("raw frame with a compressed length")
+    if kind == COMPRESSED and not 0 < length < size:
+        raise FrameError("compressed frame that does not shrink")
+    if kind not in (RAW, COMPRESSED):
+        raise FrameError(f"unknown frame kind {kind}")
+    return kind, size, length
+
+
+def decode_frame(codec, kind, size, payload):
+    if kind == RAW:
+        return payload
+    try:
+        out = _codecs[codec][1](payload, size)
+    except FrameError:
+        raise
+    except Exception as e:
+        raise FrameError(f"{codec} frame does not decode: {e}") from e
+    if len(out) != size:
+        raise FrameError(f"{codec} frame of {len(out)} bytes, announced {size}")
+    return out
+
+
+class FrameReader:
+    """Raw bytes of a framed upload through recv_into, as fill_buffer reads.
+
+    `head` is data already read off the socket. Never reads past the last
+    frame, so the CHECKSUM line after it stays on the socket. wire_bytes
+    counts the framed bytes consumed.
+    """
+
+    def __init__(self, conn, codec, head=b""):
+        self.conn = conn
+        self.codec = codec
+        self.wire_bytes = 0
+        self._head = bytearray(head)
+        self._out = memoryview(b"")
+
+    def _read(self, n):
+        buf = bytearray(n)
+        view = memoryview(buf)
+        got = min(n, len(self._head))
+        view[:got] = self._head[:got]
+        del self._head[:got]
+        while got < n:
+            k = self.conn.recv_into(view[got:])
+            if not k:
+                return None
+            got += k
+        self.wire_bytes += n
+        return buf
+
+    def recv_into(self, view):
+        if not self._out:
+            header = self._read(HEADER_SIZE)
+            if header is None:
+                return 0
+            kind, size, length = parse_header(header)
+            payload = self._read(length)
+            if payload is None:
+                return 0
+            self._out = memoryview(decode_frame(self.codec, kind, size, payload))
+        n = min(len(view), len(self._out))
+        view[:n] = self._out[:n]
+        self._out = self._out[n:]
+        return n
+
+
+class AsyncFrameReader:
+    """FrameReader for the asyncio engine: StreamReader's read / readexactly."""
+
+    def __init__(self, reader, codec, head=b""):
+        self.reader = reader
+        self.codec = codec
+        self._head = bytes(head)
+        self._out = memoryview(b"")
+
+    async def _read(self, n):
+        part, self._head = self._head[:n], self._head[n:]
+        if len(part) == n:
+            return part
+        try:
+            return part + await self.reader.readexactly(n - len(part))
+        except asyncio.IncompleteReadError:
+            return None
+
+    async def _fill(self):
+        if self._out:
+            return True
+        header = await self._read(HEADER_SIZE)
+        if header is None:
+            return False
+        kind, size, length = parse_header(header)
+        payload = await self._read(length)
+        if payload is None:
+            return False
+        data = await asyncio.to_thread(decode_frame, self.codec, kind, size, payload)
+        self._out = memoryview(data)
+        return True
+
+    async def read(self, n):
+        if not await self._fill():
+            return b""
+        out = bytes(self._out[:n])
+        self._out = self._out[len(out) :]
+        return out
+
+    async def readexactly(self, n):
+        parts, got = [], 0
+        while got < n:
+            if not await self._fill():
+                raise asyncio.IncompleteReadError(b"".join(parts), n)
+            part = bytes(self._out[: n - got])
+            self._out = self._out[len(part) :]
+            parts.append(part)
+            got += len(part)
+        return b"".join(parts)
+
+
+class FramedFile:
+    """Read-only file object over frames stored from `start` of file f.
+
+    read / readinto / seek work in raw bytes; seek() skips whole frames by
+    their headers, so reading from an offset decodes one frame before it.
+    An index from the file's header, (frame_size, stride, entries_at,
+    count), says every frame but the last holds frame_size raw bytes and
+    gives the position of every stride-th frame in count 8-byte entries at
+    entries_at; seek() then starts at the nearest indexed frame and skips
+    fewer than `stride` headers.
+    """
+
+    def __init__(self, f, codec, start=0, index=None):
+        self.f = f
+        self.codec = codec
+        self.start = start
+        self.index = index
+        self._out = memoryview(b"")
+        f.seek(start)
+
+    def _next_frame(self):
+        header = self.f.read(HEADER_SIZE)
+        if not header:
+            return None
+        if len(header) < HEADER_SIZE:
+            raise FrameError("truncated frame header")
+        return parse_header(header)
+
+    def _decode(self, kind, size, length):
+        payload = self.f.read(length)
+        if len(payload) != length:
+            raise FrameError("truncated frame")
+        return memoryview(decode_frame(self.codec, kind, size, payload))
+
+    def seek(self, offset):
+        self.f.seek(self.start)
+        self._out = memoryview(b"")
+        skipped = 0
+        if self.index and offset > 0:
+            frame_size, stride, entries_at, count = self.index
+            entry = min(offset // frame_size // stride, count - 1)
+            if entry > 0:
+                self.f.seek(entries_at + 8 * entry)
+                at = self.f.read(8)
+                if len(at) != 8:
+                    raise FrameError("truncated frame index")
+                self.f.seek(_INDEX_ENTRY.unpack(at)[0])
+                skipped = entry * stride * frame_size
+        while frame := self._next_frame():
+            kind, size, length = frame
+            if skipped + size > offset:
+                self._out = self._decode(kind, size, length)[offset - skipped :]
+                return offset
+            self.f.seek(length, os.SEEK_CUR)
+            skipped += size
+        return skipped
+
+    def readinto(self, view):
+        if not self._out:
+            frame = self._next_frame()
+            if frame is None:
+                return 0
+            self._out = self._decode(*frame)
+        n = min(len(view), len(self._out))
+        view[:n] = self._out[:n]
+        self._out = self._out[n:]
+        return n
+
+    def read(self, n):
+        buf = bytearray(n)
+        return bytes(buf[: self.readinto(memoryview(buf))])
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
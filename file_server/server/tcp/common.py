@@ -0,0 +1,80 @@
+import os, ssl
+
+from utils.blobstore import STORAGE_DIR
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+HOST = os.getenv("TCP_HOST", "0.0.0.0")
+PORT = int(os.getenv("TCP_PORT", "8000"))
+
+CERT_PATH = os.path.join(os.path.dirname(__file__), "cert.pem")
+KEY_PATH = os.path.join(os.path.dirname(__file__), "key.pem")
+
+os.makedirs(STORAGE_DIR, exist_ok=True)
+
+HEARTBEAT_TIMEOUT = 12
+# a client that has not finished its TLS handshake by then is dropped
+TLS_HANDSHAKE_TIMEOUT = float(os.getenv("TLS_HANDSHAKE_TIMEOUT", "10"))
+# listen() queue for connections not yet accepted; the kernel caps it at
+# net.core.somaxconn
+TCP_BACKLOG = int(os.getenv("TCP_BACKLOG", "1024"))
+# upload receive buffer; each recv_into/write/hash round moves up to this much
+UPLOAD_BUFFER_SIZE = int(os.getenv("UPLOAD_BUFFER_SIZE", str(1024 * 1024)))
+# download send block; SSLSocket.sendfile falls back to 8 KB send() calls,
+# 0 keeps that path (for comparison in bench/bench_download.py)
+DOWNLOAD_BLOCK_SIZE = int(os.getenv("DOWNLOAD_BLOCK_SIZE", str(1024 * 1024)))
+# how long a client gets to answer DOWNLOAD_RESUME with its offset
+RESUME_REPLY_TIMEOUT = float(os.getenv("RESUME_REPLY_TIMEOUT", "10"))
+# seconds between fallback DB polls for actions the dispatcher did not push
+ACTION_POLL_INTERVAL = float(os.getenv("ACTION_POLL_INTERVAL", "30"))
+
+
+def create_ssl_context():
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(CERT_PATH, KEY_PATH)
+    return context
+
+
+def raise_nofile_limit():
+    """Lift the soft fd limit to the hard limit so we can hold many clients."""
+    if resource is None:
+        return None
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError):
+            pass
+    return resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+
+
+def get_unique_filename(folder, filename, taken=None):
+    """filename, or "name (n).ext" if on disk in folder or taken(name)."""
+    base, ext = os.path.splitext(filename)
+    counter = 1
+    new = filename
+    while os.path.exists(os.path.join(folder, new)) or (taken and taken(new)):
+        new = f"{base} ({counter}){ext}"
+        counter += 1
+    return new
+
+
+def parse_ping(data):
+    """Return the echo token of a PING line ("PING <token>"), or None."""
+    first = data.split("\n", 1)[0].strip()
+    parts = first.split(" ", 1)
+    return parts[1].strip() if len(parts) == 2 and parts[1].strip() else None
+
+
+def parse_download_offset(reply, file_size):
+    """Offset from an "OFFSET <n>" reply, or None (cancel, old client)."""
+    for line in reply.splitlines():
+        parts = line.split()
+        if len(parts) == 2 and parts[0] == "OFFSET" and parts[1].isdigit():
+            return min(int(parts[1]), file_size)
+    return None
@@ -0,0 +1,65 @@
+import socket, threading
+
+from utils.tcp_control import CONTROL_HOST, CONTROL_PORT, control_key, seal, unseal
+from tcp.dispatcher import dispatcher
+from tcp.progress import progress
+
+_handlers = {}
+
+
+def register_handler(message_type, handler):
+    """handler(message) -> dict | None; a dict is sent back to the sender."""
+    _handlers[message_type] = handler
+
+
+def _on_action(message):
+    client_id = message.get("client_id")
+    if client_id:
+        dispatcher.notify(client_id)
+
+
+def _on_progress(message):
+    live = progress.snapshot()
+    return {"files": {str(file_id): received for file_id, received in live.items()}}
+
+
+register_handler("action", _on_action)
+register_handler("progress", _on_progress)
+
+
+def _serve(sock):
+    while True:
+        try:
+            raw, addr = sock.recvfrom(65535)
+        except OSError:
+            continue
+        message = unseal(raw)
+        if message is None:
+            # unsigned, signed with another key or too old
+            continue
+
+        handler = _handlers.get(message.get("type"))
+        if not handler:
+            continue
+        try:
+            reply = handler(message)
+            if reply is not None:
+                sock.sendto(seal(reply), addr)
+        except Exception as e:
+            print(f"[CONTROL] {message.get('type')} failed: {e}")
+
+
+def start_control_listener(host=CONTROL_HOST, port=CONTROL_PORT):
+    """Local UDP channel the Flask API uses to poke the TCP server."""
+    # make sure the shared key exists before the API first needs it
+    control_key()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.bind((host, port))
+    except OSError as e:
+        print(f"[CONTROL] cannot bind {host}:{port} ({e}), push dispatch disabled")
+        sock.close()
+        return None
+    threading.Thread(target=_serve, args=(sock,), daemon=True).start()
+    print(f"[CONTROL] Listening on {host}:{port}/udp")
+    return sock
@@ -0,0 +1,38 @@
+import threading
+
+
+class ActionDispatcher:
+    """Wakes the connection that owns a client id when an action is queued.
+
+    Engines register a zero-argument ``wake`` callback per connection; it
+    must be safe to call from any thread (the control listener calls it).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiters = {}
+
+    def register(self, client_id, wake):
+        with self._lock:
+            self._waiters.setdefault(client_id, []).append(wake)
+
+    def unregister(self, client_id, wake):
+        with self._lock:
+            waiters = self._waiters.get(client_id, [])
+            if wake in waiters:
+                waiters.remove(wake)
+            if not waiters:
+                self._waiters.pop(client_id, None)
+
+    def notify(self, client_id):
+        with self._lock:
+            waiters = list(self._waiters.get(client_id, []))
+        for wake in waiters:
+            try:
+                wake()
+            except Exception as e:
+                print(f"[DISPATCH] wake failed for {client_id}: {e}")
+        return len(waiters)
+
+
+dispatcher = ActionDispatcher()
@@ -0,0 +1,106 @@
+import os, socket, time, threading
+
+from db.model import on_action_change
+from utils.tcp_control import CONTROL_HOST, seal
+from tcp.control import register_handler
+from tcp.progress import progress
+
+# Live event feed for the API's /clients/monitor/events stream. An API
+# process subscribes over the control channel with the UDP port it listens
+# on and renews that every few seconds; the TCP server pushes action state
+# changes as they happen and the byte counts of running transfers every
+# EVENT_INTERVAL, all from memory.
+EVENT_INTERVAL = float(os.getenv("EVENT_INTERVAL", "0.5"))
+SUBSCRIPTION_TTL = 10.0
+# entries per progress datagram, to stay well inside the UDP size limit
+EVENT_BATCH = 200
+
+
+class LiveFeed:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}  # port -> expiry
+        self._downloads = {}  # action_id -> progress entry
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._last = None
+
+    def subscribe(self, message):
+        port = int(message.get("port", 0))
+        if port:
+            with self._lock:
+                self._subscribers[port] = time.monotonic() + SUBSCRIPTION_TTL
+
+    def publish(self, event):
+        now = time.monotonic()
+        with self._lock:
+            for port, expiry in list(self._subscribers.items()):
+                if expiry < now:
+                    del self._subscribers[port]
+            ports = list(self._subscribers)
+        if not ports:
+            return
+        raw = seal(event)
+        for port in ports:
+            try:
+                self._sock.sendto(raw, (CONTROL_HOST, port))
+            except OSError:
+                pass
+
+    def action_changed(self, action):
+        self.publish({"type": "action", **action})
+
+    def download(self, action, sent, size):
+        """Bytes of a download sent so far; cheap enough for every block."""
+        self._downloads[action["action_id"]] = {
+            "action_id": action["action_id"],
+            "client_id": action["client_id"],
+            "file_id": action["file_id"],
+            "sent": sent,
+            "size": size,
+        }
+
+    def download_end(self, action_id):
+        self._downloads.pop(action_id, None)
+
+    def progress_events(self):
+        uploads = [
+            {"file_id": file_id, "client_id": client_id, "received": received}
+            for file_id, (client_id, received) in progress.snapshot_owned().items()
+        ]
+        downloads = list(self._downloads.values())
+        events = []
+        for i in range(0, max(len(uploads), len(downloads), 1), EVENT_BATCH):
+            events.append(
+                {
+                    "type": "progress",
+                    "uploads": uploads[i : i + EVENT_BATCH],
+                    "downloads": downloads[i : i + EVENT_BATCH],
+                }
+            )
+        return events
+
+    def _tick(self):
+        while True:
+            time.sleep(EVENT_INTERVAL)
+            if not self._subscribers:
+                continue
+            try:
+                events = self.progress_events()
+                # idle and unchanged: nothing worth a datagram
+                if events == self._last and not any(
+                    e["uploads"] or e["downloads"] for e in events
+                ):
+                    continue
+                self._last = events
+                for event in events:
+                    self.publish(event)
+            except Exception as e:
+                print(f"[EVENTS] progress tick failed: {e}")
+
+    def start(self):
+        register_handler("subscribe", self.subscribe)
+        on_action_change(self.action_changed)
+        threading.Thread(target=self._tick, name="event-feed", daemon=True).start()
+
+
+feed = LiveFeed()
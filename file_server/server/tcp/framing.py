@@ -0,0 +1,444 @@
+import os, socket, struct, asyncio
+
+from tcp.common import parse_ping
+from tcp.ktls import ktls_send_active, sendfile_ktls
+
+# Protocol v2. A client that logs in with "LOGIN2 <client_id> <password>"
+# and is answered "OK AUTHORIZED V2" speaks in frames from then on, both
+# ways:
+#
+#     <type:u8> <length:u32> <payload>
+#
+# CONTROL carries what v1 sends as text (prompts, paths, size lines, PING,
+# OFFSET, cancel), DATA file bytes, ACK the end of a transfer ("Upload
+# completed!"), PROGRESS an upload's durable offset (u64) after each
+# checkpoint, and CHECKSUM "<sha256> [<tree>]" after an upload's data, or
+# the file's sha256 before a download's ACK. Message boundaries no longer
+# depend on read timing, so a client can send an upload's path, size line,
+# data and CHECKSUM in one go after the prompt, and PING between DATA
+# frames. A server without v2 answers LOGIN2 with "ERROR UNKNOWN_COMMAND";
+# the client then logs in again with LOGIN and speaks v1. The client waits
+# for the LOGIN2 reply before it sends any frame. STREAM connections of
+# parallel uploads stay v1.
+
+LOGIN_V2 = "LOGIN2"
+CONTROL, DATA, ACK, PROGRESS, CHECKSUM = 1, 2, 3, 4, 5
+_TYPES = (CONTROL, DATA, ACK, PROGRESS, CHECKSUM)
+
+_HEADER = struct.Struct(">BI")
+HEADER_SIZE = _HEADER.size
+_OFFSET = struct.Struct(">Q")
+
+# largest DATA frame; senders split bigger writes
+MAX_PAYLOAD = 16 * 1024 * 1024
+# largest frame of any other type (a NEED line of a big manifest); those
+# are read whole from the buffer
+MAX_MESSAGE = 1024 * 1024
+# receive buffer of a connection, reused for its whole life; grows once if
+# a message does not fit
+RECV_BUFFER = 64 * 1024
+
+
+class ProtocolError(OSError):
+    """A frame that breaks v2; handled like a dropped connection."""
+
+
+def frame(kind, payload=b""):
+    return b"".join((_HEADER.pack(kind, len(payload)), payload))
+
+
+def parse_header(buf, offset=0):
+    """(type, payload length) of the frame header at buf[offset:]."""
+    kind, length = _HEADER.unpack_from(buf, offset)
+    if kind not in _TYPES:
+        raise ProtocolError(f"unknown frame type {kind}")
+    if length > (MAX_PAYLOAD if kind == DATA else MAX_MESSAGE):
+        raise ProtocolError(f"frame of {length} bytes")
+    return kind, length
+
+
+def pack_progress(offset):
+    return _OFFSET.pack(offset)
+
+
+def unpack_progress(payload):
+    return _OFFSET.unpack(payload)[0]
+
+
+def _as_text(kind, payload):
+    # v1 code reads the checksum as its "CHECKSUM ..." line
+    return b"CHECKSUM " + payload if kind == CHECKSUM else payload
+
+
+def _pong(payload):
+    """The CONTROL frame answering a PING message, or None."""
+    token = parse_ping(bytes(payload).decode(errors="ignore"))
+    return frame(CONTROL, f"PONG {token}\n".encode()) if token else None
+
+
+def send_frame(conn, kind, payload):
+    """A `kind` frame on a v2 Channel; on a v1 socket the payload as is."""
+    if isinstance(conn, Channel):
+        conn.send_frame(kind, payload)
+    else:
+        conn.send(payload)
+
+
+def progress_reporter(conn):
+    """Callback sending PROGRESS frames; None on v1, which has none."""
+    return conn.send_progress if isinstance(conn, Channel) else None
+
+
+def is_cancel(message):
+    return bytes(message).strip().lower() == b"cancel"
+
+
+def client_canceled(conn):
+    """True if a v2 upload's DATA stopped at the client's "cancel" (consumed)."""
+    return isinstance(conn, Channel) and conn.take_cancel()
+
+
+def recv_head(conn, bufsize):
+    """First upload bytes after OFFSET, or b"cancel" if the client gave up.
+
+    On v2 upload bytes come from DATA frames only; a PING ahead of them is
+    answered, not taken for file data.
+    """
+    if not isinstance(conn, Channel):
+        return conn.recv(bufsize)
+    if bufsize <= 0:
+        return b""
+    buf = bytearray(bufsize)
+    n = conn.recv_into(memoryview(buf))
+    if n:
+        return bytes(buf[:n])
+    return b"cancel" if conn.take_cancel() else b""
+
+
+class Channel:
+    """The socket calls of the thread engine over a v2 connection.
+
+    send() sends a CONTROL frame and sendall() DATA. recv() hands out one
+    frame at a time whatever its type (a message whole, DATA as far as it
+    is there); recv_into() takes DATA only and returns 0 at any other
+    frame, which stays for the next recv(). A PING between DATA frames is
+    answered right away. Frames are parsed out of one reusable buffer; a
+    DATA payload is read straight into the caller's buffer when nothing is
+    buffered. Clients read whole frames with read_frame().
+    """
+
+    def __init__(self, sock, buffer_size=RECV_BUFFER):
+        self.sock = sock
+        # frames go out whole; Nagle would only hold a reply back until the
+        # peer's delayed ACK (asyncio sets this on its own transports)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._buf = bytearray(max(buffer_size, HEADER_SIZE))
+        self._view = memoryview(self._buf)
+        self._start = self._end = 0
+        # type and unread payload bytes of the frame being read
+        self._kind = None
+        self._left = 0
+
+    def settimeout(self, timeout):
+        self.sock.settimeout(timeout)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def getsockopt(self, *args):
+        return self.sock.getsockopt(*args)
+
+    def pending(self):
+        return self._end > self._start or self.sock.pending()
+
+    def close(self):
+        self.sock.close()
+
+    # ---------- sending ----------
+    def send_frame(self, kind, payload=b""):
+        self.sock.sendall(frame(kind, payload))
+
+    def send(self, data):
+        self.send_frame(CONTROL, data)
+        return len(data)
+
+    def sendall(self, data):
+        view = memoryview(data)
+        for start in range(0, len(view), MAX_PAYLOAD):
+            part = view[start : start + MAX_PAYLOAD]
+            if len(part) <= MAX_MESSAGE:
+                self.sock.sendall(frame(DATA, part))
+            else:
+                # no copy of a large block just to put 5 bytes in front
+                self.sock.sendall(_HEADER.pack(DATA, len(part)))
+                self.sock.sendall(part)
+
+    def sendfile(self, file, offset=None, count=None):
+        """File bytes as DATA frames; zero-copy when the kernel does TLS.
+
+        Starts at the file's position when offset is None, like the
+        socket.sendfile it stands in for.
+        """
+        if offset is None:
+            offset = file.tell()
+        if count is None:
+            count = os.fstat(file.fileno()).st_size - offset
+        zero_copy = ktls_send_active(self.sock)
+        sent = 0
+        while sent < count:
+            n = min(MAX_PAYLOAD, count - sent)
+            self.sock.sendall(_HEADER.pack(DATA, n))
+            if zero_copy:
+                done = sendfile_ktls(self.sock, file, offset + sent, n)
+            else:
+                done = self.sock.sendfile(file, offset + sent, n)
+            if done < n:
+                raise ProtocolError("file ended inside a DATA frame")
+            sent += n
+        return sent
+
+    def send_progress(self, offset):
+        self.send_frame(PROGRESS, pack_progress(offset))
+
+    # ---------- receiving ----------
+    def _fill(self):
+        """One recv into the free end of the buffer; False at EOF."""
+        if self._start == self._end:
+            self._start = self._end = 0
+        elif self._end == len(self._buf):
+            kept = self._end - self._start
+            self._view[:kept] = self._view[self._start : self._end]
+            self._start, self._end = 0, kept
+        n = self.sock.recv_into(self._view[self._end :])
+        self._end += n
+        return n > 0
+
+    def _next(self):
+        """Type of the frame being read, starting the next one; None at EOF."""
+        while not self._left:
+            while self._end - self._start < HEADER_SIZE:
+                if not self._fill():
+                    return None
+            self._kind, self._left = parse_header(self._buf, self._start)
+            self._start += HEADER_SIZE  # empty frames are skipped
+        return self._kind
+
+    def _buffer_message(self):
+        """Wait until the current frame is all in the buffer; False at EOF."""
+        if self._left > len(self._buf):
+            kept = self._end - self._start
+            grown = bytearray(self._left)
+            grown[:kept] = self._view[self._start : self._end]
+            self._buf, self._view = grown, memoryview(grown)
+            self._start, self._end = 0, kept
+        while self._end - self._start < self._left:
+            if not self._fill():
+                return False
+        return True
+
+    def _take_message(self):
+        payload = bytes(self._view[self._start : self._start + self._left])
+        self._start += self._left
+        self._left = 0
+        return payload
+
+    def _take(self, view):
+        """Up to len(view) payload bytes of the current DATA frame.
+
+        The peer owes the rest of the frame, so past what is buffered this
+        gathers TLS records straight into view until it is full (or the
+        frame ends), in one call rather than one per 16 KB record.
+        """
+        want = min(len(view), self._left)
+        n = min(want, self._end - self._start)
+        view[:n] = self._view[self._start : self._start + n]
+        self._start += n
+        while n < want:
+            try:
+                got = self.sock.recv_into(view[n:want])
+            except OSError:
+                if n:
+                    break  # hand out what arrived; the error comes back next call
+                raise
+            if not got:
+                break
+            n += got
+        self._left -= n
+        return n
+
+    def recv(self, bufsize):
+        """Next frame for code written against v1's text; b"" at EOF."""
+        if bufsize <= 0:
+            return b""
+        kind = self._next()
+        if kind is None:
+            return b""
+        if kind == DATA:
+            buf = bytearray(min(bufsize, self._left))
+            return bytes(buf[: self._take(memoryview(buf))])
+        if not self._buffer_message():
+            return b""
+        return _as_text(kind, self._take_message())
+
+    def recv_into(self, view):
+        """DATA bytes into view; 0 at EOF or when another frame is next."""
+        while True:
+            kind = self._next()
+            if kind is None:
+                return 0
+            if kind == DATA:
+                return self._take(view)
+            if kind != CONTROL or not self._buffer_message():
+                return 0
+            message = self._view[self._start : self._start + self._left]
+            if bytes(message[:4]) != b"PING":
+                return 0
+            reply = _pong(message)
+            self._take_message()
+            if reply:
+                self.sock.sendall(reply)
+
+    def take_cancel(self):
+        """Consume a "cancel" message recv_into stopped at; True if it was one."""
+        if self._kind != CONTROL or self._end - self._start < self._left:
+            return False
+        if not self._left or not is_cancel(
+            self._view[self._start : self._start + self._left]
+        ):
+            return False
+        self._take_message()
+        return True
+
+    def read_frame(self):
+        """(type, payload) of the next whole frame; (None, b"") at EOF."""
+        kind = self._next()
+        if kind is None:
+            return None, b""
+        if kind != DATA:
+            if not self._buffer_message():
+                return None, b""
+            return kind, self._take_message()
+        buf = bytearray(self._left)
+        view = memoryview(buf)
+        got = 0
+        while got < len(buf):
+            n = self._take(view[got:])
+            if not n:
+                return None, b""
+            got += n
+        return DATA, buf
+
+
+class AsyncChannel:
+    """Channel for the asyncio engine; stands in for the StreamReader.
+
+    read() hands out frames like Channel.recv(); DATA alone comes through
+    `data`, a reader with read / readexactly. A read is safe to cancel: the
+    frame state lives here and StreamReader consumes nothing on cancel.
+    """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.data = _AsyncDataReader(self)
+        self._kind = None
+        self._left = 0
+        # a message a DATA read came across, for the next read()
+        self._held = None
+
+    def write(self, kind, payload):
+        """Queue a frame; the caller drains the writer."""
+        if kind != DATA or len(payload) <= MAX_MESSAGE:
+            self.writer.write(frame(kind, payload))
+            return
+        view = memoryview(payload)
+        for start in range(0, len(view), MAX_PAYLOAD):
+            part = view[start : start + MAX_PAYLOAD]
+            self.writer.write(_HEADER.pack(kind, len(part)))
+            self.writer.write(part)
+
+    def at_eof(self):
+        return self._held is None and not self._left and self.reader.at_eof()
+
+    async def _next(self):
+        while not self._left:
+            try:
+                header = await self.reader.readexactly(HEADER_SIZE)
+            except asyncio.IncompleteReadError:
+                return None
+            self._kind, self._left = parse_header(header)
+        return self._kind
+
+    async def _message(self):
+        try:
+            payload = await self.reader.readexactly(self._left)
+        except asyncio.IncompleteReadError:
+            return None
+        self._left = 0
+        return payload
+
+    async def _read_payload(self, n):
+        part = await self.reader.read(min(n, self._left))
+        self._left -= len(part)
+        return part
+
+    async def read(self, n):
+        """Same contract as Channel.recv."""
+        if self._held is not None:
+            payload, self._held = self._held, None
+            return payload
+        if n <= 0:
+            return b""
+        kind = await self._next()
+        if kind is None:
+            return b""
+        if kind == DATA:
+            return await self._read_payload(n)
+        payload = await self._message()
+        return b"" if payload is None else _as_text(kind, payload)
+
+    async def read_data(self, n):
+        """Same contract as Channel.recv_into; b"" in place of 0."""
+        while self._held is None:
+            kind = await self._next()
+            if kind is None:
+                return b""
+            if kind == DATA:
+                return await self._read_payload(n)
+            payload = await self._message()
+            if payload is None:
+                return b""
+            if kind != CONTROL or not payload.startswith(b"PING"):
+                self._held = _as_text(kind, payload)
+                break
+            reply = _pong(payload)
+            if reply:
+                self.writer.write(reply)
+        return b""
+
+    def take_cancel(self):
+        """Consume a "cancel" message read_data stopped at; True if it was one."""
+        if self._held is None or not is_cancel(self._held):
+            return False
+        self._held = None
+        return True
+
+
+class _AsyncDataReader:
+    """The DATA frames of an AsyncChannel as a StreamReader-like stream."""
+
+    def __init__(self, channel):
+        self.channel = channel
+
+    async def read(self, n):
+        return await self.channel.read_data(n)
+
+    async def readexactly(self, n):
+        parts, got = [], 0
+        while got < n:
+            part = await self.channel.read_data(n - got)
+            if not part:
+                raise asyncio.IncompleteReadError(b"".join(parts), n)
+            parts.append(part)
+            got += len(part)
+        return b"".join(parts)
@@ -0,0 +1,161 @@
+import os, hashlib, threading
+
+# Uploads are hashed in fixed segments as well as end to end. Segment
+# digests are checkpointed with files.received, so a resumed upload only
+# rehashes the unfinished tail segment instead of the whole partial file.
+SEGMENT_SIZE = int(os.getenv("HASH_SEGMENT_SIZE", str(64 * 1024 * 1024)))
+
+
+def tree_digest(segment_digests):
+    """sha256 over the raw segment digests, in order (hex in, hex out)."""
+    h = hashlib.sha256()
+    for d in segment_digests:
+        h.update(bytes.fromhex(d))
+    return h.hexdigest()
+
+
+def tree_hash_file(path, segment_size=SEGMENT_SIZE):
+    """Reference implementation of the client-side TREE value."""
+    digests = []
+    with open(path, "rb") as f:
+        while True:
+            seg = hashlib.sha256()
+            left = segment_size
+            while left:
+                block = f.read(min(left, 1024 * 1024))
+                if not block:
+                    break
+                seg.update(block)
+                left -= len(block)
+            if left == segment_size:
+                break
+            digests.append(seg.hexdigest())
+            if left:
+                break
+    return tree_digest(digests)
+
+
+class UploadHasher:
+    """Full-file sha256 plus per-segment digests for one upload.
+
+    ``full`` is None when the upload was resumed from a checkpoint after a
+    restart (hashlib state cannot be serialised); the upload is then
+    verified through the segment tree instead.
+    """
+
+    def __init__(self, position=0, segments=None, full=None, segment_size=SEGMENT_SIZE):
+        self.segment_size = segment_size
+        self.position = position
+        self.segments = list(segments or [])
+        self.full = full
+        self.current = hashlib.sha256()
+        self.unsaved = []  # (index, digest) not yet checkpointed
+
+    @classmethod
+    def fresh(cls):
+        return cls(full=hashlib.sha256())
+
+    def update(self, data):
+        view = memoryview(data)
+        if self.full is not None:
+            self.full.update(view)
+        while len(view):
+            room = self.segment_size - self.position % self.segment_size
+            part = view[:room]
+            self.current.update(part)
+            self.position += len(part)
+            view = view[len(part) :]
+            if self.position % self.segment_size == 0:
+                self._close_segment()
+
+    def _close_segment(self):
+        digest = self.current.hexdigest()
+        self.unsaved.append((len(self.segments), digest))
+        self.segments.append(digest)
+        self.current = hashlib.sha256()
+
+    def take_unsaved(self):
+        unsaved, self.unsaved = self.unsaved, []
+        return unsaved
+
+    def restore_unsaved(self, unsaved):
+        self.unsaved = unsaved + self.unsaved
+
+    def hexdigest(self):
+        return self.full.hexdigest() if self.full is not None else None
+
+    def tree_hexdigest(self):
+        digests = list(self.segments)
+        if self.position % self.segment_size:
+            digests.append(self.current.hexdigest())
+        return tree_digest(digests)
+
+
+def verify_upload(ck_line, hasher, save_path):
+    """Check "CHECKSUM <sha256> [<tree>]"; returns the file's sha256 or None.
+
+    The tree value lets an upload resumed after a server restart (no full
+    hash state left) be verified from its checkpointed segment digests.
+    """
+    parts = ck_line.split()
+    client_ck = parts[1] if len(parts) > 1 else ""
+    client_tree = parts[2] if len(parts) > 2 else ""
+
+    server_ck = hasher.hexdigest()
+    if server_ck is not None:
+        return server_ck if client_ck == server_ck else None
+    if client_tree:
+        return client_ck if client_tree == hasher.tree_hexdigest() else None
+
+    # old client after a restart: only a full pass can check its sha256
+    h = hashlib.sha256()
+    with open(save_path, "rb") as f:
+        while True:
+            b = f.read(1024 * 1024)
+            if not b:
+                break
+            h.update(b)
+    return client_ck if client_ck == h.hexdigest() else None
+
+
+# Hashers of interrupted uploads, so a reconnect served by the same process
+# resumes with the exact full-file state and no rehash at all.
+_suspended = {}
+_suspended_lock = threading.Lock()
+MAX_SUSPENDED = 10000
+
+
+def suspend(file_id, hasher):
+    with _suspended_lock:
+        _suspended[file_id] = hasher
+        while len(_suspended) > MAX_SUSPENDED:
+            # oldest first; those fall back to the on-disk checkpoint
+            _suspended.pop(next(iter(_suspended)))
+
+
+def discard(file_id):
+    with _suspended_lock:
+        _suspended.pop(file_id, None)
+
+
+def resume_hasher(file_id, path, received, saved_segments):
+    """Hasher positioned at `received`, reading at most one segment from disk."""
+    with _suspended_lock:
+        hasher = _suspended.pop(file_id, None)
+    if hasher is not None and hasher.position == received:
+        return hasher
+
+    complete = min(len(saved_segments), received // SEGMENT_SIZE)
+    start = complete * SEGMENT_SIZE
+    hasher = UploadHasher(position=start, segments=saved_segments[:complete])
+    if received > start:
+        with open(path, "rb") as f:
+            f.seek(start)
+            left = received - start
+            while left:
+                block = f.read(min(left, 1024 * 1024))
+                if not block:
+                    raise IOError(f"partial file shorter than {received} bytes")
+                hasher.update(block)
+                left -= len(block)
+    return hasher
@@ -0,0 +1,107 @@
+import ssl, socket, sys, threading
+
+# Kernel TLS: OpenSSL 3 can hand the record layer to the kernel after the
+# handshake. Encryption then happens in the kernel (or the NIC), and with
+# TX offload a download can go out with a true zero-copy sendfile().
+# Needs Linux with the "tls" module and an OpenSSL built with enable-ktls;
+# anything else falls back to the usual userspace TLS.
+OP_ENABLE_KTLS = getattr(
+    ssl, "OP_ENABLE_KTLS", 1 << 3 if ssl.OPENSSL_VERSION_INFO >= (3, 0) else 0
+)
+SOL_TLS = getattr(socket, "SOL_TLS", 282)
+TLS_TX = 1
+TLS_RX = 2
+
+
+def _has_crypto(sock, direction):
+    try:
+        sock.getsockopt(SOL_TLS, direction, 4)
+        return True
+    except OSError:
+        return False
+
+
+def ktls_send_active(sock):
+    """True when the kernel encrypts what this socket sends."""
+    return _has_crypto(sock, TLS_TX)
+
+
+def _probe(context):
+    """Handshake with ourselves over loopback; (tx, rx) offload in effect."""
+    result = {}
+    with socket.socket() as srv:
+        srv.bind(("127.0.0.1", 0))
+        srv.listen(1)
+        srv.settimeout(5)
+
+        def serve():
+            try:
+                conn, _ = srv.accept()
+                with context.wrap_socket(conn, server_side=True) as s:
+                    result["tx"] = _has_crypto(s, TLS_TX)
+                    result["rx"] = _has_crypto(s, TLS_RX)
+                    s.recv(1)
+            except (OSError, ssl.SSLError) as e:
+                result["error"] = e
+
+        t = threading.Thread(target=serve, daemon=True)
+        t.start()
+        client_ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        client_ctx.check_hostname = False
+        client_ctx.verify_mode = ssl.CERT_NONE
+        try:
+            with socket.create_connection(srv.getsockname(), timeout=5) as raw:
+                with client_ctx.wrap_socket(raw) as c:
+                    c.sendall(b"\0")
+                    t.join(5)
+        except (OSError, ssl.SSLError) as e:
+            result.setdefault("error", e)
+    if "error" in result:
+        raise result["error"]
+    return result.get("tx", False), result.get("rx", False)
+
+
+def enable_ktls(context):
+    """Turn kTLS on for the context if it works here; returns a log line.
+
+    The option is left off when the probe shows no offload, so a host that
+    cannot do kTLS behaves exactly as before.
+    """
+    if not sys.platform.startswith("linux"):
+        return "userspace TLS (kTLS needs Linux)"
+    if not OP_ENABLE_KTLS:
+        return f"userspace TLS (kTLS needs OpenSSL 3, have {ssl.OPENSSL_VERSION})"
+
+    context.options |= OP_ENABLE_KTLS
+    try:
+        tx, rx = _probe(context)
+    except (OSError, ssl.SSLError) as e:
+        tx = rx = False
+        print(f"[TLS] kTLS probe failed: {e}")
+    if tx or rx:
+        dirs = "+".join(d for d, on in (("tx", tx), ("rx", rx)) if on)
+        return f"kernel TLS ({dirs}){', zero-copy downloads' if tx else ''}"
+
+    context.options &= ~OP_ENABLE_KTLS
+    if not _kernel_has_tls_ulp():
+        reason = "kernel has no tls module loaded"
+    else:
+        reason = f"{ssl.OPENSSL_VERSION} not built with enable-ktls"
+    return f"userspace TLS (kTLS unavailable: {reason})"
+
+
+def _kernel_has_tls_ulp():
+    try:
+        with open("/proc/sys/net/ipv4/tcp_available_ulp") as f:
+            return "tls" in f.read().split()
+    except OSError:
+        return False
+
+
+def sendfile_ktls(sock, f, offset, count):
+    """Zero-copy send of f[offset:offset+count] on a kTLS socket.
+
+    SSLSocket.sendfile always copies through OpenSSL; the plain socket
+    implementation hands the fd to os.sendfile and the kernel encrypts.
+    """
+    return socket.socket.sendfile(sock, f, offset, count)
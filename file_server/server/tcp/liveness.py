@@ -0,0 +1,169 @@
+import os, time, heapq, threading
+
+from db.model import set_client_statuses, reset_client_statuses
+from tcp.common import HEARTBEAT_TIMEOUT
+from tcp.control import register_handler
+
+# Heartbeat bookkeeping for every logged-in client. A PING only moves the
+# client's deadline in memory; clients.status is written when a client
+# actually goes ONLINE or OFFLINE, and those writes are batched into one
+# transaction every STATUS_FLUSH_INTERVAL seconds. Deadlines sit in a heap
+# (one entry per client, pushed back lazily when a PING moved the
+# deadline), so the sweep only touches clients that are due.
+STATUS_FLUSH_INTERVAL = float(os.getenv("STATUS_FLUSH_INTERVAL", "1.0"))
+# client ids a single control query may ask about (keeps the reply in one datagram)
+LIVE_QUERY_MAX = 1000
+
+
+class LivenessTracker:
+    def __init__(self, timeout=HEARTBEAT_TIMEOUT):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._sessions = {}  # client_id -> logged-in connections
+        self._deadline = {}  # client_id -> monotonic heartbeat deadline
+        self._heap = []  # (deadline, client_id)
+        self._scheduled = set()  # clients with an entry in the heap
+        # clients busy with an action (prompt, transfer): they do not PING
+        self._held = set()
+        self._online = set()
+        self._pending = {}  # client_id -> status not written yet
+        self.beats = 0
+        self.transitions = 0
+        self.expirations = 0
+        self.writes = 0
+
+    def _set(self, cid, status):
+        if (cid in self._online) == (status == "ONLINE"):
+            return
+        if status == "ONLINE":
+            self._online.add(cid)
+        else:
+            self._online.discard(cid)
+        self._pending[cid] = status
+        self.transitions += 1
+
+    def login(self, cid):
+        deadline = time.monotonic() + self.timeout
+        with self._lock:
+            self._sessions[cid] = self._sessions.get(cid, 0) + 1
+            if cid not in self._scheduled:
+                self._scheduled.add(cid)
+                heapq.heappush(self._heap, (deadline, cid))
+            self._deadline[cid] = deadline
+            self._set(cid, "ONLINE")
+
+    def logout(self, cid):
+        with self._lock:
+            left = self._sessions.get(cid, 0) - 1
+            if left > 0:
+                self._sessions[cid] = left
+                return
+            self._sessions.pop(cid, None)
+            self._deadline.pop(cid, None)
+            self._held.discard(cid)
+            self._set(cid, "OFFLINE")
+
+    def beat(self, cid):
+        """A PING or other sign of life: push the deadline out."""
+        with self._lock:
+            if cid not in self._deadline:
+                return
+            self._deadline[cid] = time.monotonic() + self.timeout
+            self.beats += 1
+            self._set(cid, "ONLINE")
+
+    def hold(self, cid):
+        """The client is busy with an action; do not time it out meanwhile."""
+        with self._lock:
+            self._held.add(cid)
+
+    def expired(self, cid):
+        """Idle-loop check: True once the heartbeat deadline has passed.
+
+        Back in the idle loop the action is over, so a hold ends here and
+        the deadline restarts from now.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if cid in self._held:
+                self._held.discard(cid)
+                self._deadline[cid] = now + self.timeout
+                return False
+            return self._deadline.get(cid, 0) < now
+
+    def _expire(self, now):
+        while self._heap and self._heap[0][0] <= now:
+            _, cid = heapq.heappop(self._heap)
+            deadline = self._deadline.get(cid)
+            if deadline is None:
+                self._scheduled.discard(cid)  # logged out
+                continue
+            if deadline > now:
+                heapq.heappush(self._heap, (deadline, cid))
+                continue
+            if cid not in self._held and cid in self._online:
+                # the session notices on its next idle check and closes
+                self._set(cid, "OFFLINE")
+                self.expirations += 1
+            heapq.heappush(self._heap, (now + self.timeout, cid))
+
+    def flush(self):
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return
+        try:
+            set_client_statuses(batch.items())
+            with self._lock:
+                self.writes += len(batch)
+        except Exception as e:
+            print(f"[LIVENESS] status write failed: {e}")
+            with self._lock:
+                # retry next round unless the client changed state meanwhile
+                for cid, status in batch.items():
+                    self._pending.setdefault(cid, status)
+
+    def flush_all(self):
+        """Shutdown: every tracked client goes OFFLINE."""
+        with self._lock:
+            for cid in list(self._online):
+                self._set(cid, "OFFLINE")
+        self.flush()
+
+    def _run(self):
+        while True:
+            time.sleep(STATUS_FLUSH_INTERVAL)
+            with self._lock:
+                self._expire(time.monotonic())
+            self.flush()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "tracked": len(self._deadline),
+                "online": len(self._online),
+                "busy": len(self._held),
+                "beats": self.beats,
+                "transitions": self.transitions,
+                "expirations": self.expirations,
+                "status_writes": self.writes,
+                "pending_writes": len(self._pending),
+                "heartbeat_timeout": self.timeout,
+            }
+
+    def query(self, message):
+        """Control handler: counters, or which of message["clients"] are online."""
+        clients = message.get("clients")
+        if clients is None:
+            return self.stats()
+        online = self._online
+        return {"online": [c for c in clients[:LIVE_QUERY_MAX] if c in online]}
+
+    def start(self):
+        # statuses left behind by a crash: nobody is connected yet
+        reset_client_statuses()
+        register_handler("liveness", self.query)
+        threading.Thread(target=self._run, name="liveness", daemon=True).start()
+
+
+liveness = LivenessTracker()
@@ -0,0 +1,211 @@
+import os, threading
+from collections import deque
+
+from tcp.common import UPLOAD_BUFFER_SIZE
+
+# Buffers one upload may have in flight between the socket and the disk.
+# 0 turns the pipeline off: write and hash inline on the connection thread,
+# which is the default on a single core where the hand-off is pure overhead.
+PIPELINE_DEPTH = int(
+    os.getenv("UPLOAD_PIPELINE_DEPTH", "4" if (os.cpu_count() or 1) > 1 else "0")
+)
+# Threads writing and hashing for all uploads of the process together.
+PIPELINE_WORKERS = int(
+    os.getenv("UPLOAD_PIPELINE_WORKERS", str(max(2, os.cpu_count() or 1)))
+)
+# jobs a worker runs from one lane before it moves on to the next lane
+LANE_BATCH = 4
+
+
+class WorkerPool:
+    """Process-wide threads that run the lanes of every upload pipeline.
+
+    Threads start on first use and live as long as the process, so an
+    upload costs no thread start-up and the number of threads does not grow
+    with the number of uploads.
+    """
+
+    def __init__(self, workers=PIPELINE_WORKERS):
+        self.workers = max(1, workers)
+        self._ready = deque()
+        self._cond = threading.Condition()
+        self._threads = []
+
+    def schedule(self, lane):
+        with self._cond:
+            if len(self._threads) < self.workers:
+                t = threading.Thread(
+                    target=self._work, name=f"upload-worker-{len(self._threads)}"
+                )
+                t.daemon = True
+                t.start()
+                self._threads.append(t)
+            self._ready.append(lane)
+            self._cond.notify()
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._ready:
+                    self._cond.wait()
+                lane = self._ready.popleft()
+            lane.run()
+
+
+pool = WorkerPool()
+
+
+class _Lane:
+    """One function applied to a pipeline's buffers in submit order.
+
+    A lane sits on the pool's ready queue while it has jobs and no worker
+    runs it, so it is never run by two workers at once. A worker runs at
+    most LANE_BATCH of its jobs, then puts it back at the end of the queue,
+    so an upload whose client keeps up cannot hold the workers of all.
+    """
+
+    def __init__(self, pipeline, fn):
+        self.pipeline = pipeline
+        self.fn = fn
+        self._jobs = deque()
+        self._lock = threading.Lock()
+        self._scheduled = False
+
+    def put(self, job):
+        with self._lock:
+            self._jobs.append(job)
+            if self._scheduled:
+                return
+            self._scheduled = True
+        pool.schedule(self)
+
+    def run(self):
+        for _ in range(LANE_BATCH):
+            with self._lock:
+                if not self._jobs:
+                    self._scheduled = False
+                    return
+                job = self._jobs.popleft()
+            self.pipeline._run(self.fn, job)
+        with self._lock:
+            if not self._jobs:
+                self._scheduled = False
+                return
+        # still scheduled: nobody else queues it meanwhile
+        pool.schedule(self)
+
+
+class _Job:
+    __slots__ = ("data", "buf", "pending")
+
+    def __init__(self, data, buf, pending):
+        self.data = data
+        self.buf = buf
+        self.pending = pending
+
+
+class UploadPipeline:
+    """Write and hash one upload's buffers on the shared worker pool.
+
+    The connection thread only receives: it takes a free buffer (blocking
+    once `depth` buffers are in flight, which is the backpressure), fills it
+    and submits it. A write lane and a hash lane each consume the buffers in
+    order, so the file and the digest stay sequential; a buffer is recycled
+    once both are done with it. Errors from either lane are re-raised to
+    the connection thread on the next submit or drain. With depth 0 both
+    run inline on submit and buffer() hands out the same buffer each time.
+    """
+
+    def __init__(self, f, hasher, depth=PIPELINE_DEPTH, buffer_size=UPLOAD_BUFFER_SIZE):
+        self.buffer_size = buffer_size
+        self.depth = depth
+        self.error = None
+        # bytes written and hashed so far; jobs finish in submit order
+        self.completed = 0
+        self._write = f.write
+        self._hash = hasher.update
+        self._spare = []
+        self._in_flight = 0
+        self._cond = threading.Condition()
+        self._lanes = []
+        if depth <= 0:
+            return
+        self._slots = threading.Semaphore(depth)
+        self._lanes = [_Lane(self, self._write), _Lane(self, self._hash)]
+
+    def acquire(self, blocking=True):
+        """Reserve an in-flight slot; False if none is free and not blocking."""
+        if self.depth <= 0:
+            return True
+        return self._slots.acquire(blocking)
+
+    def buffer(self):
+        """A free receive buffer; its slot is taken until it is submitted."""
+        self.acquire()
+        with self._cond:
+            if self._spare:
+                buf = self._spare.pop()
+            else:
+                buf = bytearray(self.buffer_size)
+            if self.depth <= 0:
+                # inline: the buffer is free again once submit() returns
+                self._spare.append(buf)
+            return buf
+
+    def give_back(self, buf):
+        """Return a buffer from buffer() that was not submitted."""
+        if self.depth <= 0:
+            return
+        with self._cond:
+            self._spare.append(buf)
+        self._slots.release()
+
+    def submit(self, data, buf=None):
+        """Queue data for writing and hashing; a slot must be held for it."""
+        self._check()
+        if self.depth <= 0:
+            self._write(data)
+            self._hash(data)
+            self.completed += len(data)
+            return
+        job = _Job(data, buf, len(self._lanes))
+        with self._cond:
+            self._in_flight += 1
+        for lane in self._lanes:
+            lane.put(job)
+
+    def drain(self):
+        """Block until every submitted buffer is written and hashed."""
+        with self._cond:
+            while self._in_flight:
+                self._cond.wait()
+        self._check()
+
+    def close(self):
+        """Drain; the pool's threads stay for the next upload."""
+        self.drain()
+
+    def _check(self):
+        if self.error is not None:
+            raise self.error
+
+    def _run(self, fn, job):
+        if self.error is None:
+            try:
+                fn(job.data)
+            except BaseException as e:
+                self.error = e
+        self._done(job)
+
+    def _done(self, job):
+        with self._cond:
+            job.pending -= 1
+            if job.pending:
+                return
+            if job.buf is not None:
+                self._spare.append(job.buf)
+            self.completed += len(job.data)
+            self._in_flight -= 1
+            if not self._in_flight:
+                self._cond.notify_all()
+        self._slots.release()
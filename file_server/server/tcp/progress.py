@@ -0,0 +1,108 @@
+import os, time, threading
+
+from db.model import save_upload_checkpoint
+
+FLUSH_INTERVAL = float(os.getenv("PROGRESS_FLUSH_INTERVAL", "1.0"))
+FLUSH_BYTES = int(os.getenv("PROGRESS_FLUSH_BYTES", str(16 * 1024 * 1024)))
+
+
+class ProgressTracker:
+    """Live byte counts of uploads in flight, persisted to files.received lazily.
+
+    ``advance`` is pure bookkeeping; the caller runs ``flush`` when it says a
+    flush is due (every FLUSH_INTERVAL seconds or FLUSH_BYTES bytes). A flush
+    fsyncs the partial file before writing the count (and the upload's newly
+    completed hash segments), so the persisted ``received`` never runs ahead
+    of what is durable on disk and resume stays correct after a crash.
+    An upload whose writes trail its reads (tcp/pipeline.py) passes
+    ``written``, the offset written and hashed so far; a flush persists
+    that rather than the bytes received.
+    """
+
+    def __init__(self, flush_interval=FLUSH_INTERVAL, flush_bytes=FLUSH_BYTES):
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self._lock = threading.Lock()
+        self._live = {}
+
+    def start(
+        self, file_id, fileobj, received, hasher=None, client_id=None, written=None
+    ):
+        with self._lock:
+            self._live[file_id] = {
+                "client_id": client_id,
+                "file": fileobj,
+                "hasher": hasher,
+                "written": written,
+                "received": received,
+                "persisted": received,
+                "flushed_at": time.monotonic(),
+                "lock": threading.Lock(),
+            }
+
+    def advance(self, file_id, nbytes):
+        """Count bytes received for the file; True when a flush is due."""
+        entry = self._live[file_id]
+        entry["received"] += nbytes
+        return (
+            entry["received"] - entry["persisted"] >= self.flush_bytes
+            or time.monotonic() - entry["flushed_at"] >= self.flush_interval
+        )
+
+    def flush(self, file_id):
+        entry = self._live.get(file_id)
+        if not entry:
+            return
+        with entry["lock"]:
+            written = entry["written"]
+            received = written() if written else entry["received"]
+            # fileobj None: the caller checkpoints itself (parallel uploads)
+            if received != entry["persisted"] and entry["file"] is not None:
+                f = entry["file"]
+                f.flush()
+                os.fsync(f.fileno())
+                hasher = entry["hasher"]
+                segments = hasher.take_unsaved() if hasher else []
+                try:
+                    save_upload_checkpoint(file_id, received, segments)
+                except Exception:
+                    if hasher:
+                        hasher.restore_unsaved(segments)
+                    raise
+                entry["persisted"] = received
+            entry["flushed_at"] = time.monotonic()
+
+    def stop(self, file_id, flush=True):
+        """Forget an upload; flush=True on interruption so resume sees it all."""
+        if flush:
+            self.flush(file_id)
+        with self._lock:
+            self._live.pop(file_id, None)
+
+    def received(self, file_id):
+        entry = self._live.get(file_id)
+        return entry["received"] if entry else None
+
+    def snapshot(self):
+        with self._lock:
+            return {file_id: e["received"] for file_id, e in self._live.items()}
+
+    def snapshot_owned(self):
+        """{file_id: (client_id, received)}, for the live event feed."""
+        with self._lock:
+            return {
+                file_id: (e["client_id"], e["received"])
+                for file_id, e in self._live.items()
+            }
+
+    def flush_all(self):
+        with self._lock:
+            file_ids = list(self._live)
+        for file_id in file_ids:
+            try:
+                self.flush(file_id)
+            except (OSError, ValueError) as e:
+                print(f"[PROGRESS] flush {file_id} failed: {e}")
+
+
+progress = ProgressTracker()
@@ -0,0 +1,230 @@
+import os, time, secrets, threading
+
+from db.model import plan_file_ranges, get_file_ranges, complete_file_range
+from tcp.hashing import SEGMENT_SIZE, UploadHasher
+from tcp.progress import progress
+
+# Parallel uploads: the control connection negotiates "RANGES", then the
+# client opens extra connections that start with "STREAM <file_id> <token>"
+# instead of LOGIN. The server hands each stream one range at a time.
+# A range is exactly one hash segment, so the finished range digests form
+# the same tree checksum a sequential upload is verified with.
+MAX_STREAMS = int(os.getenv("UPLOAD_MAX_STREAMS", "4"))
+# below this a single stream is as fast and far simpler
+PARALLEL_MIN_SIZE = int(os.getenv("UPLOAD_PARALLEL_MIN_SIZE", str(2 * SEGMENT_SIZE)))
+# a ranged upload with pending ranges and no stream activity for this long
+# is treated as interrupted
+STREAM_IDLE_TIMEOUT = float(os.getenv("UPLOAD_STREAM_IDLE_TIMEOUT", "30"))
+
+_uploads = {}
+_uploads_lock = threading.Lock()
+
+
+def parse_size_line(line):
+    """ "<size>" or "<size> STREAMS <n>" -> (size, streams wanted).
+
+    Other "<KEY> <value>" offers may follow (CHUNKS, see tcp/chunks.py;
+    COMPRESS, see tcp/codecs.py).
+    """
+    parts = line.split()
+    size = int(parts[0])
+    streams = 1
+    for key, value in zip(parts[1::2], parts[2::2]):
+        if key == "STREAMS":
+            streams = max(1, int(value))
+    return size, streams
+
+
+def wants_ranges(size, streams):
+    return (
+        hasattr(os, "pwrite")
+        and MAX_STREAMS > 1
+        and streams > 1
+        and size >= PARALLEL_MIN_SIZE
+    )
+
+
+def pwrite_all(fd, data, offset):
+    view = memoryview(data)
+    while len(view):
+        n = os.pwrite(fd, view, offset)
+        view = view[n:]
+        offset += n
+
+
+class RangedUpload:
+    """Shared state of one parallel upload: range queue, digests, liveness."""
+
+    def __init__(self, file_id, path, size, ranges):
+        self.file_id = file_id
+        self.path = path
+        self.size = size
+        self.token = secrets.token_hex(16)
+        self.ranges = {r["range_index"]: r for r in ranges}
+        self.digests = {r["range_index"]: r["digest"] for r in ranges if r["digest"]}
+        self.pending = sorted(i for i in self.ranges if i not in self.digests)
+        self.streams = 0
+        self.closed = False
+        self.last_activity = time.monotonic()
+        self.cond = threading.Condition()
+        self.fd = os.open(path, os.O_RDWR)
+        # manifest of a chunked upload handed over to ranges (tcp/chunks.py);
+        # not kept across a resume, so a resumed upload is not chunk-indexed
+        self.manifest = None
+
+    @property
+    def done_bytes(self):
+        return sum(self.ranges[i]["length"] for i in self.digests)
+
+    def header(self, streams):
+        return (
+            f"RANGES {self.file_id} {self.token} {SEGMENT_SIZE} "
+            f"{min(streams, MAX_STREAMS)}\n"
+        )
+
+    def attach(self):
+        with self.cond:
+            if self.closed:
+                return False
+            self.streams += 1
+            self.last_activity = time.monotonic()
+            return True
+
+    def detach(self):
+        with self.cond:
+            self.streams -= 1
+            self.last_activity = time.monotonic()
+            self.cond.notify_all()
+            self._close_fd()
+
+    def _close_fd(self):
+        # the fd lives until the last stream is gone, so a late pwrite can
+        # never land in a file that reused the descriptor number
+        if self.closed and self.streams == 0 and self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def claim(self):
+        """Next range for a stream as (index, start, length), or None.
+
+        While other streams still have ranges in flight this waits, so a
+        range released by a dying stream is picked up by a live one.
+        """
+        with self.cond:
+            while not self.closed and not self.pending and not self.finished:
+                self.cond.wait(1.0)
+            if self.closed or not self.pending:
+                return None
+            index = self.pending.pop(0)
+            r = self.ranges[index]
+            return index, r["start"], r["length"]
+
+    def release(self, index):
+        """A stream died mid-range: hand the range to someone else."""
+        with self.cond:
+            if index not in self.digests:
+                self.pending.insert(0, index)
+                self.pending.sort()
+            self.cond.notify_all()
+
+    def write(self, data, offset):
+        """pwrite a block of a range; False once the upload is closed.
+
+        close() stops the upload's progress entry after marking it closed,
+        so checking under the condition keeps a late block from counting.
+        """
+        pwrite_all(self.fd, data, offset)
+        with self.cond:
+            if self.closed:
+                return False
+            self.last_activity = time.monotonic()
+            progress.advance(self.file_id, len(data))
+            return True
+
+    def complete(self, index, digest):
+        """Make the range durable, then record it (the resume checkpoint)."""
+        os.fsync(self.fd)
+        complete_file_range(self.file_id, index, digest)
+        with self.cond:
+            self.digests[index] = digest
+            self.last_activity = time.monotonic()
+            self.cond.notify_all()
+
+    @property
+    def finished(self):
+        return len(self.digests) == len(self.ranges)
+
+    def stalled(self):
+        return (
+            self.streams == 0
+            and time.monotonic() - self.last_activity > STREAM_IDLE_TIMEOUT
+        )
+
+    def wait(self, timeout):
+        """Wait for a state change; True once every range is done."""
+        with self.cond:
+            if not self.finished:
+                self.cond.wait(timeout)
+            return self.finished
+
+    def hasher(self):
+        """UploadHasher carrying the range digests, for verify_upload."""
+        digests = [self.digests[i] for i in sorted(self.ranges)]
+        return UploadHasher(position=len(digests) * SEGMENT_SIZE, segments=digests)
+
+    def close(self):
+        with _uploads_lock:
+            if _uploads.get(self.file_id) is self:
+                del _uploads[self.file_id]
+        with self.cond:
+            if self.closed:
+                return
+            self.closed = True
+            self.cond.notify_all()
+            self._close_fd()
+        progress.stop(self.file_id, flush=False)
+
+
+def open_ranged_upload(file_id, path, size, resume=False, client_id=None):
+    """Register a parallel upload, planning its ranges unless resuming.
+
+    Resuming reuses the finished ranges recorded in file_ranges; only the
+    missing ones are handed out again.
+    """
+    with _uploads_lock:
+        old = _uploads.get(file_id)
+    if old:
+        old.close()
+
+    ranges = get_file_ranges(file_id) if resume else []
+    if not ranges or not os.path.exists(path):
+        open(path, "wb").close()
+        plan_file_ranges(file_id, size, SEGMENT_SIZE)
+        ranges = get_file_ranges(file_id)
+    preallocate(path, size)
+
+    upload = RangedUpload(file_id, path, size, ranges)
+    progress.start(file_id, None, upload.done_bytes, client_id=client_id)
+    with _uploads_lock:
+        _uploads[file_id] = upload
+    return upload
+
+
+def find_ranged_upload(file_id, token):
+    with _uploads_lock:
+        upload = _uploads.get(file_id)
+    if upload and secrets.compare_digest(upload.token, token):
+        return upload
+    return None
+
+
+def preallocate(path, size):
+    with open(path, "r+b") as f:
+        if hasattr(os, "posix_fallocate"):
+            try:
+                os.posix_fallocate(f.fileno(), 0, size)
+                return
+            except OSError:
+                pass  # e.g. unsupported on this filesystem
+        if os.fstat(f.fileno()).st_size < size:
+            f.truncate(size)
@@ -1,4 +1,4 @@
-import socket, ssl, threading, os, sys, time, hashlib
+import socket, ssl, select, threading, os, sys, time, hashlib, argparse, atexit, signal
 
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 sys.path.insert(0, BASE_DIR)
@@ -10,39 +10,92 @@ from db.model import (
     get_pending_actions_by_client,
     get_action_by_file,
     set_action_status,
-    update_client_status,
     get_file,
-    update_file_received,
-    finish_file_upload,
+    filename_taken,
     get_interrupted_action,
     attach_file_to_action,
+    get_file_segments,
+    get_file_ranges,
+    update_action_progress,
 )
 
-from utils.hash import verify_password
-
-HOST = "0.0.0.0"
-PORT = 8000
-
-CERT_PATH = os.path.join(os.path.dirname(__file__), "cert.pem")
-KEY_PATH = os.path.join(os.path.dirname(__file__), "key.pem")
-
-context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
-context.load_cert_chain(CERT_PATH, KEY_PATH)
-
-STORAGE_DIR = os.path.join(BASE_DIR, "storage")
-os.makedirs(STORAGE_DIR, exist_ok=True)
-
-last_seen = {}
-
-
-def get_unique_filename(folder, filename):
-    base, ext = os.path.splitext(filename)
-    counter = 1
-    new = filename
-    while os.path.exists(os.path.join(folder, new)):
-        new = f"{base} ({counter}){ext}"
-        counter += 1
-    return new
+from db.database import init_db
+from utils.hash import verify_password_cached, keep_credentials, auth_cache_stats
+from tcp.common import (
+    HOST,
+    PORT,
+    STORAGE_DIR,
+    ACTION_POLL_INTERVAL,
+    UPLOAD_BUFFER_SIZE,
+    DOWNLOAD_BLOCK_SIZE,
+    RESUME_REPLY_TIMEOUT,
+    TLS_HANDSHAKE_TIMEOUT,
+    TCP_BACKLOG,
+    raise_nofile_limit,
+    get_unique_filename,
+    parse_ping,
+    parse_download_offset,
+)
+from tcp.dispatcher import dispatcher
+from tcp.control import start_control_listener, register_handler
+from tcp.events import feed
+from tcp.progress import progress, FLUSH_INTERVAL, FLUSH_BYTES
+from tcp.pipeline import UploadPipeline
+from utils.blobstore import (
+    open_stored,
+    content_size,
+    staging_path,
+    promote,
+    maintain_store,
+)
+from tcp.tls import sessions
+from tcp.accept import accepts
+from tcp.liveness import liveness
+from tcp.ktls import enable_ktls, ktls_send_active, sendfile_ktls
+from tcp.ranges import (
+    MAX_STREAMS,
+    STREAM_IDLE_TIMEOUT,
+    parse_size_line,
+    wants_ranges,
+    open_ranged_upload,
+    find_ranged_upload,
+)
+from tcp.chunks import (
+    CHUNK_MAX_SIZE,
+    MANIFEST_TIMEOUT,
+    ChunkedUpload,
+    CheckedManifest,
+    manifest_count,
+    wants_chunks,
+    parse_manifest,
+    prefer_ranges,
+)
+from tcp.codecs import (
+    FrameEncoder,
+    FrameReader,
+    FramedFile,
+    FRAME_SIZE,
+    HEADER_SIZE,
+    parse_offer,
+    choose_codec,
+    codec_line,
+)
+from tcp.framing import (
+    LOGIN_V2,
+    ACK,
+    CHECKSUM,
+    Channel,
+    send_frame,
+    progress_reporter,
+    client_canceled,
+    recv_head,
+)
+from tcp.hashing import (
+    UploadHasher,
+    resume_hasher,
+    suspend as suspend_hasher,
+    verify_upload,
+)
 
 
 def recv_text(sock, timeout=None):
@@ -58,9 +111,562 @@ def recv_text(sock, timeout=None):
         return ""
 
 
+def recv_idle(sock, timeout=1.0):
+    """Like recv_text, but None means EOF or a dropped connection."""
+    sock.settimeout(timeout)
+    try:
+        data = sock.recv(4096)
+    except socket.timeout:
+        return ""
+    except (ssl.SSLError, OSError):
+        return None
+    if not data:
+        return None
+    return data.decode(errors="ignore").strip()
+
+
+def make_waker(wake_w):
+    def wake():
+        try:
+            wake_w.send(b"\0")
+        except (BlockingIOError, OSError):
+            pass  # already has a pending wake-up, or the connection is gone
+
+    return wake
+
+
+def make_poller(conn, wake_r):
+    """poll() rather than select(): with thousands of clients fds pass 1024."""
+    if not hasattr(select, "poll"):
+        return lambda timeout: select.select([conn, wake_r], [], [], timeout)[0]
+    poller = select.poll()
+    poller.register(conn, select.POLLIN)
+    poller.register(wake_r, select.POLLIN)
+    fds = {conn.fileno(): conn, wake_r.fileno(): wake_r}
+    return lambda timeout: [fds[fd] for fd, _ in poller.poll(timeout * 1000)]
+
+
+def wait_readable(conn, wake_r, poll, timeout):
+    """Wait for client data or a dispatcher wake-up. Returns (readable, woken)."""
+    if conn.pending():
+        return True, False
+    r = poll(timeout)
+    woken = wake_r in r
+    if woken:
+        try:
+            while wake_r.recv(64):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+    return conn in r, woken
+
+
+def upload_canceled(file_id):
+    action = get_action_by_file(file_id)
+    return bool(action and action["status"] == "CANCELED")
+
+
+def fill_buffer(conn, view, want):
+    """recv_into until view[:want] is full; returns bytes read (short on EOF).
+
+    TLS hands back at most one record (16 KB) per call, so we gather several
+    before touching the disk and the hash.
+    """
+    got = 0
+    while got < want:
+        try:
+            n = conn.recv_into(view[got:want])
+        except OSError:
+            n = 0
+        if not n:
+            break
+        got += n
+    return got
+
+
+def pump_upload(
+    conn, pipeline, file_id, received_now, file_size, head, on_checkpoint=None
+):
+    """Receive into pipeline buffers; the workers write and hash behind us."""
+    if head:
+        pipeline.acquire()
+        pipeline.submit(head)
+        received_now += len(head)
+        progress.advance(file_id, len(head))
+
+    while received_now < file_size:
+        want = min(pipeline.buffer_size, file_size - received_now)
+        buf = pipeline.buffer()
+        n = fill_buffer(conn, memoryview(buf), want)
+        if n:
+            pipeline.submit(memoryview(buf)[:n], buf)
+            received_now += n
+            due = progress.advance(file_id, n)
+        else:
+            pipeline.give_back(buf)
+        if n < want:
+            return "INTERRUPTED"
+
+        if due:
+            # a checkpoint must only cover bytes that are written and hashed
+            pipeline.drain()
+            progress.flush(file_id)
+            if on_checkpoint:
+                on_checkpoint(received_now)
+            if upload_canceled(file_id):
+                return "CANCELED"
+    return "DONE"
+
+
+def receive_upload(
+    conn,
+    f,
+    hasher,
+    file_id,
+    received_now,
+    file_size,
+    head=b"",
+    client_id=None,
+    on_checkpoint=None,
+):
+    """Stream the rest of an upload into f and hasher.
+
+    `head` holds upload bytes the caller already read off the socket.
+    Returns "DONE", "CANCELED" (by the UI) or "INTERRUPTED" (connection lost).
+    Progress goes through the in-memory tracker and is persisted in batches;
+    the UI cancel flag is checked at the same cadence. on_checkpoint gets
+    the offset persisted at each batch.
+    """
+    pipeline = UploadPipeline(f, hasher)
+    progress.start(
+        file_id,
+        f,
+        received_now,
+        hasher,
+        client_id,
+        written=lambda: received_now + pipeline.completed,
+    )
+    try:
+        state = pump_upload(
+            conn, pipeline, file_id, received_now, file_size, head, on_checkpoint
+        )
+        pipeline.close()
+    except BaseException:
+        # bytes a failed write never stored must not be checkpointed
+        try:
+            pipeline.close()
+            intact = True
+        except Exception:
+            intact = False
+        progress.stop(file_id, flush=intact)
+        raise
+
+    if state != "DONE":
+        progress.stop(file_id, flush=state == "INTERRUPTED")
+    return state
+
+
+def complete_upload(conn, action, file_id, hasher, save_path, chunked=None):
+    """Check the client's CHECKSUM line and mark the upload finished."""
+    try:
+        ck_line = recv_text(conn, 2.0)
+        server_ck = verify_upload(ck_line, hasher, save_path)
+
+        if server_ck is None:
+            update_file_status(file_id, "CANCELED")
+            set_action_status(action["action_id"], "CANCELED")
+            conn.send(b"ERROR CHECKSUM MISMATCH\n")
+            return False
+
+        # keyed by the tree digest: computed here from the bytes received
+        extra = (chunked.index_entries(), chunked.wire_bytes) if chunked else ()
+        promote(file_id, save_path, hasher.tree_hexdigest(), server_ck, *extra)
+        set_action_status(action["action_id"], "DONE")
+        send_frame(conn, ACK, b"\nUpload completed!\n")
+        return True
+    finally:
+        progress.stop(file_id, flush=False)
+
+
+def canceled_by_client(conn, action, file_id):
+    """True if a v2 client's "cancel" cut the upload short; records it."""
+    if not client_canceled(conn):
+        return False
+    set_action_status(action["action_id"], "CANCELED")
+    update_file_status(file_id, "CANCELED")
+    return True
+
+
+def end_upload(cid, action, state, file_id, hasher, save_path):
+    if state == "CANCELED":
+        print(f"[UPLOAD CANCELED] {cid}")
+        try:
+            os.remove(save_path)
+        except OSError:
+            pass
+    else:
+        print(f"[INTERRUPTED] {cid}")
+        set_action_status(action["action_id"], "INTERRUPTED")
+        if hasher is not None:
+            suspend_hasher(file_id, hasher)
+
+
+def run_upload(
+    conn,
+    cid,
+    action,
+    file_id,
+    save_path,
+    hasher,
+    received,
+    file_size,
+    head=b"",
+    codec=None,
+):
+    """Receive from `received` on, then verify; the file must exist already.
+
+    With a codec the data arrives framed (tcp/codecs.py); `head` is then the
+    start of the first frame.
+    """
+    source = conn
+    if codec:
+        source, head = FrameReader(conn, codec, head), b""
+    with open(save_path, "r+b") as f:
+        # drop bytes written after the last checkpoint; the client resends them
+        f.truncate(received)
+        f.seek(received)
+        state = receive_upload(
+            source,
+            f,
+            hasher,
+            file_id,
+            received,
+            file_size,
+            head,
+            cid,
+            progress_reporter(conn),
+        )
+
+    if state == "INTERRUPTED" and canceled_by_client(conn, action, file_id):
+        state = "CANCELED"
+    if state == "DONE":
+        complete_upload(conn, action, file_id, hasher, save_path)
+        liveness.beat(cid)
+    else:
+        end_upload(cid, action, state, file_id, hasher, save_path)
+
+
+def receive_range(conn, upload, view, start, length):
+    """pwrite one range as it arrives; its sha256, or None if cut short."""
+    h = hashlib.sha256()
+    pos, end = start, start + length
+    while pos < end:
+        want = min(len(view), end - pos)
+        n = fill_buffer(conn, view, want)
+        if n:
+            chunk = view[:n]
+            if not upload.write(chunk, pos):
+                return None
+            h.update(chunk)
+            pos += n
+        if n < want:
+            return None
+    return h.hexdigest()
+
+
+def serve_stream(conn, parts):
+    """Data connection of a parallel upload: take ranges until none are left."""
+    upload = None
+    if len(parts) == 3 and parts[1].isdigit():
+        upload = find_ranged_upload(int(parts[1]), parts[2])
+    if not upload or not upload.attach():
+        conn.send(b"ERROR UNKNOWN_STREAM\n")
+        return
+
+    conn.settimeout(STREAM_IDLE_TIMEOUT)
+    view = memoryview(bytearray(UPLOAD_BUFFER_SIZE))
+    try:
+        while True:
+            claimed = upload.claim()
+            if claimed is None:
+                conn.send(b"END\n")
+                return
+            index, start, length = claimed
+            try:
+                conn.send(f"RANGE {index} {start} {length}\n".encode())
+                digest = receive_range(conn, upload, view, start, length)
+            except BaseException:
+                upload.release(index)
+                raise
+            if digest is None:
+                upload.release(index)
+                return
+            upload.complete(index, digest)
+    finally:
+        upload.detach()
+
+
+def run_ranged_upload(conn, cid, action, upload, poll):
+    """Control side of a parallel upload: wait for the streams, then verify."""
+    file_id = upload.file_id
+    state = "DONE"
+    try:
+        while not upload.wait(1.0):
+            if conn.pending() or conn in poll(0):
+                data = recv_idle(conn)
+                if data is None:
+                    state = "INTERRUPTED"
+                    break
+                if data.lower() == "cancel":
+                    set_action_status(action["action_id"], "CANCELED")
+                    update_file_status(file_id, "CANCELED")
+                    state = "CANCELED"
+                    break
+            if upload.stalled():
+                state = "INTERRUPTED"
+                break
+            if upload_canceled(file_id):
+                state = "CANCELED"
+                break
+    finally:
+        upload.close()
+
+    if state == "DONE":
+        conn.send(b"RANGES DONE\n")
+        index = None
+        if upload.manifest:
+            index = CheckedManifest(upload.path, upload.manifest)
+        complete_upload(conn, action, file_id, upload.hasher(), upload.path, index)
+        liveness.beat(cid)
+        return
+    try:
+        conn.send(f"RANGES {state}\n".encode())
+    except OSError:
+        pass
+    end_upload(cid, action, state, file_id, None, upload.path)
+
+
+def recv_lines(conn, count, timeout):
+    """Read `count` newline-terminated lines; fewer if the client stops."""
+    conn.settimeout(timeout)
+    lines, tail = [], b""
+    while len(lines) < count:
+        try:
+            data = conn.recv(65536)
+        except OSError:
+            break
+        if not data:
+            break
+        *done, tail = (tail + data).split(b"\n")
+        lines.extend(done)
+    return [line.decode(errors="ignore") for line in lines[:count]]
+
+
+def receive_chunks(conn, upload, file_id, client_id, on_checkpoint=None):
+    """Rebuild a chunked upload from the store and the chunks the client sends.
+
+    Returns "DONE", "CANCELED", "INTERRUPTED" or "MISMATCH" (a chunk that
+    is not what the manifest promised). Checkpoints like receive_upload, so
+    an interrupted chunked upload resumes as a plain one from its offset.
+    """
+    progress.start(file_id, upload.f, 0, upload.hasher, client_id)
+    view = memoryview(bytearray(CHUNK_MAX_SIZE))
+    state = "DONE"
+    try:
+        while not upload.done:
+            n = upload.copy_stored(FLUSH_BYTES)
+            if not n:
+                want = upload.next_length
+                n = fill_buffer(conn, view, want)
+                if n < want:
+                    state = "INTERRUPTED"
+                    break
+                if not upload.accept(view[:n]):
+                    state = "MISMATCH"
+                    break
+            if progress.advance(file_id, n):
+                progress.flush(file_id)
+                if on_checkpoint:
+                    on_checkpoint(progress.received(file_id))
+                if upload_canceled(file_id):
+                    state = "CANCELED"
+                    break
+    except BaseException:
+        progress.stop(file_id, flush=False)
+        raise
+
+    if state != "DONE":
+        progress.stop(file_id, flush=state == "INTERRUPTED")
+    return state
+
+
+def run_chunked_upload(
+    conn, cid, action, file_id, save_path, file_size, count, codec=None, streams=1
+):
+    """Manifest, NEED, the missing chunks, then the usual CHECKSUM check.
+
+    Only the chunk data is framed when a codec was agreed on. When the
+    manifest shows too little of the file is stored to beat parallel streams
+    (see prefer_ranges), returns it before NEED is sent; the caller then
+    answers with the RANGES header.
+    """
+    conn.send(b"MANIFEST\n")
+    lines = recv_lines(conn, count, MANIFEST_TIMEOUT)
+    manifest = parse_manifest(lines, count, file_size)
+    if manifest is None:
+        print(f"[UPLOAD CANCELED] {cid} bad chunk manifest")
+        update_file_status(file_id, "CANCELED")
+        set_action_status(action["action_id"], "CANCELED")
+        conn.send(b"ERROR BAD MANIFEST\n")
+        return
+
+    with open(save_path, "w+b") as f:
+        upload = ChunkedUpload(file_id, f, manifest, cid)
+        try:
+            print(f"[CHUNKS] {cid} needs {len(upload.needed)}/{count} chunks")
+            if prefer_ranges(upload, file_size, streams):
+                print(f"[CHUNKS] {cid} too little stored, using ranges")
+                return manifest
+            conn.send(upload.need_line().encode())
+            source = FrameReader(conn, codec) if codec else conn
+            state = receive_chunks(
+                source, upload, file_id, cid, progress_reporter(conn)
+            )
+        finally:
+            upload.close()
+
+    if state == "INTERRUPTED" and canceled_by_client(conn, action, file_id):
+        state = "CANCELED"
+    if state == "DONE":
+        complete_upload(conn, action, file_id, upload.hasher, save_path, upload)
+        liveness.beat(cid)
+    elif state == "MISMATCH":
+        print(f"[UPLOAD CANCELED] {cid} chunk {upload.index} does not match")
+        update_file_status(file_id, "CANCELED")
+        set_action_status(action["action_id"], "CANCELED")
+        conn.send(b"ERROR CHUNK MISMATCH\n")
+    else:
+        end_upload(cid, action, state, file_id, upload.hasher, save_path)
+
+
+def send_download(conn, action, file_info, offset, file_size, codec=None):
+    """Send a file's content from offset on; returns (state, bytes sent).
+
+    state is "DONE" or "INTERRUPTED". Progress goes to actions.progress at
+    the same cadence uploads checkpoint theirs. With a codec the file goes
+    out in frames of FRAME_SIZE bytes; sent still counts bytes of the file.
+    Content compressed at rest is decompressed as it is read. On a v2
+    Channel the bytes go out as DATA frames.
+    """
+    action_id = action["action_id"]
+    sent = offset
+    encoder = FrameEncoder(codec) if codec else None
+    with open_stored(file_info) as f:
+        f.seek(offset)
+        # plain file bytes can go out as they are on disk
+        direct = not encoder and not isinstance(f, FramedFile)
+        if DOWNLOAD_BLOCK_SIZE <= 0 and direct:
+            try:
+                conn.sendfile(f)  # 8 KB send() loop on an SSLSocket
+            except OSError:
+                return "INTERRUPTED", offset
+            return "DONE", file_size
+
+        # with kernel TLS the file goes out by sendfile() without a copy
+        zero_copy = direct and ktls_send_active(conn)
+        block = FRAME_SIZE if encoder else DOWNLOAD_BLOCK_SIZE
+        view = None if zero_copy else memoryview(bytearray(block))
+        flushed, flushed_at = sent, time.monotonic()
+        while sent < file_size:
+            try:
+                if zero_copy:
+                    count = min(FLUSH_BYTES, file_size - sent)
+                    if isinstance(conn, Channel):
+                        n = conn.sendfile(f, sent, count)
+                    else:
+                        n = sendfile_ktls(conn, f, sent, count)
+                else:
+                    n = f.readinto(view)
+                    if n:
+                        conn.sendall(encoder.encode(view[:n]) if encoder else view[:n])
+            except OSError:
+                update_action_progress(action_id, sent)
+                return "INTERRUPTED", sent
+            if not n:
+                break
+            sent += n
+            feed.download(action, sent, file_size)
+            if (
+                sent - flushed >= FLUSH_BYTES
+                or time.monotonic() - flushed_at >= FLUSH_INTERVAL
+            ):
+                update_action_progress(action_id, sent)
+                flushed, flushed_at = sent, time.monotonic()
+    return "DONE", sent
+
+
+def run_download(conn, cid, action, file_info, offset, file_size, codec=None):
+    try:
+        state, sent = send_download(conn, action, file_info, offset, file_size, codec)
+    finally:
+        feed.download_end(action["action_id"])
+    if state == "DONE":
+        # v2 clients can check what they got against the stored sha256
+        if isinstance(conn, Channel) and file_info.get("checksum"):
+            conn.send_frame(CHECKSUM, file_info["checksum"].encode())
+        send_frame(conn, ACK, b"\nDownload completed!\n")
+        update_action_progress(action["action_id"], file_size)
+        set_action_status(action["action_id"], "DONE")
+        liveness.beat(cid)
+    else:
+        # the client reports what it really has when the download resumes
+        print(f"[INTERRUPTED] {cid} download at {sent}/{file_size}")
+        set_action_status(action["action_id"], "INTERRUPTED")
+
+
+def resume_download(conn, cid, action, file_info):
+    """Ask the client how much it already has and send the rest.
+
+    Clients without download resume never answer DOWNLOAD_RESUME with an
+    offset; the action is canceled after RESUME_REPLY_TIMEOUT.
+    """
+    filename = file_info["filename"]
+    file_size = content_size(file_info)
+    if file_size is None:
+        set_action_status(action["action_id"], "CANCELED")
+        conn.send(b"ERROR FILE NOT FOUND ON SERVER\n")
+        return
+
+    set_action_status(action["action_id"], "RUNNING")
+    conn.send(f"DOWNLOAD_RESUME {file_size}|{filename}\n".encode())
+
+    offset = None
+    deadline = time.time() + RESUME_REPLY_TIMEOUT
+    while offset is None and time.time() < deadline:
+        reply = recv_text(conn, max(deadline - time.time(), 0.1))
+        if not reply or reply.lower() == "cancel":
+            break
+        liveness.beat(cid)  # PINGs while the user decides
+        offset = parse_download_offset(reply, file_size)
+
+    if offset is None:
+        print(f"[RESUME CANCELED] {cid} download {filename}")
+        set_action_status(action["action_id"], "CANCELED")
+        return
+
+    # a COMPRESS offer comes with the OFFSET line
+    offer = parse_offer(reply)
+    codec = choose_codec(offer)
+    if offer is not None:
+        conn.send(codec_line(codec).encode())
+    print(f"[RESUME] {cid} download {filename} from {offset}/{file_size}")
+    run_download(conn, cid, action, file_info, offset, file_size, codec)
+
+
 def handle_client(conn, addr):
     print(f"[CONNECTED] {addr}")
     cid = None
+    wake = None
 
     try:
         # ========== LOGIN ==========
@@ -69,71 +675,176 @@ def handle_client(conn, addr):
             return
         parts = raw.decode(errors="ignore").strip().split(" ", 2)
 
-        if len(parts) != 3 or parts[0] != "LOGIN":
+        if parts[0] == "STREAM":
+            serve_stream(conn, parts)
+            return
+
+        if len(parts) != 3 or parts[0] not in ("LOGIN", LOGIN_V2):
             conn.send(b"ERROR UNKNOWN_COMMAND\n")
             return
 
-        _, cid, pwd = parts
+        command, cid, pwd = parts
         user = get_client(cid)
 
-        if not user or not verify_password(pwd, user["password_hash"]):
+        if not user or not verify_password_cached(
+            f"client:{cid}", pwd, user["password_hash"]
+        ):
             conn.send(b"ERROR INVALID_CREDENTIALS\n")
             return
 
-        conn.send(b"OK AUTHORIZED\n")
-        update_client_status(cid, "ONLINE")
-        last_seen[cid] = time.time()
-        print(f"[AUTH] {cid} LOGIN")
+        if command == LOGIN_V2:
+            # framed from here on (tcp/framing.py)
+            conn.send(b"OK AUTHORIZED V2\n")
+            conn = Channel(conn)
+        else:
+            conn.send(b"OK AUTHORIZED\n")
+        print(f"[AUTH] {cid} {command}")
+
+        liveness.login(cid)
+        wake_r, wake_w = socket.socketpair()
+        wake_r.setblocking(False)
+        wake = make_waker(wake_w)
+        dispatcher.register(cid, wake)
+        poll = make_poller(conn, wake_r)
 
         waiting_for_path = False
         current_action = None
-        upload_meta = None
+        # check the DB right after login: interrupted actions may be waiting
+        actions_dirty = True
+        last_poll = 0
+        busy = False
 
         while True:
-            if not waiting_for_path and (time.time() - last_seen.get(cid, 0)) > 12:
+            if busy and not waiting_for_path:
+                actions_dirty = True  # an action just ended, the next may be queued
+            busy = waiting_for_path
+
+            if not waiting_for_path and liveness.expired(cid):
                 print(f"[TIMEOUT] {cid} => OFFLINE")
-                update_client_status(cid, "OFFLINE")
                 break
 
-            data = recv_text(conn, None if waiting_for_path else 1.0)
+            if waiting_for_path:
+                data = recv_idle(conn, None)
+            else:
+                readable, woken = wait_readable(conn, wake_r, poll, 1.0)
+                actions_dirty = actions_dirty or woken
+                data = recv_idle(conn) if readable else ""
+            if data is None:
+                break
 
             # ========== HEARTBEAT ==========
             if not waiting_for_path and data.startswith("PING"):
-                last_seen[cid] = time.time()
-                update_client_status(cid, "ONLINE")
+                liveness.beat(cid)
+                token = parse_ping(data)
+                if token:
+                    conn.send(f"PONG {token}\n".encode())
                 continue
 
+            # actions are pushed through the dispatcher; polling is the fallback
+            poll_due = not waiting_for_path and (
+                actions_dirty or time.time() - last_poll > ACTION_POLL_INTERVAL
+            )
+            if poll_due:
+                actions_dirty = False
+                last_poll = time.time()
+
             # ========== RESUME ==========
-            if not waiting_for_path:
+            if poll_due:
                 interrupted = get_interrupted_action(cid)
                 if interrupted:
                     current_action = interrupted
+                    liveness.hold(cid)
                     file_info = get_file(current_action["file_id"])
                     if not file_info:
                         set_action_status(current_action["action_id"], "CANCELED")
+                        actions_dirty = True
                         continue
 
                     filename = file_info["filename"]
                     file_size = file_info["size"]
+                    file_id = file_info["file_id"]
                     received = file_info["received"]
+                    save_path = staging_path(cid, filename)
+
+                    if current_action["action_type"] == "DOWNLOAD":
+                        print(f"[RESUME DETECTED] {cid} download {filename}")
+                        resume_download(conn, cid, current_action, file_info)
+                        continue
 
                     print(f"[RESUME DETECTED] {cid} {filename} {received}/{file_size}")
 
-                    upload_meta = {"filename": filename, "size": file_size}
-                    waiting_for_path = True
+                    if get_file_ranges(file_id):
+                        upload = open_ranged_upload(
+                            file_id, save_path, file_size, resume=True, client_id=cid
+                        )
+                        set_action_status(current_action["action_id"], "RUNNING")
+                        print(
+                            f"[RESUME] {cid} {filename} {len(upload.pending)} ranges left"
+                        )
+                        conn.send(upload.header(MAX_STREAMS).encode())
+                        liveness.beat(cid)
+                        run_ranged_upload(conn, cid, current_action, upload, poll)
+                        continue
+
+                    try:
+                        hasher = resume_hasher(
+                            file_id, save_path, received, get_file_segments(file_id)
+                        )
+                    except OSError:
+                        # partial file lost: start the transfer over
+                        received = 0
+                        hasher = UploadHasher.fresh()
+                        os.makedirs(os.path.dirname(save_path), exist_ok=True)
+                        open(save_path, "wb").close()
+
                     set_action_status(current_action["action_id"], "RUNNING")
-                    conn.send(f"OFFSET {received}\n".encode())
-                    last_seen[cid] = time.time()
+                    # the upload goes on framed if it started that way
+                    codec = file_info.get("upload_codec")
+                    reply = f"OFFSET {received}\n"
+                    if codec:
+                        reply = codec_line(codec) + reply
+                    conn.send(reply.encode())
+                    liveness.beat(cid)
+
+                    # the client streams right after OFFSET, there is no prompt;
+                    # a client that lost its upload path answers "cancel"
+                    conn.settimeout(None)
+                    # framed, the CHECKSUM line may follow sooner than that
+                    want = HEADER_SIZE if codec else UPLOAD_BUFFER_SIZE
+                    try:
+                        head = recv_head(conn, min(want, file_size - received))
+                    except (ConnectionError, OSError):
+                        head = b""  # run_upload records the interruption
+                    if head.strip().lower() == b"cancel":
+                        print(f"[RESUME CANCELED] {cid} {filename}")
+                        set_action_status(current_action["action_id"], "CANCELED")
+                        update_file_status(file_id, "CANCELED")
+                        continue
+
+                    print(f"[RESUME] {cid} {filename} from {received}/{file_size}")
+                    run_upload(
+                        conn,
+                        cid,
+                        current_action,
+                        file_id,
+                        save_path,
+                        hasher,
+                        received,
+                        file_size,
+                        head,
+                        codec,
+                    )
                     continue
 
             # ========== NEW ACTION ==========
-            actions = get_pending_actions_by_client(cid)
-            if actions and not waiting_for_path:
+            actions = get_pending_actions_by_client(cid) if poll_due else None
+            if actions:
                 current_action = actions[0]
                 action_type = current_action.get("action_type")
 
                 if not action_type:
                     set_action_status(current_action["action_id"], "CANCELED")
+                    actions_dirty = True
                     continue
 
                 if current_action["status"] in ("DONE", "CANCELED"):
@@ -141,7 +852,7 @@ def handle_client(conn, addr):
 
                 waiting_for_path = True
                 set_action_status(current_action["action_id"], "RUNNING")
-                last_seen[cid] = time.time()
+                liveness.hold(cid)
 
                 if action_type == "UPLOAD":
                     conn.send(b"\nUpload request\nEnter file path:\n\n")
@@ -159,80 +870,6 @@ def handle_client(conn, addr):
                 folder = os.path.join(STORAGE_DIR, cid)
                 os.makedirs(folder, exist_ok=True)
 
-                # ========== RESUME ==========
-                if upload_meta is not None:
-                    filename = upload_meta["filename"]
-                    file_size = upload_meta["size"]
-                    info = get_file(current_action["file_id"])
-                    received_now = info["received"]
-                    save_path = os.path.join(folder, filename)
-
-                    print(f"[RESUME] {cid} {filename} from {received_now}/{file_size}")
-
-                    f = open(save_path, "ab")
-                    h = hashlib.sha256()
-
-                    with open(save_path, "rb") as existing:
-                        while True:
-                            b = existing.read(4096)
-                            if not b:
-                                break
-                            h.update(b)
-
-                    while received_now < file_size:
-                        action = get_action_by_file(current_action["file_id"])
-                        if action and action["status"] == "CANCELED":
-                            print(f"[UPLOAD CANCELED] {cid}")
-                            f.close()
-                            try:
-                                os.remove(save_path)
-                            except:
-                                pass
-                            upload_meta = None
-                            waiting_for_path = False
-                            break
-
-                        part = conn.recv(min(4096, file_size - received_now))
-                        if not part:
-                            print(f"[INTERRUPTED RESUME] {cid}")
-                            set_action_status(
-                                current_action["action_id"], "INTERRUPTED"
-                            )
-                            waiting_for_path = False
-                            break
-
-                        f.write(part)
-                        h.update(part)
-                        received_now += len(part)
-                        update_file_received(current_action["file_id"], received_now)
-
-                    f.close()
-
-                    if received_now < file_size:
-                        upload_meta = None
-                        continue
-
-                    ck_line = recv_text(conn, 2.0)
-                    client_ck = ck_line.split(" ", 1)[1] if " " in ck_line else ""
-                    server_ck = h.hexdigest()
-
-                    if client_ck != server_ck:
-                        update_file_status(current_action["file_id"], "CANCELED")
-                        set_action_status(current_action["action_id"], "CANCELED")
-                        conn.send(b"ERROR CHECKSUM MISMATCH\n")
-                        waiting_for_path = False
-                        upload_meta = None
-                        continue
-
-                    finish_file_upload(current_action["file_id"], server_ck)
-                    set_action_status(current_action["action_id"], "DONE")
-                    conn.send(b"\nUpload completed!\n")
-
-                    upload_meta = None
-                    waiting_for_path = False
-                    last_seen[cid] = time.time()
-                    continue
-
                 # ========== NEW UPLOAD ==========
                 if not data:
                     continue
@@ -246,76 +883,72 @@ def handle_client(conn, addr):
 
                 clean = req.replace("\\", "/")
                 filename = os.path.basename(clean)
-                filename = get_unique_filename(folder, filename)
+                filename = get_unique_filename(
+                    folder, filename, lambda name: filename_taken(cid, name)
+                )
 
                 conn.send(b"OK START_UPLOAD\n")
 
                 size_line = recv_text(conn, 5.0)
-                file_size = int(size_line)
-                file_id = add_file(cid, filename, file_size, "UPLOADING")
+                file_size, streams = parse_size_line(size_line)
+                chunk_count = manifest_count(size_line)
+                chunked = wants_chunks(file_size, chunk_count)
+                ranged = not chunked and wants_ranges(file_size, streams)
+                # range streams are never framed
+                offer = parse_offer(size_line)
+                codec = None if ranged else choose_codec(offer)
+                file_id = add_file(cid, filename, file_size, "UPLOADING", codec)
                 current_action["file_id"] = file_id
                 attach_file_to_action(current_action["action_id"], file_id)
 
                 save_path = os.path.join(folder, filename)
-                upload_meta = {"filename": filename, "size": file_size}
                 print(f"[NEW UPLOAD] {cid} uploading {filename}")
-
-                conn.send(b"0\n")
-
-                f = open(save_path, "wb")
-                h = hashlib.sha256()
-                received_now = 0
-
-                while received_now < file_size:
-                    action = get_action_by_file(current_action["file_id"])
-                    if action and action["status"] == "CANCELED":
-                        print(f"[UPLOAD CANCELED] {cid}")
-                        f.close()
-                        try:
-                            os.remove(save_path)
-                        except:
-                            pass
-                        upload_meta = None
+                if offer is not None:
+                    conn.send(codec_line(codec).encode())
+
+                manifest = None
+                if chunked:
+                    manifest = run_chunked_upload(
+                        conn,
+                        cid,
+                        current_action,
+                        file_id,
+                        save_path,
+                        file_size,
+                        chunk_count,
+                        codec,
+                        streams,
+                    )
+                    if manifest is None:
                         waiting_for_path = False
-                        break
-
-                    part = conn.recv(min(4096, file_size - received_now))
-                    if not part:
-                        print(f"[INTERRUPTED NEW] {cid}")
-                        set_action_status(current_action["action_id"], "INTERRUPTED")
-                        waiting_for_path = False
-                        break
-
-                    f.write(part)
-                    h.update(part)
-                    received_now += len(part)
-                    update_file_received(file_id, received_now)
-
-                f.close()
-
-                if received_now < file_size:
-                    upload_meta = None
-                    continue
-
-                ck_line = recv_text(conn, 2.0)
-                client_ck = ck_line.split(" ", 1)[1] if " " in ck_line else ""
-                server_ck = h.hexdigest()
-
-                if client_ck != server_ck:
-                    update_file_status(file_id, "CANCELED")
-                    set_action_status(current_action["action_id"], "CANCELED")
-                    conn.send(b"ERROR CHECKSUM MISMATCH\n")
+                        continue
+                    ranged = True
+
+                if ranged:
+                    upload = open_ranged_upload(
+                        file_id, save_path, file_size, client_id=cid
+                    )
+                    upload.manifest = manifest
+                    conn.send(upload.header(streams).encode())
+                    run_ranged_upload(conn, cid, current_action, upload, poll)
                     waiting_for_path = False
-                    upload_meta = None
                     continue
 
-                finish_file_upload(file_id, server_ck)
-                set_action_status(current_action["action_id"], "DONE")
-                conn.send(b"\nUpload completed!\n")
+                open(save_path, "wb").close()
+                conn.send(b"0\n")
 
-                upload_meta = None
+                run_upload(
+                    conn,
+                    cid,
+                    current_action,
+                    file_id,
+                    save_path,
+                    UploadHasher.fresh(),
+                    0,
+                    file_size,
+                    codec=codec,
+                )
                 waiting_for_path = False
-                last_seen[cid] = time.time()
                 continue
 
             # ========== DOWNLOAD ==========
@@ -333,47 +966,126 @@ def handle_client(conn, addr):
                     continue
 
                 file_info = get_file(current_action["file_id"])
-                file_path = os.path.join(STORAGE_DIR, cid, file_info["filename"])
+                file_size = content_size(file_info)
 
-                if not os.path.exists(file_path):
+                if file_size is None:
                     conn.send(b"ERROR FILE NOT FOUND ON SERVER\n")
                     waiting_for_path = False
                     continue
 
-                file_size = os.path.getsize(file_path)
                 file_name = file_info["filename"]
                 conn.send(f"{file_size}|{file_name}\n".encode())
+                # a COMPRESS offer comes with the save path
+                offer = parse_offer(data)
+                codec = choose_codec(offer)
+                if offer is not None:
+                    conn.send(codec_line(codec).encode())
 
-                with open(file_path, "rb") as f:
-                    conn.sendfile(f)
-
-                conn.send(b"\nDownload completed!\n")
-                set_action_status(current_action["action_id"], "DONE")
-
+                run_download(conn, cid, current_action, file_info, 0, file_size, codec)
                 waiting_for_path = False
-                last_seen[cid] = time.time()
                 continue
 
     except Exception as e:
         print(f"[ERROR] {cid} crashed: {e}")
 
     finally:
-        if cid:
-            update_client_status(cid, "OFFLINE")
+        if wake:
+            dispatcher.unregister(cid, wake)
+            wake_r.close()
+            wake_w.close()
+            liveness.logout(cid)
+            # a blip that dropped this session is followed by a reconnect
+            keep_credentials(f"client:{cid}")
         conn.close()
         print(f"[DISCONNECTED] {addr}")
 
 
-def start_secure_server():
-    print(f"[TCP] Listening on {HOST}:{PORT} (SSL ENABLED)")
+def secure_client(client, addr, pending):
+    """Worker thread: TLS handshake (bounded by a timeout), then the session."""
+    client.settimeout(TLS_HANDSHAKE_TIMEOUT)
+    try:
+        conn = sessions.context.wrap_socket(client, server_side=True)
+    except (ssl.SSLError, OSError) as e:
+        pending.failed(timed_out=isinstance(e, socket.timeout))
+        sessions.record_failure()
+        print(f"[HANDSHAKE FAILED] {addr}: {e}")
+        client.close()
+        return
+    conn.settimeout(None)
+    pending.done()
+    sessions.record(conn)
+    handle_client(conn, addr)
+
+
+def start_secure_server(backlog=TCP_BACKLOG):
+    print(f"[TCP] Listening on {HOST}:{PORT} (SSL ENABLED, engine=thread)")
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     sock.bind((HOST, PORT))
-    sock.listen()
+    sock.listen(backlog)
+    accepts.configure(backlog, TLS_HANDSHAKE_TIMEOUT)
     while True:
         client, addr = sock.accept()
-        conn = context.wrap_socket(client, server_side=True)
-        threading.Thread(target=handle_client, args=(conn, addr), daemon=True).start()
+        # the handshake runs in the worker so a stalled client cannot hold
+        # up the accept loop
+        threading.Thread(
+            target=secure_client, args=(client, addr, accepts.accept()), daemon=True
+        ).start()
 
 
 if __name__ == "__main__":
-    start_secure_server()
+    parser = argparse.ArgumentParser(description="TLS file transfer server")
+    parser.add_argument(
+        "--engine",
+        choices=("thread", "asyncio"),
+        default=os.getenv("TCP_ENGINE", "thread"),
+        help="thread = one OS thread per client, asyncio = one event loop",
+    )
+    parser.add_argument(
+        "--ktls",
+        action="store_true",
+        default=os.getenv("TCP_KTLS", "") not in ("", "0"),
+        help="use kernel TLS when the host supports it (thread engine)",
+    )
+    parser.add_argument(
+        "--backlog",
+        type=int,
+        default=TCP_BACKLOG,
+        help="listen() backlog for connections waiting to be accepted",
+    )
+    args = parser.parse_args()
+    init_db()
+    # blobs left by a crash between promotion and commit, then at-rest
+    # compression when STORAGE_CODEC is set
+    threading.Thread(target=maintain_store, name="blob-store", daemon=True).start()
+    raise_nofile_limit()
+    start_control_listener()
+    feed.start()
+    sessions.start()
+    accepts.start()
+    liveness.start()
+    register_handler("auth", auth_cache_stats)
+
+    # persist live upload progress on Ctrl+C / SIGTERM so resume is exact
+    atexit.register(progress.flush_all)
+    atexit.register(liveness.flush_all)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    print(
+        f"[TLS] {sessions.tickets} session ticket(s) per full handshake, "
+        f"keys rotate every {sessions.rotate_every:g}s"
+    )
+    if not args.ktls:
+        print("[TLS] userspace TLS (kTLS off, enable with --ktls)")
+    elif args.engine == "asyncio":
+        # asyncio runs TLS over memory BIOs, the kernel never sees a session
+        print("[TLS] userspace TLS (kTLS needs the thread engine)")
+    else:
+        print(f"[TLS] {enable_ktls(sessions.context)}")
+
+    if args.engine == "asyncio":
+        from tcp.async_server import start_async_server
+
+        start_async_server(args.backlog)
+    else:
+        start_secure_server(args.backlog)
@@ -0,0 +1,100 @@
+import os, threading, time
+
+from tcp.common import create_ssl_context
+from tcp.control import register_handler
+
+# TLS session resumption. Agents reconnect often (a missed heartbeat, a
+# parallel upload stream, a restart), and a full handshake costs a
+# certificate signature plus a key exchange each time. The server issues
+# TLS 1.3 session tickets (RFC 8446 4.6.1) after every full handshake; a
+# client that keeps one skips the signature on its next connect. TLS 1.2
+# clients resume by session id from OpenSSL's built-in server cache.
+#
+# Ticket keys live inside OpenSSL's SSL_CTX and the ssl module gives no
+# hook to set them, so rotating them means handing out a fresh context:
+# tickets issued under the old keys stop working and each client pays one
+# full handshake after a rotation, which is what rotation is for.
+TLS_TICKETS = int(os.getenv("TLS_TICKETS", "2"))
+TLS_TICKET_ROTATE = float(os.getenv("TLS_TICKET_ROTATE", str(12 * 3600)))
+
+
+class SessionContexts:
+    """Current server SSLContext plus full/resumed handshake counters."""
+
+    def __init__(self, rotate_every=TLS_TICKET_ROTATE, tickets=TLS_TICKETS):
+        self.rotate_every = rotate_every
+        self.tickets = tickets
+        self._lock = threading.Lock()
+        self._context = self._build()
+        self._rotated_at = time.monotonic()
+        self.full = 0
+        self.resumed = 0
+        self.failed = 0
+        self.rotations = 0
+
+    def _build(self, previous=None):
+        context = create_ssl_context()
+        context.num_tickets = self.tickets
+        if previous is not None:
+            # keeps whatever was switched on since startup (e.g. kTLS)
+            context.options = previous.options
+        return context
+
+    def _due(self):
+        return (
+            self.rotate_every > 0
+            and time.monotonic() - self._rotated_at >= self.rotate_every
+        )
+
+    @property
+    def context(self):
+        """The context new connections should use; rotates it when due."""
+        if self._due():
+            self.rotate()
+        return self._context
+
+    def rotate(self):
+        with self._lock:
+            # another accepting thread may have rotated since our check;
+            # rotating again would void the tickets it just started issuing
+            if not self._due():
+                return
+            self._context = self._build(self._context)
+            self._rotated_at = time.monotonic()
+            self.rotations += 1
+            rotations = self.rotations
+        print(f"[TLS] session ticket keys rotated ({rotations})")
+
+    def record(self, ssl_obj):
+        """Count one finished handshake (SSLSocket or asyncio's SSLObject)."""
+        with self._lock:
+            if ssl_obj is None:
+                self.failed += 1
+            elif ssl_obj.session_reused:
+                self.resumed += 1
+            else:
+                self.full += 1
+
+    def record_failure(self):
+        self.record(None)
+
+    def stats(self, message=None):
+        with self._lock:
+            total = self.full + self.resumed
+            return {
+                "handshakes": total,
+                "full": self.full,
+                "resumed": self.resumed,
+                "failed": self.failed,
+                "resumption_ratio": round(self.resumed / total, 3) if total else None,
+                "tickets_per_handshake": self.tickets,
+                "ticket_rotations": self.rotations,
+                "ticket_rotate_seconds": self.rotate_every,
+                "ticket_age_seconds": round(time.monotonic() - self._rotated_at),
+            }
+
+    def start(self):
+        register_handler("tls", self.stats)
+
+
+sessions = SessionContexts()
@@ -0,0 +1,364 @@
+import os, time, struct, hashlib
+
+from db.model import (
+    finish_file_upload,
+    delete_file,
+    blob_stats,
+    list_blob_hashes,
+    list_uncompressed_blobs,
+    set_blob_storage,
+)
+from tcp.codecs import FrameEncoder, FramedFile, FRAME_SIZE, has_codec
+
+# Content-addressed storage. An upload is received into its per-client
+# staging path (storage/<client_id>/<filename>) as before, where resume and
+# parallel ranges work on it; once verified it is promoted into
+# BLOB_DIR/<hh>/<hash>, or dropped if that content is stored already. The
+# files row keeps the client's name as metadata and points at the blob
+# through files.blob_hash; blobs.refcount counts those rows.
+#
+# Blobs are keyed by the upload's segment-tree digest (sha256 over the
+# HASH_SEGMENT_SIZE segment digests). The server computes it from the bytes
+# it received on every path: fresh, resumed after a restart, or parallel
+# ranges. A resumed or ranged upload only has the client's word for the
+# whole-file sha256, which must not decide what content a file points at.
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+STORAGE_DIR = os.getenv("STORAGE_DIR", os.path.join(BASE_DIR, "storage"))
+# must be on the same filesystem as STORAGE_DIR: promotion is a rename
+BLOB_DIR = os.getenv("BLOB_DIR", os.path.join(STORAGE_DIR, ".blobs"))
+# a blob being deleted is renamed to this first, so a failed commit can undo it
+_DELETING = ".deleting"
+
+# At-rest compression. With STORAGE_CODEC set (a codec of tcp/codecs.py;
+# lzma packs tightest), a background job of the TCP server compresses blobs
+# older than STORAGE_COMPRESS_AGE seconds into <blob>.z: a header naming the
+# codec and holding an index of every FRAME_INDEX_STRIDE-th frame, then
+# frames as on the wire, so a download resumed at an offset jumps to the
+# nearest indexed frame and decodes a single frame. The copy is checked
+# against the content's sha256 (files.checksum) before it replaces the raw
+# blob, and files.stored_codec / stored_size record the outcome for every
+# file of the blob. Readers go by what is on disk: the raw blob while it
+# exists, else <blob>.z. Content that does not shrink stays raw.
+STORAGE_CODEC = os.getenv("STORAGE_CODEC", "")
+STORAGE_COMPRESS_AGE = int(os.getenv("STORAGE_COMPRESS_AGE", "3600"))
+# seconds between passes of the job
+STORAGE_COMPRESS_INTERVAL = int(os.getenv("STORAGE_COMPRESS_INTERVAL", "300"))
+# kept raw unless compressing saves at least this share of the blob
+STORAGE_COMPRESS_MIN_SAVING = float(os.getenv("STORAGE_COMPRESS_MIN_SAVING", "0.1"))
+# frames per entry of a compressed blob's index (8 bytes each)
+FRAME_INDEX_STRIDE = 16
+_COMPRESSED = ".z"
+_PARTIAL = ".partial"
+# FSZ2: magic, codec, then frame size, stride and entry count and the index
+# entries before the frames; FSZ1 blobs (no index) are read by a full scan
+_MAGIC = b"FSZ2"
+_MAGIC_V1 = b"FSZ1"
+_INDEX_HEAD = struct.Struct(">III")
+
+
+def blob_path(blob_hash):
+    return os.path.join(BLOB_DIR, blob_hash[:2], blob_hash)
+
+
+def compressed_path(blob_hash):
+    return blob_path(blob_hash) + _COMPRESSED
+
+
+def staging_path(client_id, filename):
+    return os.path.join(STORAGE_DIR, client_id, filename)
+
+
+def stored_path(f):
+    """Where a files row's content is on disk.
+
+    Its blob once promoted; the staging path while uploading and for files
+    stored before the blob store existed.
+    """
+    if f.get("blob_hash"):
+        return blob_path(f["blob_hash"])
+    return staging_path(f["client_id"], f["filename"])
+
+
+def _open_compressed(path):
+    f = open(path, "rb")
+    try:
+        head = f.read(len(_MAGIC) + 1)
+        if len(head) != len(_MAGIC) + 1 or head[:-1] not in (_MAGIC, _MAGIC_V1):
+            raise OSError(f"{path} is not a compressed blob")
+        codec = f.read(head[-1]).decode()
+        index = None
+        if head.startswith(_MAGIC):
+            raw = f.read(_INDEX_HEAD.size)
+            if len(raw) != _INDEX_HEAD.size:
+                raise OSError(f"{path} has a truncated header")
+            frame_size, stride, count = _INDEX_HEAD.unpack(raw)
+            index = (frame_size, stride, f.tell(), count)
+            f.seek(8 * count, os.SEEK_CUR)
+        return FramedFile(f, codec, f.tell(), index)
+    except BaseException:
+        f.close()
+        raise
+
+
+def open_stored(f):
+    """A files row's content opened for reading, decompressed if need be.
+
+    A compressed blob comes back as a FramedFile; its seek() and reads are
+    in the original bytes like those of a plain file.
+    """
+    try:
+        return open(stored_path(f), "rb")
+    except FileNotFoundError:
+        if not f.get("blob_hash"):
+            raise
+    # compressed meanwhile: <blob>.z exists before the raw blob goes
+    return _open_compressed(compressed_path(f["blob_hash"]))
+
+
+def content_size(f):
+    """Size of a files row's content as clients see it; None if it is gone."""
+    try:
+        return os.path.getsize(stored_path(f))
+    except OSError:
+        pass
+    if f.get("blob_hash") and os.path.exists(compressed_path(f["blob_hash"])):
+        return f["size"]
+    return None
+
+
+def promote(file_id, staged, blob_hash, checksum, chunks=(), wire_bytes=None):
+    """Finish a verified upload: move it into the store, or drop the copy.
+
+    The rename happens inside finish_file_upload's transaction; if the
+    commit fails the file goes back to its staging path. chunks and
+    wire_bytes come from a chunked upload (tcp/chunks.py).
+    """
+    moved = []
+
+    def store(first):
+        target = blob_path(blob_hash)
+        stored = os.path.exists(target) or os.path.exists(target + _COMPRESSED)
+        if first or not stored:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(staged, target)
+            moved.append(target)
+
+    try:
+        finish_file_upload(file_id, checksum, blob_hash, store, chunks, wire_bytes)
+    except BaseException:
+        for target in moved:
+            os.replace(target, staged)
+        raise
+    if not moved:
+        # same content stored already: this upload's copy is not needed
+        try:
+            os.remove(staged)
+        except OSError:
+            pass
+    return bool(moved)
+
+
+def release(f):
+    """Delete a file row and its content (its blob if no other file uses it)."""
+    aside = []
+
+    def drop(blob_hash):
+        for path in (blob_path(blob_hash), compressed_path(blob_hash)):
+            try:
+                os.replace(path, path + _DELETING)
+                aside.append(path)
+            except FileNotFoundError:
+                pass
+
+    try:
+        delete_file(f["file_id"], drop)
+    except BaseException:
+        for path in aside:
+            os.replace(path + _DELETING, path)
+        raise
+    for path in aside:
+        os.remove(path + _DELETING)
+
+    if not f.get("blob_hash"):
+        try:
+            os.remove(staging_path(f["client_id"], f["filename"]))
+        except OSError:
+            pass
+
+
+def dedup_stats():
+    stats = blob_stats()
+    saved = stats["logical_bytes"] - stats["stored_bytes"]
+    stats["bytes_saved"] = saved
+    stats["disk_bytes"] = stats["stored_bytes"] - stats["compression_bytes_saved"]
+    stats["dedup_ratio"] = (
+        round(stats["logical_bytes"] / stats["stored_bytes"], 3)
+        if stats["stored_bytes"]
+        else None
+    )
+    return stats
+
+
+def sweep_orphans(min_age=3600):
+    """Remove blobs no row refers to (a crash between rename and commit).
+
+    Also drops partial compressed copies, and raw blobs whose compressed
+    copy is in place. Only files older than min_age are touched, so a
+    promotion still in flight in another process is left alone.
+    """
+    if not os.path.isdir(BLOB_DIR):
+        return 0
+    cutoff = time.time() - min_age
+    removed = 0
+    for shard in os.listdir(BLOB_DIR):
+        folder = os.path.join(BLOB_DIR, shard)
+        if not os.path.isdir(folder):
+            continue
+        known = list_blob_hashes(shard)
+        names = set(os.listdir(folder))
+        for name in names:
+            path = os.path.join(folder, name)
+            orphan = (
+                name.endswith((_DELETING, _PARTIAL))
+                or name.split(".")[0] not in known
+                or name + _COMPRESSED in names
+            )
+            try:
+                if orphan and os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                pass
+    return removed
+
+
+def _write_compressed(source, target, codec):
+    """Frame source into target; returns the bytes written.
+
+    The index's room is reserved from the blob's size (blobs do not change)
+    and filled in once the frames are written.
+    """
+    encoder = FrameEncoder(codec)
+    frames = -(-os.path.getsize(source) // FRAME_SIZE)
+    entries = [0] * -(-frames // FRAME_INDEX_STRIDE)
+    with open(source, "rb") as src, open(target, "wb") as out:
+        out.write(_MAGIC + bytes([len(codec)]) + codec.encode())
+        out.write(_INDEX_HEAD.pack(FRAME_SIZE, FRAME_INDEX_STRIDE, len(entries)))
+        index_at = out.tell()
+        out.write(bytes(8 * len(entries)))
+        frame = 0
+        while block := src.read(FRAME_SIZE):
+            if frame % FRAME_INDEX_STRIDE == 0:
+                entries[frame // FRAME_INDEX_STRIDE] = out.tell()
+            out.write(encoder.encode(block))
+            frame += 1
+        size = out.tell()
+        out.seek(index_at)
+        out.write(struct.pack(f">{len(entries)}Q", *entries))
+        out.flush()
+        os.fsync(out.fileno())
+        return size
+
+
+def _content_sha256(path):
+    h = hashlib.sha256()
+    with _open_compressed(path) as f:
+        while block := f.read(FRAME_SIZE):
+            h.update(block)
+    return h.hexdigest()
+
+
+def compress_blob(blob, codec=STORAGE_CODEC):
+    """Store one blob of list_uncompressed_blobs compressed if that pays.
+
+    Returns the bytes saved on disk by this call.
+    """
+    blob_hash = blob["blob_hash"]
+    raw, target = blob_path(blob_hash), compressed_path(blob_hash)
+
+    if os.path.exists(target):
+        # compressed already; the files added since (or a crash before the
+        # raw blob went) only lack the record
+        with _open_compressed(target) as f:
+            stored_codec = f.codec
+        if set_blob_storage(blob_hash, stored_codec, os.path.getsize(target)):
+            _remove(raw)
+        return 0
+    if blob["stored_size"] is not None:
+        # looked at before and kept raw
+        set_blob_storage(blob_hash, None, blob["size"])
+        return 0
+
+    partial = target + _PARTIAL
+    moved = []
+
+    def store():
+        os.replace(partial, target)
+        moved.append(target)
+
+    try:
+        size = _write_compressed(raw, partial, codec)
+        keep = size <= blob["size"] * (1 - STORAGE_COMPRESS_MIN_SAVING)
+        if keep and blob["checksum"] and _content_sha256(partial) != blob["checksum"]:
+            print(f"[COMPRESS] {blob_hash} does not match its sha256, kept raw")
+            keep = False
+        if not keep:
+            set_blob_storage(blob_hash, None, blob["size"])
+            return 0
+        try:
+            stored = set_blob_storage(blob_hash, codec, size, store)
+        except BaseException:
+            for path in moved:
+                os.replace(path, partial)
+            raise
+    finally:
+        _remove(partial)
+    if not stored:
+        return 0  # deleted meanwhile
+    # a download that opened the raw blob keeps reading it after this
+    _remove(raw)
+    return blob["size"] - size
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def compress_idle_blobs(codec=STORAGE_CODEC, min_age=STORAGE_COMPRESS_AGE, limit=100):
+    """One pass of the at-rest compression job: (blobs looked at, bytes saved)."""
+    blobs = list_uncompressed_blobs(min_age, limit)
+    saved = 0
+    for blob in blobs:
+        try:
+            saved += compress_blob(blob, codec)
+        except OSError as e:
+            print(f"[COMPRESS] {blob['blob_hash']} skipped: {e}")
+    return len(blobs), saved
+
+
+def run_compressor(limit=100):
+    """The at-rest compression job; runs until the process exits."""
+    if not has_codec(STORAGE_CODEC):
+        print(f"[COMPRESS] unknown codec {STORAGE_CODEC!r}, not started")
+        return
+    while True:
+        try:
+            count, saved = compress_idle_blobs(limit=limit)
+            if saved:
+                print(f"[COMPRESS] {count} blobs looked at, {saved} bytes saved")
+        except Exception as e:
+            print(f"[COMPRESS] pass failed: {e}")
+            count = 0
+        if count < limit:
+            time.sleep(STORAGE_COMPRESS_INTERVAL)
+
+
+def maintain_store():
+    """Background work of the TCP server: the orphan sweep, then the
+    at-rest compression job if STORAGE_CODEC is set (never both at once)."""
+    sweep_orphans()
+    if STORAGE_CODEC:
+        run_compressor()
@@ -0,0 +1,79 @@
+import queue, socket, threading, time
+
+from db.model import on_action_change
+from utils.tcp_control import CONTROL_HOST, send_control, unseal
+
+# In-process pub/sub behind /clients/monitor/events. While at least one
+# stream is open the hub listens on a local UDP port and keeps it
+# subscribed to the TCP server's event feed (tcp/events.py); action changes
+# made by this process (new requests, cancels) are published directly.
+SUBSCRIBE_INTERVAL = 3.0
+# events a slow stream may fall behind by before it starts losing the oldest
+LISTENER_BACKLOG = 256
+
+
+class EventHub:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._listeners = set()
+        self._sock = None
+        on_action_change(lambda action: self.publish({"type": "action", **action}))
+
+    def listen(self):
+        q = queue.Queue(LISTENER_BACKLOG)
+        with self._lock:
+            self._listeners.add(q)
+            if self._sock is None:
+                self._start()
+        return q
+
+    def unlisten(self, q):
+        with self._lock:
+            self._listeners.discard(q)
+
+    def publish(self, event):
+        with self._lock:
+            listeners = list(self._listeners)
+        for q in listeners:
+            while True:
+                try:
+                    q.put_nowait(event)
+                    break
+                except queue.Full:
+                    try:
+                        q.get_nowait()
+                    except queue.Empty:
+                        pass
+
+    def _start(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind((CONTROL_HOST, 0))
+        sock.settimeout(SUBSCRIBE_INTERVAL)
+        self._sock = sock
+        threading.Thread(target=self._run, args=(sock,), daemon=True).start()
+
+    def _run(self, sock):
+        port = sock.getsockname()[1]
+        renew_at = 0
+        while True:
+            with self._lock:
+                if not self._listeners:
+                    # last stream closed: let the subscription lapse
+                    self._sock = None
+                    sock.close()
+                    return
+            if time.monotonic() >= renew_at:
+                send_control({"type": "subscribe", "port": port})
+                renew_at = time.monotonic() + SUBSCRIBE_INTERVAL
+            try:
+                raw, _ = sock.recvfrom(65535)
+            except socket.timeout:
+                continue
+            except OSError:
+                continue
+            event = unseal(raw)
+            if event and event.get("type") in ("action", "progress"):
+                self.publish(event)
+
+
+hub = EventHub()
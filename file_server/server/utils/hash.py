@@ -1,3 +1,6 @@
+import os, hmac, time, hashlib, secrets, threading
+from collections import OrderedDict
+
 import bcrypt
 
 
@@ -7,3 +10,86 @@ def verify_password(plain: str, hashed: str) -> bool:
         return bcrypt.checkpw(plain.encode(), hashed.encode())
     except:
         return False
+
+
+# ========== VERIFIED CREDENTIAL CACHE ==========
+# A reconnect storm (every agent logging in again after a network blip)
+# would otherwise run bcrypt once per agent. A successful check is
+# remembered in memory per principal, with an HMAC (per-process random
+# key) of the secret together with the stored hash: plaintexts are never
+# kept, and a changed or deleted hash simply stops matching, in any
+# process. An entry lives AUTH_CACHE_TTL seconds past the principal's last
+# login or the end of its last session, so agents that were connected for
+# hours still skip bcrypt when a blip drops them. 0 disables the cache.
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "300"))
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "100000"))
+
+_auth_key = secrets.token_bytes(32)
+_verified = OrderedDict()  # principal -> [digest, expires_at]
+_verified_lock = threading.Lock()
+_counts = {"hits": 0, "misses": 0}
+
+
+def _credential_digest(plain, hashed):
+    msg = plain.encode() + b"\0" + hashed.encode()
+    return hmac.new(_auth_key, msg, hashlib.sha256).digest()
+
+
+def verify_password_cached(principal: str, plain: str, hashed: str) -> bool:
+    """verify_password, skipping bcrypt for a recently verified secret."""
+    if AUTH_CACHE_TTL <= 0:
+        return verify_password(plain, hashed)
+
+    digest = _credential_digest(plain, hashed)
+    now = time.monotonic()
+    with _verified_lock:
+        entry = _verified.get(principal)
+        if entry is not None and entry[0] == digest and entry[1] > now:
+            entry[1] = now + AUTH_CACHE_TTL
+            _verified.move_to_end(principal)
+            _counts["hits"] += 1
+            return True
+        _counts["misses"] += 1
+
+    if not verify_password(plain, hashed):
+        return False
+    with _verified_lock:
+        _verified[principal] = [digest, now + AUTH_CACHE_TTL]
+        _verified.move_to_end(principal)
+        while len(_verified) > AUTH_CACHE_SIZE:
+            _verified.popitem(last=False)
+    return True
+
+
+def auth_cache_stats(message=None):
+    """Hits and misses of this process's cache (the "auth" control query)."""
+    with _verified_lock:
+        hits, misses = _counts["hits"], _counts["misses"]
+        entries = len(_verified)
+    total = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_ratio": round(hits / total, 3) if total else None,
+        "entries": entries,
+        "ttl_seconds": AUTH_CACHE_TTL,
+    }
+
+
+def keep_credentials(principal: str):
+    """Restart the TTL of the check a session logged in with, when it ends.
+
+    The session was live until now, so its entry counts from here even if
+    the TTL ran out while it was connected.
+    """
+    with _verified_lock:
+        entry = _verified.get(principal)
+        if entry is not None:
+            entry[1] = time.monotonic() + AUTH_CACHE_TTL
+            _verified.move_to_end(principal)
+
+
+def forget_credentials(principal: str):
+    """Drop the cached check of a principal whose password changed or is gone."""
+    with _verified_lock:
+        _verified.pop(principal, None)
@@ -0,0 +1,73 @@
+import json
+from functools import partial
+from flask import Response, request
+
+# Opt-in streaming for list endpoints: "?stream=json" (same document as the
+# buffered response, written row by row) or "?stream=ndjson" / an
+# "Accept: application/x-ndjson" header (one JSON object per line). Rows
+# are read in keyset batches (db/model.py), so memory stays flat however
+# many rows there are and the first bytes leave after the first batch.
+
+# rows are coalesced into writes of about this size rather than one tiny
+# (chunked-encoded) write per row
+STREAM_CHUNK = 64 * 1024
+
+_dumps = partial(json.dumps, separators=(",", ":"))
+
+
+def stream_mode():
+    mode = request.args.get("stream")
+    if mode in ("json", "ndjson"):
+        return mode
+    if "application/x-ndjson" in request.headers.get("Accept", ""):
+        return "ndjson"
+    return None
+
+
+def stream_rows(mode, key, rows, tail=None):
+    """Response writing `rows` under `key` as they are produced.
+
+    `tail` is called once the rows are exhausted and returns extra
+    top-level fields (e.g. a next_cursor). In json mode they close the
+    document; in ndjson mode they go out as a last line when any is set.
+    """
+    if mode == "ndjson":
+        body = _ndjson(rows, tail)
+        return Response(_coalesce(body), mimetype="application/x-ndjson")
+    return Response(_coalesce(_json(key, rows, tail)), mimetype="application/json")
+
+
+def _coalesce(parts):
+    buf, size = [], 0
+    try:
+        for part in parts:
+            buf.append(part)
+            size += len(part)
+            if size >= STREAM_CHUNK:
+                yield "".join(buf)
+                buf, size = [], 0
+        if buf:
+            yield "".join(buf)
+    finally:
+        # stops the row generator if the client went away early
+        parts.close()
+
+
+def _ndjson(rows, tail):
+    for row in rows:
+        yield _dumps(row) + "\n"
+    extra = tail() if tail else {}
+    if any(v is not None for v in extra.values()):
+        yield _dumps(extra) + "\n"
+
+
+def _json(key, rows, tail):
+    yield '{"status":"ok",' + _dumps(key) + ":["
+    sep = ""
+    for row in rows:
+        yield sep + _dumps(row)
+        sep = ","
+    yield "]"
+    for k, v in (tail() if tail else {}).items():
+        yield "," + _dumps(k) + ":" + _dumps(v)
+    yield "}"
@@ -0,0 +1,144 @@
+import hmac, json, os, time, socket, hashlib, secrets
+
+CONTROL_HOST = os.getenv("TCP_CONTROL_HOST", "127.0.0.1")
+CONTROL_PORT = int(os.getenv("TCP_CONTROL_PORT", "8002"))
+
+# Every datagram on the control channel and the event feed starts with an
+# HMAC-SHA256 of its body under a key the API and the TCP server share, so
+# another local user cannot queue wakeups or read transfer state. The key
+# is TCP_CONTROL_SECRET or, when that is unset, a random one kept in an
+# owner-only file next to the database (created by whichever side needs
+# it first).
+CONTROL_SECRET = os.getenv("TCP_CONTROL_SECRET", "")
+CONTROL_KEY_FILE = os.getenv(
+    "TCP_CONTROL_KEY_FILE",
+    os.path.join(
+        os.path.dirname(os.getenv("DATA_DB_PATH", "data/data.db")), "control.key"
+    ),
+)
+# a datagram stamped further than this from our clock is dropped, so one
+# seen on the wire cannot be replayed later
+MAX_SKEW = 30.0
+_TAG_SIZE = hashlib.sha256().digest_size
+_key = None
+
+
+def load_key(path):
+    """The key stored at path, creating it (mode 0600) if there is none."""
+    try:
+        with open(path, "rb") as f:
+            key = f.read()
+        if key:
+            return key
+    except FileNotFoundError:
+        pass
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(secrets.token_hex(32).encode())
+    try:
+        # the first process to link its key wins; the others read that one
+        os.link(tmp, path)
+    except FileExistsError:
+        pass
+    finally:
+        os.unlink(tmp)
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def control_key():
+    global _key
+    if _key is None:
+        _key = CONTROL_SECRET.encode() if CONTROL_SECRET else load_key(CONTROL_KEY_FILE)
+    return _key
+
+
+def seal(message, key=None):
+    """Datagram carrying message, timestamped and signed."""
+    body = json.dumps({**message, "ts": time.time()}).encode()
+    return hmac.new(key or control_key(), body, hashlib.sha256).digest() + body
+
+
+def unseal(raw, key=None):
+    """The message in a datagram from seal(); None if forged, stale or garbled."""
+    tag, body = raw[:_TAG_SIZE], raw[_TAG_SIZE:]
+    expected = hmac.new(key or control_key(), body, hashlib.sha256).digest()
+    if not hmac.compare_digest(tag, expected):
+        return None
+    try:
+        message = json.loads(body)
+    except ValueError:
+        return None
+    if not isinstance(message, dict):
+        return None
+    ts = message.pop("ts", None)
+    if not isinstance(ts, (int, float)) or abs(time.time() - ts) > MAX_SKEW:
+        return None
+    return message
+
+
+def send_control(message):
+    """Fire-and-forget datagram to the TCP server's control channel.
+
+    Never raises: if the TCP server is down the connection's slow fallback
+    poll will pick the change up anyway.
+    """
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.sendto(seal(message), (CONTROL_HOST, CONTROL_PORT))
+    except OSError:
+        pass
+
+
+def notify_action(client_id):
+    send_control({"type": "action", "client_id": client_id})
+
+
+def query_control(message, timeout=0.2):
+    """Request/reply over the control channel; None if the server is silent."""
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.settimeout(timeout)
+            s.sendto(seal(message), (CONTROL_HOST, CONTROL_PORT))
+            raw, _ = s.recvfrom(65535)
+            return unseal(raw)
+    except OSError:
+        return None
+
+
+def live_progress():
+    """{file_id: bytes received} for uploads in flight on the TCP server."""
+    reply = query_control({"type": "progress"})
+    if not reply:
+        return {}
+    return {int(k): v for k, v in reply.get("files", {}).items()}
+
+
+def tls_stats():
+    """Full vs resumed TLS handshakes on the TCP server; None if it is down."""
+    return query_control({"type": "tls"})
+
+
+def accept_stats():
+    """Accept rate and handshake outcomes on the TCP server; None if it is down."""
+    return query_control({"type": "accept"})
+
+
+def auth_stats():
+    """Credential cache hits and misses on the TCP server; None if it is down."""
+    return query_control({"type": "auth"})
+
+
+def liveness_stats():
+    """Heartbeat tracker counters on the TCP server; None if it is down."""
+    return query_control({"type": "liveness"})
+
+
+def live_online(client_ids):
+    """Which of client_ids the TCP server sees online; None if it is down."""
+    reply = query_control({"type": "liveness", "clients": list(client_ids)})
+    if reply is None:
+        return None
+    return set(reply.get("online", []))